@@ -0,0 +1,122 @@
+""" Helpers shared by the benchmark scripts. """
+
+import json
+import logging
+import os
+import sys
+from statistics import mean
+from time import perf_counter_ns
+from types import ModuleType
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_userbot(**config):
+    """ Makes the userbot package importable without running its
+        __init__.py, which needs Telegram credentials and connects the bot.
+        Config values such as DB_URI become attributes of the package. """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.WARNING,
+    )
+    package = ModuleType("userbot")
+    package.__path__ = [os.path.join(ROOT, "userbot")]
+    package.LOGS = logging.getLogger("userbot")
+    for name, value in config.items():
+        setattr(package, name, value)
+    sys.modules["userbot"] = package
+    return package
+
+
+def load_package(name):
+    """ Makes a subpackage such as userbot.utils importable without running
+        its __init__.py, whose imports need a browser and API keys. Call
+        load_userbot() first. """
+    package = ModuleType(f"userbot.{name}")
+    package.__path__ = [os.path.join(ROOT, "userbot", *name.split("."))]
+    sys.modules[package.__name__] = package
+    return package
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(name, samples, **extra):
+    """ Returns a result row for samples, a list of latencies in ns. """
+    total = sum(samples)
+    row = {
+        "name": name,
+        "ops": len(samples),
+        "mean_us": mean(samples) / 1000,
+        "p50_us": percentile(samples, 0.50) / 1000,
+        "p99_us": percentile(samples, 0.99) / 1000,
+        "ops_per_s": len(samples) / (total / 1e9) if total else float("inf"),
+    }
+    row.update(extra)
+    return row
+
+
+def measure(name, func, args_list, **extra):
+    """ Calls func(*args) for each args in args_list, timing every call. """
+    samples = []
+    for args in args_list:
+        start = perf_counter_ns()
+        func(*args)
+        samples.append(perf_counter_ns() - start)
+    return summarize(name, samples, **extra)
+
+
+def measure_once(name, func, *args, **extra):
+    """ Times a single call, e.g. a cold load, as one sample. """
+    start = perf_counter_ns()
+    func(*args)
+    return summarize(name, [perf_counter_ns() - start], **extra)
+
+
+def measure_batch(name, items, func, *args, **extra):
+    """ Times a single call that handles items rows or writes at once, and
+        reports it per item. """
+    start = perf_counter_ns()
+    func(*args)
+    elapsed = perf_counter_ns() - start
+    row = {
+        "name": name,
+        "ops": items,
+        "mean_us": elapsed / items / 1000,
+        "ops_per_s": items / (elapsed / 1e9),
+    }
+    row.update(extra)
+    return row
+
+
+def emit(row):
+    """ Prints a result row as a JSON line, for the parent process. """
+    print(json.dumps(row), flush=True)
+
+
+def print_table(rows, columns):
+    """ Prints rows as a plain text table with the given (key, title)
+        columns. """
+    table = [[title for _, title in columns]]
+    for row in rows:
+        cells = []
+        for key, _ in columns:
+            value = row.get(key, "")
+            if isinstance(value, float):
+                value = f"{value:,.1f}"
+            elif isinstance(value, int):
+                value = f"{value:,}"
+            cells.append(str(value))
+        table.append(cells)
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for index, line in enumerate(table):
+        print("  ".join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(line, widths))
+        ))
+        if index == 0:
+            print("  ".join("-" * width for width in widths))
@@ -0,0 +1,267 @@
+""" Benchmarks the parallel transfers of userbot.utils.FastTelethon.
+
+Runs download_file and upload_file against an in-process stand-in for
+Telegram, so no account or network is needed. MTProtoSender is replaced
+by a sender that only pretends to connect, and client._call answers
+GetFileRequest and SaveFilePartRequest after the simulated latency and
+transfer time, with optional jitter and FloodWait errors. Reports the
+throughput, CPU time and peak memory of every transfer.
+
+    python benchmarks/fasttelethon_bench.py
+    python benchmarks/fasttelethon_bench.py --sizes 8 256 --connections 0 4 16
+    python benchmarks/fasttelethon_bench.py --latency 0.2 --flood-rate 0.001
+
+Connection count 0 lets the connection tuner pick, as in the bot, any
+other count is kept for the whole transfer. Every transfer runs in a
+process of its own, so the peak memory of one does not hide another's.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from random import Random
+from types import SimpleNamespace
+
+from common import emit, load_package, load_userbot, print_table
+
+SIZES = (1, 32, 256)
+CONNECTIONS = (0, 1, 4, 8, 16)
+DIRECTIONS = ("download", "upload")
+DC_ID = 2
+MIB = 1024 * 1024
+
+
+class Network:
+    """ The simulated link to Telegram. Every request waits the latency,
+        give or take jitter, then its payload goes through a connection of
+        conn_bandwidth bytes/s and a shared link of link_bandwidth bytes/s,
+        whichever is slower. """
+
+    def __init__(self, args, rng):
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.conn_bandwidth = args.conn_bandwidth * MIB
+        self.link_bandwidth = args.link_bandwidth * MIB
+        self.flood_rate = args.flood_rate
+        self.flood_seconds = args.flood_seconds
+        self.rng = rng
+        self.link_free_at = 0.0
+        self.requests = 0
+        self.floods = 0
+
+    def flooded(self):
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.floods += 1
+            return True
+        return False
+
+    async def transfer(self, size):
+        self.requests += 1
+        now = time.monotonic()
+        latency = self.latency * (1 + self.jitter * self.rng.uniform(-1, 1))
+        start = max(now, self.link_free_at)
+        self.link_free_at = start + size / self.link_bandwidth
+        done = max(now + latency + size / self.conn_bandwidth,
+                   self.link_free_at)
+        await asyncio.sleep(done - now)
+
+
+class FakeSender:
+    """ Takes the place of MTProtoSender, connecting takes one round trip. """
+
+    network = None
+
+    def __init__(self, auth_key, loggers=None):
+        self.auth_key = auth_key
+        self.connected = False
+
+    async def connect(self, connection):
+        await self.network.transfer(0)
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        self.connected = False
+
+
+class FakeClient:
+    """ Just what FastTelethon uses of TelegramClient. """
+
+    def __init__(self, ft, network, loop):
+        self.ft = ft
+        self.network = network
+        self.loop = loop
+        self.session = SimpleNamespace(dc_id=DC_ID, auth_key=None)
+        self._log = None
+        self._proxy = None
+        # Sliced parts of a full-size block are the block itself, so
+        # answering costs no copy.
+        self.block = bytes(512 * 1024)
+
+    async def _get_dc(self, dc_id):
+        return SimpleNamespace(ip_address="127.0.0.1", port=443, id=dc_id)
+
+    def _connection(self, *args, **kwargs):
+        return None
+
+    async def _call(self, sender, request):
+        if self.network.flooded():
+            await self.network.transfer(0)
+            raise self.ft.FloodWaitError(request, self.network.flood_seconds)
+        if isinstance(request, self.ft.GetFileRequest):
+            size = min(request.limit, self.size - request.offset)
+            await self.network.transfer(size)
+            if size == len(self.block):
+                return SimpleNamespace(bytes=self.block)
+            return SimpleNamespace(bytes=self.block[:size])
+        await self.network.transfer(len(request.bytes))
+        return True
+
+
+def document(ft, size):
+    return ft.Document(id=1, access_hash=0, file_reference=b"", date=None,
+                       mime_type="application/octet-stream", size=size,
+                       dc_id=DC_ID, attributes=[])
+
+
+async def transfer(ft, client, direction, size, tmp):
+    path = os.path.join(tmp, f"{direction}.bin")
+    if direction == "download":
+        client.size = size
+        with open(path, "wb") as out:
+            await ft.download_file(client, document(ft, size), out)
+    else:
+        # A sparse file, so reading it costs no disk time.
+        with open(path, "wb") as f:
+            f.truncate(size)
+        with open(path, "rb") as f:
+            await ft.upload_file(client, f, "bench.bin")
+
+
+def run_case(args, direction, size_mib, connections):
+    load_userbot()
+    load_package("utils")
+    from userbot.utils import FastTelethon as ft
+
+    size = size_mib * MIB
+    if connections:
+        ft.TUNED_CONNECTIONS[(DC_ID, direction)] = connections
+        ft.ConnectionTuner.interval = float("inf")
+        ft.ConnectionTuner.warmup_parts = float("inf")
+    network = Network(args, Random(args.seed))
+    FakeSender.network = network
+    ft.MTProtoSender = FakeSender
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = FakeClient(ft, network, loop)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_before = time.process_time()
+    start = time.perf_counter()
+    error = ""
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            loop.run_until_complete(transfer(ft, client, direction, size, tmp))
+        except Exception as e:
+            error = type(e).__name__
+    seconds = time.perf_counter() - start
+    cpu = time.process_time() - cpu_before
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if connections:
+        label = connections
+    else:
+        # The tuner only remembers transfers long enough to be sampled.
+        tuned = ft.TUNED_CONNECTIONS.get((DC_ID, direction))
+        label = f"auto ({tuned})" if tuned else "auto"
+    emit({
+        "name": f"{direction} {size_mib} MiB",
+        "connections": label,
+        "seconds": seconds,
+        "mib_per_s": size_mib / seconds,
+        "cpu_s": cpu,
+        "cpu_pct": cpu / seconds * 100,
+        # ru_maxrss is in KiB on Linux.
+        "peak_mib": rss_after / 1024,
+        "growth_mib": (rss_after - rss_before) / 1024,
+        "requests": network.requests,
+        "floods": network.floods,
+        "error": error,
+    })
+
+
+def run_worker(args, direction, size_mib, connections):
+    """ Runs one transfer in a child process and returns its result row. """
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--directions", direction, "--sizes", str(size_mib),
+        "--connections", str(connections),
+    ]
+    for option in ("latency", "jitter", "conn_bandwidth", "link_bandwidth",
+                   "flood_rate", "flood_seconds", "seed"):
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return [json.loads(line) for line in output.splitlines()
+            if line.startswith("{")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directions", nargs="+", choices=DIRECTIONS,
+                        default=DIRECTIONS)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="file sizes in MiB")
+    parser.add_argument("--connections", type=int, nargs="+",
+                        default=CONNECTIONS,
+                        help="connection counts, 0 lets the tuner decide")
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="round trip of a request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2,
+                        help="latency varies by up to this fraction")
+    parser.add_argument("--conn-bandwidth", type=float, default=2.0,
+                        help="MiB/s of a single connection")
+    parser.add_argument("--link-bandwidth", type=float, default=40.0,
+                        help="MiB/s shared by all connections")
+    parser.add_argument("--flood-rate", type=float, default=0.0,
+                        help="chance of a request getting a FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+                        help="print raw result rows as JSON lines")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_case(args, args.directions[0], args.sizes[0], args.connections[0])
+        return
+
+    rows = []
+    for direction in args.directions:
+        for size in args.sizes:
+            for connections in args.connections:
+                for row in run_worker(args, direction, size, connections):
+                    if args.json:
+                        print(json.dumps(row), flush=True)
+                    rows.append(row)
+    if args.json:
+        return
+    columns = (
+        ("name", "transfer"), ("connections", "connections"),
+        ("seconds", "seconds"), ("mib_per_s", "MiB/s"), ("cpu_pct", "CPU %"),
+        ("peak_mib", "peak MiB"), ("requests", "requests"),
+        ("floods", "floods"), ("error", "error"),
+    )
+    print_table(rows, columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+""" Benchmarks the sql_helper accessors that run for incoming messages.
+
+Seeds the filters, gmute, muted, pmpermit, globals and welcome tables
+with each of the given row counts and reports the latency and throughput
+of their hot-path accessors, cold and cached, and of the writers.
+
+    python benchmarks/sql_helper_bench.py
+    python benchmarks/sql_helper_bench.py --sizes 100 10000 --ops 5000
+    python benchmarks/sql_helper_bench.py --db-url postgresql://localhost/bench
+
+Every size runs in a process of its own, since sql_helper binds its engine
+on import. Without --db-url a fresh SQLite file is used for each size.
+With --db-url the rows of the benchmarked tables are DELETED first, so
+never point it at the bot's own database.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from random import Random
+
+from common import (
+    emit,
+    load_userbot,
+    measure,
+    measure_batch,
+    measure_once,
+    print_table,
+)
+
+SIZES = (100, 10_000, 1_000_000)
+FILTERS_PER_CHAT = 100
+MUTED_PER_CHAT = 1000
+USER_BASE = 10 ** 9
+CHAT_BASE = 10 ** 12
+WORDS = ("hello", "there", "how", "are", "you", "doing", "today", "the",
+         "bot", "group", "message", "thanks", "ok", "lol", "see", "later")
+
+
+def insert_rows(engine, table, rows, chunk=50_000):
+    with engine.begin() as conn:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+
+
+def filter_chat(index):
+    return -(CHAT_BASE + index)
+
+
+def seed(tables, engine, size):
+    chats = max(1, size // FILTERS_PER_CHAT)
+    muted_chats = max(1, size // MUTED_PER_CHAT)
+    seeds = {
+        "filters": ({
+            "chat_id": filter_chat(i % chats),
+            "keyword": f"kw{i // chats}",
+            "reply": f"reply {i}",
+            "f_mesg_id": None,
+        } for i in range(size)),
+        "gmute": ({"sender": USER_BASE + i} for i in range(size)),
+        "muted": ({
+            "chat_id": filter_chat(i % muted_chats),
+            "sender": USER_BASE + i,
+        } for i in range(size)),
+        "pmpermit": ({"chat_id": USER_BASE + i} for i in range(size)),
+        "globals": ({
+            "variable": f"var{i}",
+            "value": f"value{i}",
+        } for i in range(size)),
+        "welcome": ({
+            "chat_id": filter_chat(i),
+            "previous_welcome": None,
+            "reply": "Welcome {mention}",
+            "f_mesg_id": None,
+        } for i in range(size)),
+    }
+    for name, rows in seeds.items():
+        emit(measure_batch(f"seed {name}", size, insert_rows, engine,
+                           tables[name], rows))
+
+
+def message(rng, keywords):
+    words = [rng.choice(WORDS) for _ in range(12)]
+    if keywords and rng.random() < 0.5:
+        words[rng.randrange(len(words))] = rng.choice(keywords)
+    return " ".join(words)
+
+
+def bench_filters(filter_sql, sql_helper, rng, size, ops):
+    chats = max(1, size // FILTERS_PER_CHAT)
+    keywords = [f"kw{i}" for i in range(min(FILTERS_PER_CHAT, size))]
+    sample = [filter_chat(i) for i in rng.sample(range(chats), min(ops, chats))]
+
+    filter_sql.FILTERS_INDEX.invalidate()
+    filter_sql.MATCHERS.invalidate()
+    emit(measure("match_filters (cold chat)", filter_sql.match_filters,
+                 [(chat, message(rng, keywords)) for chat in sample]))
+    emit(measure("match_filters (warm)", filter_sql.match_filters,
+                 [(rng.choice(sample), message(rng, keywords))
+                  for _ in range(ops)]))
+    emit(measure("get_filters", filter_sql.get_filters,
+                 [(rng.choice(sample),) for _ in range(ops)]))
+    emit(measure("add_filter (queued)", filter_sql.add_filter,
+                 [(rng.choice(sample), f"new{i}", "reply", None)
+                  for i in range(ops)]))
+    emit(measure_batch("flush_writes (filters)", ops,
+                       sql_helper.flush_writes))
+
+
+def bench_gmute(gmute_sql, rng, size, ops):
+    gmute_sql.GMUTED = None
+    emit(measure_once("is_gmuted (set load)", gmute_sql.is_gmuted, USER_BASE,
+                      rows=size))
+    emit(measure("is_gmuted", gmute_sql.is_gmuted,
+                 [(USER_BASE + rng.randrange(2 * size),) for _ in range(ops)]))
+    writes = min(ops, 200)
+    emit(measure("gmute", gmute_sql.gmute,
+                 [(USER_BASE + size + i,) for i in range(writes)]))
+
+
+def bench_muted(spam_mute_sql, rng, size, ops):
+    muted_chats = max(1, size // MUTED_PER_CHAT)
+    spam_mute_sql.MUTED = None
+    emit(measure_once("is_muted (set load)", spam_mute_sql.is_muted,
+                      filter_chat(0), USER_BASE, rows=size))
+    emit(measure("is_muted", spam_mute_sql.is_muted,
+                 [(filter_chat(rng.randrange(muted_chats)),
+                   USER_BASE + rng.randrange(2 * size)) for _ in range(ops)]))
+    writes = min(ops, 200)
+    emit(measure("mute", spam_mute_sql.mute,
+                 [(filter_chat(0), USER_BASE + size + i)
+                  for i in range(writes)]))
+
+
+def cold_keys(rng, size, ops):
+    return rng.sample(range(size), min(ops, size))
+
+
+def hot_keys(rng, keys, ops):
+    return [rng.choice(keys[:100]) for _ in range(ops)]
+
+
+def bench_pmpermit(pm_permit_sql, sql_helper, rng, size, ops):
+    sql_helper.invalidate("pmpermit")
+    keys = [(USER_BASE + i,) for i in cold_keys(rng, size, ops)]
+    emit(measure("is_approved (uncached)", pm_permit_sql.is_approved, keys))
+    emit(measure("is_approved (cached)", pm_permit_sql.is_approved,
+                 hot_keys(rng, keys, ops)))
+    emit(measure("is_approved (stranger)", pm_permit_sql.is_approved,
+                 [(USER_BASE + size + i,) for i in range(ops)]))
+
+
+def bench_globals(gvars, sql_helper, rng, size, ops):
+    sql_helper.invalidate("globals")
+    keys = [(f"var{i}",) for i in cold_keys(rng, size, ops)]
+    emit(measure("gvarstatus (uncached)", gvars.gvarstatus, keys))
+    emit(measure("gvarstatus (cached)", gvars.gvarstatus,
+                 hot_keys(rng, keys, ops)))
+    emit(measure("addgvar (queued)", gvars.addgvar,
+                 [(f"var{rng.randrange(size)}", "changed") for _ in range(ops)]))
+    emit(measure_batch("flush_writes (globals)", ops,
+                       sql_helper.flush_writes))
+
+
+def bench_welcome(welcome_sql, sql_helper, rng, size, ops):
+    sql_helper.invalidate("welcome")
+    keys = [(filter_chat(i),) for i in cold_keys(rng, size, ops)]
+    emit(measure("get_current_welcome_settings (uncached)",
+                 welcome_sql.get_current_welcome_settings, keys))
+    emit(measure("get_current_welcome_settings (cached)",
+                 welcome_sql.get_current_welcome_settings,
+                 hot_keys(rng, keys, ops)))
+    emit(measure("update_previous_welcome (queued)",
+                 welcome_sql.update_previous_welcome,
+                 [(chat, i) for i, (chat,) in enumerate(keys)]))
+    emit(measure_batch("flush_writes (welcome)", len(keys),
+                       sql_helper.flush_writes))
+
+
+def run_size(db_url, size, ops, seed_value):
+    load_userbot(DB_URI=db_url)
+    from userbot.modules import sql_helper
+    from userbot.modules.sql_helper import (
+        filter_sql,
+        globals as gvars,
+        gmute_sql,
+        pm_permit_sql,
+        spam_mute_sql,
+        welcome_sql,
+    )
+
+    tables = {
+        "filters": filter_sql.Filters.__table__,
+        "gmute": gmute_sql.GMute.__table__,
+        "muted": spam_mute_sql.Mute.__table__,
+        "pmpermit": pm_permit_sql.PMPermit.__table__,
+        "globals": gvars.Globals.__table__,
+        "welcome": welcome_sql.Welcome.__table__,
+    }
+    engine = sql_helper.BASE.metadata.bind
+    with engine.begin() as conn:
+        for table in tables.values():
+            conn.execute(table.delete())
+    seed(tables, engine, size)
+
+    rng = Random(seed_value)
+    bench_filters(filter_sql, sql_helper, rng, size, ops)
+    bench_gmute(gmute_sql, rng, size, ops)
+    bench_muted(spam_mute_sql, rng, size, ops)
+    bench_pmpermit(pm_permit_sql, sql_helper, rng, size, ops)
+    bench_globals(gvars, sql_helper, rng, size, ops)
+    bench_welcome(welcome_sql, sql_helper, rng, size, ops)
+
+
+def run_worker(db_url, size, ops, seed_value):
+    """ Runs one size in a child process and returns its result rows. """
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--worker", "--db-url", db_url, "--sizes", str(size),
+        "--ops", str(ops), "--seed", str(seed_value),
+    ]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    return [json.loads(line) for line in output.splitlines()
+            if line.startswith("{")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", help="database to benchmark against "
+                        "(its benchmarked tables are emptied)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="rows seeded into every table")
+    parser.add_argument("--ops", type=int, default=2000,
+                        help="calls timed per accessor")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+                        help="print raw result rows as JSON lines")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_size(args.db_url, args.sizes[0], args.ops, args.seed)
+        return
+
+    columns = (
+        ("name", "benchmark"), ("ops", "ops"), ("mean_us", "mean µs"),
+        ("p50_us", "p50 µs"), ("p99_us", "p99 µs"), ("ops_per_s", "ops/s"),
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            db_url = args.db_url or f"sqlite:///{tmp}/bench-{size}.db"
+            rows = run_worker(db_url, size, args.ops, args.seed)
+            if args.json:
+                for row in rows:
+                    print(json.dumps(dict(row, size=size)))
+                continue
+            print(f"\n{size:,} rows per table")
+            print_table(rows, columns)
+
+
+if __name__ == "__main__":
+    main()
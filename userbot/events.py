@@ -6,9 +6,11 @@
 """ Userbot module for managing events.
  One of the main components of the userbot. """
 
+import inspect
 import sys
 from asyncio import create_subprocess_shell as asyncsubshell
 from asyncio import subprocess as asyncsub
+from operator import itemgetter
 from time import gmtime, strftime
 from traceback import format_exc
 
@@ -16,6 +18,191 @@ from telethon import events
 
 from userbot import LOGSPAMMER, bot
 
+QUANTIFIERS = "?*+{"
+
+
+def _next_atom(pattern, index):
+    """ Returns (literal, end) for the regex atom starting at index.
+        literal is None when the atom doesn't match one fixed character. """
+    char = pattern[index]
+    if char == "\\":
+        escaped = pattern[index + 1:index + 2]
+        if not escaped or escaped.isalnum():
+            return None, index + 2
+        return escaped, index + 2
+    if char == "[":
+        end = index + 1
+        if pattern[end:end + 1] == "^":
+            end += 1
+        if pattern[end:end + 1] == "]":
+            end += 1
+        while end < len(pattern) and pattern[end] != "]":
+            end += 2 if pattern[end] == "\\" else 1
+        return None, end + 1
+    if char in ".()|^$" or char in QUANTIFIERS:
+        return None, index + 1
+    return char, index + 1
+
+
+def _has_top_level_alternation(pattern):
+    """ Whether the pattern is an alternation of several branches. """
+    depth = index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char in "\\[":
+            index = _next_atom(pattern, index)[1]
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return True
+        index += 1
+    return False
+
+
+def literal_prefix(pattern):
+    """ Returns the lowercased literal text every match of the pattern has
+        right after its first character, e.g. "filter " for `^\\.filter (.*)`.
+        An empty string means the pattern can't be indexed. """
+    if not isinstance(pattern, str):
+        return ""
+    if pattern.startswith("(?i)"):
+        pattern = pattern[4:]
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    if not pattern or pattern[0] in "()" or _has_top_level_alternation(pattern):
+        return ""
+
+    # The first character is the command trigger, which is often a class
+    # such as the unsafe pattern, so it is skipped rather than indexed.
+    index = _next_atom(pattern, 0)[1]
+    if pattern[index:index + 1] in tuple(QUANTIFIERS):
+        return ""
+
+    prefix = ""
+    while index < len(pattern):
+        literal, end = _next_atom(pattern, index)
+        if literal is None:
+            break
+        quantifier = pattern[end:end + 1]
+        if quantifier and quantifier in QUANTIFIERS:
+            if quantifier == "+":
+                prefix += literal
+            break
+        prefix += literal
+        index = end
+    return prefix.lower()
+
+
+class CommandRouter:
+    """ Dispatches one event type to every handler added through register().
+        Handlers are indexed in a trie by the literal prefix of their pattern,
+        so a message only runs the regexes of the commands it could match. """
+
+    class _Node:
+        __slots__ = ("children", "handlers")
+
+        def __init__(self):
+            self.children = {}
+            self.handlers = []
+
+    def __init__(self, client, event_type):
+        self.client = client
+        self.event_type = event_type
+        self.root = self._Node()
+        self.count = 0
+
+    def add(self, builder, callback):
+        if not self.count:
+            self.client.add_event_handler(self.dispatch, self.event_type())
+        self.count += 1
+
+        node = self.root
+        for char in literal_prefix(builder.pattern_source):
+            node = node.children.setdefault(char, self._Node())
+        node.handlers.append((self.count, builder, callback))
+
+    def candidates(self, text):
+        """ Handlers that may match the text, in registration order. """
+        found = list(self.root.handlers)
+        node = self.root
+        for char in text[1:].lower():
+            node = node.children.get(char)
+            if node is None:
+                break
+            found.extend(node.handlers)
+        found.sort(key=itemgetter(0))
+        return found
+
+    async def dispatch(self, event):
+        for _, builder, callback in self.candidates(event.message.message or ""):
+            if not builder.resolved:
+                await builder.resolve(self.client)
+            matched = builder.filter(event)
+            if inspect.isawaitable(matched):
+                matched = await matched
+            if matched:
+                await callback(event)
+
+
+NEW_MESSAGE_ROUTER = CommandRouter(bot, events.NewMessage)
+MESSAGE_EDITED_ROUTER = CommandRouter(bot, events.MessageEdited)
+
+
+async def report_error(check):
+    """ Writes the traceback of the exception being handled to error.log. """
+    date = strftime("%Y-%m-%d %H:%M:%S", gmtime())
+
+    text = "**WeebProject ERROR**\n"
+    link = "Silahkan chat: @PacarFerdilla"
+    text += "Untuk melaporkan kesalahan"
+    text += f"- tinggal teruskan pesan ini {link}.\n"
+    text += "Apis Siap Membantu Kamu\n"
+
+    ftext = "========== DISCLAIMER =========="
+    ftext += "\nThis file uploaded ONLY here,"
+    ftext += "\nwe logged only fact of error and date,"
+    ftext += "\nwe respect your privacy,"
+    ftext += "\nyou may not report this error if you've"
+    ftext += "\nany confidential data here, no one will see your data\n"
+    ftext += "================================\n\n"
+    ftext += "--------BEGIN USERBOT TRACEBACK LOG--------\n"
+    ftext += "\nDate: " + date
+    ftext += "\nChat ID: " + str(check.chat_id)
+    ftext += "\nSender ID: " + str(check.sender_id)
+    ftext += "\n\nEvent Trigger:\n"
+    ftext += str(check.text)
+    ftext += "\n\nTraceback info:\n"
+    ftext += str(format_exc())
+    ftext += "\n\nError text:\n"
+    ftext += str(sys.exc_info()[1])
+    ftext += "\n\n--------END USERBOT TRACEBACK LOG--------"
+
+    command = "git log --pretty=format:\"%an: %s\" -10"
+
+    ftext += "\n\n\nLast 10 commits:\n"
+
+    process = await asyncsubshell(command,
+                                  stdout=asyncsub.PIPE,
+                                  stderr=asyncsub.PIPE)
+    stdout, stderr = await process.communicate()
+    result = str(stdout.decode().strip()) \
+        + str(stderr.decode().strip())
+
+    ftext += result
+
+    file = open("error.log", "w+")
+    file.write(ftext)
+    file.close()
+
+
+def _make_builder(event_type, args):
+    builder = event_type(**args)
+    builder.pattern_source = args.get('pattern', None)
+    return builder
+
 
 def register(**args):
     """ Register a new event. """
@@ -94,55 +281,98 @@ def register(**args):
                 # with a dumb except.
 
                 if not disable_errors:
-                    date = strftime("%Y-%m-%d %H:%M:%S", gmtime())
-
-                    text = "**WeebProject ERROR**\n"
-                    link = "Silahkan chat: @PacarFerdilla"
-                    text += "Untuk melaporkan kesalahan"
-                    text += f"- tinggal teruskan pesan ini {link}.\n"
-                    text += "Apis Siap Membantu Kamu\n"
-
-                    ftext = "========== DISCLAIMER =========="
-                    ftext += "\nThis file uploaded ONLY here,"
-                    ftext += "\nwe logged only fact of error and date,"
-                    ftext += "\nwe respect your privacy,"
-                    ftext += "\nyou may not report this error if you've"
-                    ftext += "\nany confidential data here, no one will see your data\n"
-                    ftext += "================================\n\n"
-                    ftext += "--------BEGIN USERBOT TRACEBACK LOG--------\n"
-                    ftext += "\nDate: " + date
-                    ftext += "\nChat ID: " + str(check.chat_id)
-                    ftext += "\nSender ID: " + str(check.sender_id)
-                    ftext += "\n\nEvent Trigger:\n"
-                    ftext += str(check.text)
-                    ftext += "\n\nTraceback info:\n"
-                    ftext += str(format_exc())
-                    ftext += "\n\nError text:\n"
-                    ftext += str(sys.exc_info()[1])
-                    ftext += "\n\n--------END USERBOT TRACEBACK LOG--------"
-
-                    command = "git log --pretty=format:\"%an: %s\" -10"
-
-                    ftext += "\n\n\nLast 10 commits:\n"
-
-                    process = await asyncsubshell(command,
-                                                  stdout=asyncsub.PIPE,
-                                                  stderr=asyncsub.PIPE)
-                    stdout, stderr = await process.communicate()
-                    result = str(stdout.decode().strip()) \
-                        + str(stderr.decode().strip())
-
-                    ftext += result
-
-                    file = open("error.log", "w+")
-                    file.write(ftext)
-                    file.close()
+                    await report_error(check)
 
             else:
                 pass
 
         if not disable_edited:
-            bot.add_event_handler(wrapper, events.MessageEdited(**args))
-        bot.add_event_handler(wrapper, events.NewMessage(**args))
+            MESSAGE_EDITED_ROUTER.add(
+                _make_builder(events.MessageEdited, args), wrapper)
+        NEW_MESSAGE_ROUTER.add(_make_builder(events.NewMessage, args), wrapper)
         return wrapper
     return decorator
+
+
+class IncomingContext:
+    """ Data shared by every stage of the incoming pipeline for one event.
+        Everything is resolved on first use, so a message that no stage
+        cares about costs no round trip at all. """
+
+    self_id = None
+    _UNSET = object()
+
+    def __init__(self, event):
+        self.event = event
+        self._sender = self._UNSET
+        self._chat = self._UNSET
+        self._settings = {}
+
+    async def get_sender(self):
+        if self._sender is self._UNSET:
+            self._sender = await self.event.get_sender()
+        return self._sender
+
+    async def is_bot(self):
+        sender = await self.get_sender()
+        return bool(getattr(sender, "bot", False))
+
+    async def get_chat(self):
+        if self._chat is self._UNSET:
+            self._chat = await self.event.get_chat()
+        return self._chat
+
+    async def get_self_id(self):
+        # Our own id never changes, so it is fetched once per process.
+        if IncomingContext.self_id is None:
+            IncomingContext.self_id = (await self.event.client.get_me()).id
+        return IncomingContext.self_id
+
+    async def setting(self, key, loader, *args):
+        """ Returns loader(*args), awaited if needed and called at most once
+            per event. """
+        if key not in self._settings:
+            value = loader(*args)
+            if inspect.isawaitable(value):
+                value = await value
+            self._settings[key] = value
+        return self._settings[key]
+
+
+INCOMING_STAGES = []
+
+
+async def _run_incoming_stages(event):
+    edited = isinstance(event, events.MessageEdited.Event)
+    context = IncomingContext(event)
+    for _, func, disable_edited, disable_errors, guard in INCOMING_STAGES:
+        if edited and disable_edited:
+            continue
+        if guard is not None and not guard(event):
+            continue
+        try:
+            await func(event, context)
+        except events.StopPropagation:
+            raise
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            if not disable_errors:
+                await report_error(event)
+
+
+def incoming_stage(order, guard=None, disable_edited=False,
+                   disable_errors=False):
+    """ Register a stage of the incoming message pipeline.
+        Every incoming message goes through a single handler that runs the
+        stages by ascending order, handing each one the event and a shared
+        IncomingContext. guard is a cheap synchronous check on the event;
+        the stage is skipped without awaiting anything when it fails. """
+    def decorator(func):
+        if not INCOMING_STAGES:
+            register(incoming=True, disable_errors=True)(_run_incoming_stages)
+        INCOMING_STAGES.append(
+            (order, func, disable_edited, disable_errors, guard))
+        INCOMING_STAGES.sort(key=itemgetter(0))
+        return func
+    return decorator
@@ -35,7 +35,7 @@ from telethon.tl.types import (
 )
 
 from userbot import BOTLOG, BOTLOG_CHATID, CMD_HELP, bot
-from userbot.events import register
+from userbot.events import incoming_stage, register
 
 # =================== CONSTANT ===================
 PP_TOO_SMOL = "`The image is too small`"
@@ -316,6 +316,7 @@ async def spider(spdr):
     """
     # Check if the function running under SQL mode
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.spam_mute_sql import mute
     except AttributeError:
         return await spdr.edit(NO_SQL)
@@ -344,7 +345,7 @@ async def spider(spdr):
 
     # If everything goes well, do announcing and mute
     await spdr.edit("`Gets a tape!`")
-    if mute(spdr.chat_id, user.id) is False:
+    if await run_sql(mute, spdr.chat_id, user.id) is False:
         return await spdr.edit("`Error! User probably already muted.`")
     else:
         try:
@@ -384,6 +385,7 @@ async def unmoot(unmot):
 
     # Check if the function running under SQL mode
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.spam_mute_sql import unmute
     except AttributeError:
         return await unmot.edit(NO_SQL)
@@ -397,7 +399,7 @@ async def unmoot(unmot):
     else:
         return
 
-    if unmute(unmot.chat_id, user.id) is False:
+    if await run_sql(unmute, unmot.chat_id, user.id) is False:
         return await unmot.edit("`Error! User probably already unmuted.`")
     else:
 
@@ -418,16 +420,33 @@ async def unmoot(unmot):
             )
 
 
-@register(incoming=True, disable_errors=True)
-async def muter(moot):
+@incoming_stage(10, disable_errors=True)
+async def muter(moot, context):
     """Used for deleting the messages of muted people"""
     try:
-        from userbot.modules.sql_helper.gmute_sql import is_gmuted
-        from userbot.modules.sql_helper.spam_mute_sql import is_muted
+        from userbot.modules.sql_helper import run_sql
+        from userbot.modules.sql_helper.gmute_sql import is_gmuted, is_gmuted_cached
+        from userbot.modules.sql_helper.spam_mute_sql import (
+            is_muted,
+            is_muted_cached,
+        )
     except AttributeError:
         return
-    muted = is_muted(moot.chat_id)
-    gmuted = is_gmuted(moot.sender_id)
+    # Anonymous admins and channel posts have no sender to mute.
+    if moot.sender_id is None:
+        return
+    # Only loading the mutes needs the database thread, once they are in
+    # memory every message is checked right here.
+    muted = is_muted_cached(moot.chat_id, moot.sender_id)
+    if muted is None:
+        muted = await run_sql(is_muted, moot.chat_id, moot.sender_id)
+    if not muted:
+        gmuted = is_gmuted_cached(moot.sender_id)
+        if gmuted is None:
+            gmuted = await run_sql(is_gmuted, moot.sender_id)
+        if gmuted:
+            await moot.delete()
+        return
     rights = ChatBannedRights(
         until_date=None,
         send_messages=True,
@@ -438,24 +457,16 @@ async def muter(moot):
         send_inline=True,
         embed_links=True,
     )
-    if muted:
-        for i in muted:
-            if str(i.sender) == str(moot.sender_id):
-                try:
-                    await moot.delete()
-                    await moot.client(
-                        EditBannedRequest(moot.chat_id, moot.sender_id, rights)
-                    )
-                except (
-                    BadRequestError,
-                    UserAdminInvalidError,
-                    ChatAdminRequiredError,
-                    UserIdInvalidError,
-                ):
-                    await moot.client.send_read_acknowledge(moot.chat_id, moot.id)
-    for i in gmuted:
-        if i.sender == str(moot.sender_id):
-            await moot.delete()
+    try:
+        await moot.delete()
+        await moot.client(EditBannedRequest(moot.chat_id, moot.sender_id, rights))
+    except (
+        BadRequestError,
+        UserAdminInvalidError,
+        ChatAdminRequiredError,
+        UserIdInvalidError,
+    ):
+        await moot.client.send_read_acknowledge(moot.chat_id, moot.id)
 
 
 @register(outgoing=True, disable_errors=True, pattern=r"^\.ungmute(?: |$)(.*)")
@@ -473,6 +484,7 @@ async def ungmoot(un_gmute):
 
     # Check if the function running under SQL mode
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.gmute_sql import ungmute
     except AttributeError:
         await un_gmute.edit(NO_SQL)
@@ -486,7 +498,7 @@ async def ungmoot(un_gmute):
     # If pass, inform and start ungmuting
     await un_gmute.edit("```Ungmuting...```")
 
-    if ungmute(user.id) is False:
+    if await run_sql(ungmute, user.id) is False:
         await un_gmute.edit("`Error! User probably not gmuted.`")
     else:
         # Inform about success
@@ -518,6 +530,7 @@ async def gspider(gspdr):
 
     # Check if the function running under SQL mode
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.gmute_sql import gmute
     except AttributeError:
         await gspdr.edit(NO_SQL)
@@ -529,7 +542,7 @@ async def gspider(gspdr):
 
     # If pass, inform and start gmuting
     await gspdr.edit("`Grabs a huge, sticky duct tape!`")
-    if gmute(user.id) is False:
+    if await run_sql(gmute, user.id) is False:
         await gspdr.edit("`Error! User probably already gmuted.\nRe-rolls the tape.`")
     else:
         if reason:
@@ -10,7 +10,7 @@ from random import randint
 
 from telethon.events import StopPropagation
 
-from userbot.events import register
+from userbot.events import incoming_stage, register
 
 from userbot import (  # noqa pylint: disable=unused-import isort:skip
     AFKREASON,
@@ -24,8 +24,12 @@ from userbot import (  # noqa pylint: disable=unused-import isort:skip
 )
 
 
-@register(incoming=True, disable_edited=True)
-async def mention_afk(mention):
+@incoming_stage(
+    20,
+    guard=lambda mention: ISAFK and mention.message.mentioned,
+    disable_edited=True,
+)
+async def mention_afk(mention, context):
     """This function takes care of notifying the people who mention you that you are AFK."""
     global COUNT_MSG
     global USERS
@@ -63,13 +67,10 @@ async def mention_afk(mention):
         else:
             afk_str = f"`{int(seconds)}s` ago"
 
-        is_bot = False
-        if sender := await mention.get_sender():
-            is_bot = sender.bot
-            if is_bot:
-                return  # ignore bot
+        if await context.is_bot():
+            return  # ignore bot
 
-        chat_obj = await mention.client.get_entity(mention.chat_id)
+        chat_obj = await context.get_chat()
         chat_title = chat_obj.title
 
         if mention.sender_id not in USERS or chat_title not in USERS:
@@ -106,8 +107,12 @@ async def mention_afk(mention):
         COUNT_MSG += 1
 
 
-@register(incoming=True, disable_errors=True)
-async def afk_on_pm(sender):
+@incoming_stage(
+    25,
+    guard=lambda sender: ISAFK and sender.is_private,
+    disable_errors=True,
+)
+async def afk_on_pm(sender, context):
     """Function which informs people that you are AFK in PM"""
     global ISAFK
     global USERS
@@ -121,13 +126,16 @@ async def afk_on_pm(sender):
     if (
         sender.is_private
         and sender.sender_id != 777000
-        and not (await sender.get_sender()).bot
+        and not await context.is_bot()
     ):
         if PM_AUTO_BAN:
             try:
+                from userbot.modules.sql_helper import run_sql
                 from userbot.modules.sql_helper.pm_permit_sql import is_approved
 
-                apprv = is_approved(sender.sender_id)
+                apprv = await context.setting(
+                    "pm_approved", run_sql, is_approved, sender.sender_id
+                )
             except AttributeError:
                 apprv = True
         else:
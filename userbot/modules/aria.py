@@ -3,7 +3,6 @@
 # Licensed under the Raphielscape Public License, Version 1.c (the "License");
 # you may not use this file except in compliance with the License.
 
-import math
 import os
 from asyncio import sleep
 from subprocess import PIPE, Popen
@@ -13,7 +12,16 @@ from requests import get
 
 from userbot import CMD_HELP, LOGS, TEMP_DOWNLOAD_DIRECTORY
 from userbot.events import register
-from userbot.utils import humanbytes
+from userbot.utils import (
+    as_job,
+    check_cancelled,
+    finish_report,
+    humanbytes,
+    progress_bar,
+    report,
+    update_job,
+)
+from userbot.utils.exceptions import CancelProcess
 
 
 def subprocess_run(cmd):
@@ -58,6 +66,7 @@ aria2.set_global_options({"dir": download_path})
 
 
 @register(outgoing=True, pattern=r"^\.amag(?: |$)(.*)")
+@as_job("aria")
 async def magnet_download(event):
     magnet_uri = event.pattern_match.group(1)
     # Add Magnet URI Into Queue
@@ -74,6 +83,7 @@ async def magnet_download(event):
 
 
 @register(outgoing=True, pattern=r"^\.ator(?: |$)(.*)")
+@as_job("aria")
 async def torrent_download(event):
     torrent_file_path = event.pattern_match.group(1)
     # Add Torrent Into Queue
@@ -88,6 +98,7 @@ async def torrent_download(event):
 
 
 @register(outgoing=True, pattern=r"^\.aurl(?: |$)(.*)")
+@as_job("aria")
 async def aurl_download(event):
     uri = [event.pattern_match.group(1)]
     try:  # Add URL Into Queue
@@ -191,15 +202,18 @@ async def check_progress_for_dl(gid, event, previous):
     complete = None
     while not complete:
         file = aria2.get_download(gid)
+        try:
+            check_cancelled()
+        except CancelProcess:
+            file.remove(force=True)
+            raise
         complete = file.is_complete
         try:
             if not complete and not file.error_message:
                 percentage = int(file.progress)
                 downloaded = percentage * int(file.total_length) / 100
-                prog_str = "`Downloading` | [{0}{1}] `{2}`".format(
-                    "".join(["●" for i in range(math.floor(percentage / 10))]),
-                    "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-                    file.progress_string(),
+                prog_str = "`Downloading` | [{0}] `{1}`".format(
+                    progress_bar(percentage), file.progress_string()
                 )
                 msg = (
                     f"`Name`: `{file.name}`\n"
@@ -209,23 +223,26 @@ async def check_progress_for_dl(gid, event, previous):
                     f" @ {file.download_speed_string()}`\n"
                     f"`ETA` -> {file.eta_string()}\n"
                 )
-                if msg != previous:
-                    await event.edit(msg)
-                    msg = previous
+                report(event, msg)
+                update_job(downloaded, int(file.total_length))
             else:
-                await event.edit(f"`{msg}`")
+                report(event, f"`{msg}`")
             await sleep(5)
             await check_progress_for_dl(gid, event, previous)
             file = aria2.get_download(gid)
             complete = file.is_complete
             if complete:
-                return await event.edit(
+                return await finish_report(
+                    event,
                     f"`Name`: `{file.name}`\n"
                     f"`Size`: `{file.total_length_string()}`\n"
                     f"`Path`: `{TEMP_DOWNLOAD_DIRECTORY + file.name}`\n"
                     "`Resp`: **OK** - Successfully downloaded..."
                 )
+        except CancelProcess:
+            raise
         except Exception as e:
+            await finish_report(event)
             if " not found" in str(e) or "'file'" in str(e):
                 await event.edit("Download Canceled :\n`{}`".format(file.name))
                 await sleep(2.5)
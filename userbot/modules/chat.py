@@ -23,7 +23,7 @@ from telethon.tl.types import ChannelParticipantsAdmins, MessageActionChannelMig
 from telethon.utils import get_input_location
 
 from userbot import BOTLOG, BOTLOG_CHATID, CMD_HELP, bot
-from userbot.events import register
+from userbot.events import incoming_stage, register
 from userbot.modules.admin import get_user_from_event
 
 
@@ -409,10 +409,11 @@ async def kickme(leave):
 async def unmute_chat(unm_e):
     """For .unmutechat command, unmute a muted chat."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.keep_read_sql import unkread
     except AttributeError:
         return await unm_e.edit("`Running on Non-SQL Mode!`")
-    unkread(str(unm_e.chat_id))
+    await run_sql(unkread, str(unm_e.chat_id))
     await unm_e.edit("```Unmuted this chat Successfully```")
     await sleep(2)
     await unm_e.delete()
@@ -422,11 +423,12 @@ async def unmute_chat(unm_e):
 async def mute_chat(mute_e):
     """For .mutechat command, mute any chat."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.keep_read_sql import kread
     except AttributeError:
         return await mute_e.edit("`Running on Non-SQL mode!`")
     await mute_e.edit(str(mute_e.chat_id))
-    kread(str(mute_e.chat_id))
+    await run_sql(kread, str(mute_e.chat_id))
     await mute_e.edit("`Shush! This chat will be silenced!`")
     await sleep(2)
     await mute_e.delete()
@@ -436,17 +438,18 @@ async def mute_chat(mute_e):
         )
 
 
-@register(incoming=True, disable_errors=True)
-async def keep_read(message):
+@incoming_stage(30, disable_errors=True)
+async def keep_read(message, context):
     """The mute logic."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.keep_read_sql import is_kread
     except AttributeError:
         return
-    kread = is_kread()
+    kread = await context.setting("kread", run_sql, is_kread)
     if kread:
         for i in kread:
-            if i.groupid == str(message.chat_id):
+            if i.groupid == message.chat_id:
                 await message.client.send_read_acknowledge(message.chat_id)
 
 
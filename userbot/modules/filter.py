@@ -6,35 +6,42 @@
 """ Userbot module for filter commands """
 
 from asyncio import sleep
-from re import IGNORECASE, escape, search
 
 from userbot import BOTLOG, BOTLOG_CHATID, CMD_HELP
-from userbot.events import register
+from userbot.events import incoming_stage, register
 
 
-@register(incoming=True, disable_edited=True, disable_errors=True)
-async def filter_incoming_handler(handler):
+@incoming_stage(
+    40,
+    guard=lambda handler: bool(handler.raw_text),
+    disable_edited=True,
+    disable_errors=True,
+)
+async def filter_incoming_handler(handler, context):
     """Checks if the incoming message contains handler of a filter"""
     try:
-        if not (await handler.get_sender()).bot:
+        if not await context.is_bot():
             try:
-                from userbot.modules.sql_helper.filter_sql import get_filters
+                from userbot.modules.sql_helper import run_sql
+                from userbot.modules.sql_helper.filter_sql import (
+                    match_cached_filters,
+                    match_filters,
+                )
             except AttributeError:
                 await handler.edit("`Running on Non-SQL mode!`")
                 return
             name = handler.raw_text
-            filters = get_filters(handler.chat_id)
-            if not filters:
-                return
-            for trigger in filters:
-                pattern = r"( |^|[^\w])" + escape(trigger.keyword) + r"( |$|[^\w])"
-                pro = search(pattern, name, flags=IGNORECASE)
-                if pro and trigger.f_mesg_id:
+            # The database thread is only needed to load the chat's filters.
+            triggers = match_cached_filters(handler.chat_id, name)
+            if triggers is None:
+                triggers = await run_sql(match_filters, handler.chat_id, name)
+            for trigger in triggers:
+                if trigger.f_mesg_id:
                     msg_o = await handler.client.get_messages(
                         entity=BOTLOG_CHATID, ids=int(trigger.f_mesg_id)
                     )
                     await handler.reply(msg_o.message, file=msg_o.media)
-                elif pro and trigger.reply:
+                elif trigger.reply:
                     await handler.reply(trigger.reply)
     except AttributeError:
         pass
@@ -44,6 +51,7 @@ async def filter_incoming_handler(handler):
 async def add_new_filter(new_handler):
     """For .filter command, allows adding new filters in a chat"""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.filter_sql import add_filter
     except AttributeError:
         await new_handler.edit("`Running on Non-SQL mode!`")
@@ -79,7 +87,10 @@ async def add_new_filter(new_handler):
         rep_msg = await new_handler.get_reply_message()
         string = rep_msg.text
     success = "`Filter`  **{}**  `{} successfully`."
-    if add_filter(str(new_handler.chat_id), keyword, string, msg_id) is True:
+    if (
+        await run_sql(add_filter, str(new_handler.chat_id), keyword, string, msg_id)
+        is True
+    ):
         await new_handler.edit(success.format(keyword, "added"))
     else:
         await new_handler.edit(success.format(keyword, "updated"))
@@ -89,11 +100,12 @@ async def add_new_filter(new_handler):
 async def remove_a_filter(r_handler):
     """For .stop command, allows you to remove a filter from a chat."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.filter_sql import remove_filter
     except AttributeError:
         return await r_handler.edit("`Running on Non-SQL mode!`")
     filt = r_handler.pattern_match.group(1)
-    if not remove_filter(r_handler.chat_id, filt):
+    if not await run_sql(remove_filter, r_handler.chat_id, filt):
         await r_handler.edit("`Filter`  **{}**  `doesn't exist`.".format(filt))
     else:
         await r_handler.edit(
@@ -131,11 +143,12 @@ async def kick_marie_filter(event):
 async def filters_active(event):
     """For .filters command, lists all of the active filters in a chat."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.filter_sql import get_filters
     except AttributeError:
         return await event.edit("`Running on Non-SQL mode!`")
     transact = "`There are no filters in this chat.`"
-    filters = get_filters(event.chat_id)
+    filters = await run_sql(get_filters, event.chat_id)
     for filt in filters:
         if transact == "`There are no filters in this chat.`":
             transact = "Active filters in this chat:\n"
@@ -81,8 +81,8 @@ async def _(event):
             client=event.client,
             file=f,
             name=loa,
-            progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-                progress(d, t, event, c_time, "[UPLOAD]", loa)
+            progress_callback=lambda d, t: progress(
+                d, t, event, c_time, "[UPLOAD]", loa
             ),
         )
     await event.client.send_file(
@@ -140,8 +140,8 @@ async def _(event):
                 client=event.client,
                 file=f,
                 name=loa,
-                progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-                    progress(d, t, event, c_time, "[UPLOAD]", loa)
+                progress_callback=lambda d, t: progress(
+                    d, t, event, c_time, "[UPLOAD]", loa
                 ),
             )
         await event.client.send_file(
@@ -448,8 +448,8 @@ async def upload_track(track_location, message):
             client=message.client,
             file=f,
             name=track_location,
-            progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-                progress(d, t, message, c_time, "[UPLOAD]", track_location)
+            progress_callback=lambda d, t: progress(
+                d, t, message, c_time, "[UPLOAD]", track_location
             ),
         )
     await message.client.send_file(
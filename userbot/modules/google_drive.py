@@ -18,14 +18,18 @@
 """ - ProjectBish Google Drive managers - """
 import asyncio
 import base64
+import contextvars
 import io
 import json
 import logging
-import math
 import os
 import pickle
+import random
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from mimetypes import guess_type
 from os.path import getctime, isdir, isfile, join
 from urllib.parse import quote
@@ -33,11 +37,18 @@ from urllib.parse import quote
 import requests
 from bs4 import BeautifulSoup
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import (
+    MediaFileUpload,
+    MediaIoBaseDownload,
+    MediaUpload,
+    build_http,
+)
 from telethon import events
+from telethon.utils import get_input_location
 
 from userbot.modules.sql_helper import google_drive_sql as helper
 from userbot import (
@@ -53,8 +64,21 @@ from userbot import (
 )
 from userbot.events import register
 from userbot.modules.aria import aria2, check_metadata
-from userbot.utils import human_to_bytes, humanbytes, progress, time_formatter
+from userbot.utils import (
+    as_job,
+    check_cancelled,
+    finish_report,
+    human_to_bytes,
+    humanbytes,
+    progress,
+    progress_bar,
+    report,
+    time_formatter,
+    update_job,
+)
 from userbot.utils.exceptions import CancelProcess
+from userbot.utils.jobs import JOBS
+from userbot.utils.FastTelethon import ParallelTransferrer
 
 # =========================================================== #
 #                          STATIC                             #
@@ -67,6 +91,19 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive.metadata",
 ]
 REDIRECT_URI = "urn:ietf:wg:oauth:2.0:oob"
+# Drive takes resumable uploads in multiples of 256 KiB. A relayed file
+# never holds more than one chunk plus the buffered Telegram parts.
+RELAY_CHUNK_SIZE = 32 * 256 * 1024
+RELAY_BUFFER_PARTS = 16
+# Drive calls block on HTTP, so they run on these threads and the event loop
+# only awaits them. Shared link downloads are read this much at a time.
+DRIVE_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Drive allows a user about 1000 requests per 100 seconds, .gcl keeps its
+# requests under that and backs off when Drive says otherwise.
+CLONE_RATE = 10
+CLONE_BURST = 20
+CLONE_RETRIES = 6
 # =========================================================== #
 #      STATIC CASE FOR G_DRIVE_FOLDER_ID IF VALUE IS URL      #
 # =========================================================== #
@@ -104,11 +141,83 @@ if __ is not None:
                     else:
                         LOGS.info("G_DRIVE_FOLDER_ID " "not a valid URL...")
                         G_DRIVE_FOLDER_ID = None
+# Folder set by .gdfset, it takes the place of G_DRIVE_FOLDER_ID.
+upload_folder_Id = None
+
+
+def default_parent():
+    """- Folder set by .gdfset, else G_DRIVE_FOLDER_ID, else root (None) -"""
+    return upload_folder_Id or G_DRIVE_FOLDER_ID
+
+
 # =========================================================== #
 #                           LOG                               #
 # =========================================================== #
 logger = logging.getLogger("googleapiclient.discovery")
 logger.setLevel(logging.ERROR)
+# =========================================================== #
+#                        EXECUTOR                             #
+# =========================================================== #
+DRIVE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DRIVE_WORKERS, thread_name_prefix="gdrive"
+)
+_drive_local = threading.local()
+
+
+def _run_checked(func):
+    check_cancelled()
+    return func()
+
+
+async def run_drive(func, *args, **kwargs):
+    """- Await func(*args, **kwargs) run on the Drive threads -
+
+    The call runs in the caller's context, so a call of a cancelled job
+    that is still waiting for a free thread gives up instead of sending.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_event_loop().run_in_executor(
+        DRIVE_EXECUTOR, context.run, _run_checked, partial(func, *args, **kwargs)
+    )
+
+
+def thread_http(request):
+    """- This thread's own connection, authorized like request -
+
+    httplib2 connections must not be shared between threads, so every
+    Drive thread keeps one of its own, reused by every call it runs.
+    """
+    http = getattr(_drive_local, "http", None)
+    if http is None:
+        http = _drive_local.http = build_http()
+    return AuthorizedHttp(request.http.credentials, http=http)
+
+
+def _next_chunk(request, downloader=None):
+    if downloader is None:
+        return request.next_chunk(http=thread_http(request))
+    """- MediaIoBaseDownload always goes through request.http -"""
+    request.http = thread_http(request)
+    return downloader.next_chunk()
+
+
+async def execute(request):
+    """- Run a Drive API request off the event loop -"""
+    return await run_drive(lambda: request.execute(http=thread_http(request)))
+
+
+async def next_chunk(request, downloader=None):
+    """- Send or fetch the next chunk of a media request off the loop -"""
+    return await run_drive(_next_chunk, request, downloader)
+
+
+def read_chunk(chunks, out):
+    """- Write the next chunk of a streamed response, its size or 0 -"""
+    chunk = next(chunks, b"")
+    out.write(chunk)
+    return len(chunk)
+
+
 # =========================================================== #
 #                                                             #
 # =========================================================== #
@@ -164,7 +273,7 @@ async def generate_credentials(gdrive):
         r = conv.wait_event(events.NewMessage(outgoing=True, chats=BOTLOG_CHATID))
         r = await r
         code = r.message.message.strip()
-        flow.fetch_token(code=code)
+        await run_drive(flow.fetch_token, code=code)
         creds = flow.credentials
         await asyncio.sleep(3.5)
         await gdrive.client.delete_messages(gdrive.chat_id, msg.id)
@@ -187,14 +296,16 @@ async def create_app(gdrive):
         if creds and creds.expired and creds.refresh_token:
             await gdrive.edit("`Refreshing credentials...`")
             """ - Refresh credentials - """
-            creds.refresh(Request())
+            await run_drive(creds.refresh, Request())
             helper.save_credentials(
                 str(gdrive.sender_id), base64.b64encode(pickle.dumps(creds)).decode()
             )
         else:
             await gdrive.edit("`Credentials is empty, please generate it...`")
             return False
-    service = build("drive", "v3", credentials=creds, cache_discovery=False)
+    service = await run_drive(
+        build, "drive", "v3", credentials=creds, cache_discovery=False
+    )
     return service
 
 
@@ -223,7 +334,6 @@ async def get_mimeType(name):
 
 
 async def download(gdrive, service, uri=None):
-    global is_cancelled
     reply = ""
     """ - Download files to local then upload - """
     if not isdir(TEMP_DOWNLOAD_DIRECTORY):
@@ -250,24 +360,38 @@ async def download(gdrive, service, uri=None):
         except Exception:
             required_file_name = TEMP_DOWNLOAD_DIRECTORY + filename
     else:
+        replied = await gdrive.get_reply_message()
+        if replied.document:
+            """ - Documents go straight to GDrive, never to disk - """
+            try:
+                size, downloadURL, file_name = await relay(gdrive, service, replied)
+            except CancelProcess:
+                reply += (
+                    "`[FILE - CANCELLED]`\n\n"
+                    "`Status` : **OK** - received signal cancelled."
+                )
+                return reply
+            reply += f"**GDrive Upload**\n\n📄 [{file_name}]({downloadURL})"
+            if G_DRIVE_INDEX_URL:
+                index_url = G_DRIVE_INDEX_URL.rstrip("/") + "/" + quote(file_name)
+                reply += f"\n👥 [Index URL]({index_url})"
+            reply += f"\n__Size : {humanbytes(size)}__"
+            return reply
         try:
             current_time = time.time()
-            is_cancelled = False
             downloaded_file_name = await gdrive.client.download_media(
-                await gdrive.get_reply_message(),
+                replied,
                 TEMP_DOWNLOAD_DIRECTORY,
-                progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-                    progress(
-                        d,
-                        t,
-                        gdrive,
-                        current_time,
-                        "[FILE - DOWNLOAD]",
-                        is_cancelled=is_cancelled,
-                    )
+                progress_callback=lambda d, t: progress(
+                    d,
+                    t,
+                    gdrive,
+                    current_time,
+                    "[FILE - DOWNLOAD]",
                 ),
             )
         except CancelProcess:
+            await finish_report(gdrive)
             names = []
             for name in os.listdir(TEMP_DOWNLOAD_DIRECTORY):
                 names.append(join(TEMP_DOWNLOAD_DIRECTORY, name))
@@ -307,23 +431,18 @@ async def download(gdrive, service, uri=None):
                 reply += f"\n__Size : {humanbytes(result[0])}__"
                 return reply
         else:
-            global parent_Id
-            folder = await create_dir(service, file_name)
-            parent_Id = folder.get("id")
-            webViewURL = "https://drive.google.com/drive/folders/" + parent_Id
             try:
-                await task_directory(gdrive, service, required_file_name)
+                folder_Id, folder_size = await upload_dir(
+                    gdrive, service, required_file_name
+                )
             except CancelProcess:
                 reply += (
                     "`[FOLDER - CANCELLED]`\n\n"
                     "`Status` : **OK** - received signal cancelled."
                 )
-                await reset_parentId()
                 return reply
-            except Exception:
-                await reset_parentId()
             else:
-                folder_size = await count_dir_size(service, parent_Id)
+                webViewURL = "https://drive.google.com/drive/folders/" + folder_Id
                 reply += f"**GDrive Upload**\n\n📁 [{file_name}]({webViewURL})"
                 if G_DRIVE_INDEX_URL:
                     index_url = (
@@ -331,7 +450,6 @@ async def download(gdrive, service, uri=None):
                     )
                     reply += f"\n👥 [Index URL]({index_url})"
                 reply += f"\n__Size : {humanbytes(folder_size)}__"
-                await reset_parentId()
                 return reply
     except Exception as e:
         reply += f"`[ERROR]`\n\n" "`Status` : **failed**\n" f"`Reason` : `{str(e)}`\n\n"
@@ -341,7 +459,6 @@ async def download(gdrive, service, uri=None):
 
 async def download_gdrive(gdrive, service, uri):
     reply = ""
-    global is_cancelled
     """ - remove drivesdk and export=download from link - """
     if not isdir(TEMP_DOWNLOAD_DIRECTORY):
         os.mkdir(TEMP_DOWNLOAD_DIRECTORY)
@@ -374,12 +491,13 @@ async def download_gdrive(gdrive, service, uri):
             url = f"{drive}/uc?export=download&id={file_Id}"
 
             session = requests.session()
-            download = session.get(url, stream=True)
+            download = await run_drive(session.get, url, stream=True)
 
             try:
                 download.headers["Content-Disposition"]
             except KeyError:
-                page = BeautifulSoup(download.content, "lxml")
+                content = await run_drive(getattr, download, "content")
+                page = BeautifulSoup(content, "lxml")
                 try:
                     export = drive + page.find("a", {"id": "uc-download-link"}).get(
                         "href"
@@ -404,7 +522,7 @@ async def download_gdrive(gdrive, service, uri):
                             f"`Reason` : {error}"
                         )
                     return reply
-                download = session.get(export, stream=True)
+                download = await run_drive(session.get, export, stream=True)
                 file_size = human_to_bytes(
                     page.find("span", {"class": "uc-name-size"})
                     .text.split()[-1]
@@ -418,48 +536,34 @@ async def download_gdrive(gdrive, service, uri):
             ).group(1)
             file_path = TEMP_DOWNLOAD_DIRECTORY + file_name
             with io.FileIO(file_path, "wb") as files:
-                CHUNK_SIZE = None
+                chunks = download.iter_content(DOWNLOAD_CHUNK_SIZE)
                 current_time = time.time()
-                display_message = None
-                first = True
-                is_cancelled = False
-                for chunk in download.iter_content(CHUNK_SIZE):
-                    if is_cancelled is True:
-                        raise CancelProcess
-
-                    if not chunk:
+                downloaded = 0
+                while True:
+                    check_cancelled()
+
+                    size = await run_drive(read_chunk, chunks, files)
+                    if not size:
                         break
 
                     diff = time.time() - current_time
-                    if first is True:
-                        downloaded = len(chunk)
-                        first = False
-                    else:
-                        downloaded += len(chunk)
+                    downloaded += size
                     percentage = downloaded / file_size * 100
                     speed = round(downloaded / diff, 2)
                     eta = round((file_size - downloaded) / speed)
-                    prog_str = "`Downloading` | [{0}{1}] `{2}%`".format(
-                        "".join(["●" for i in range(math.floor(percentage / 10))]),
-                        "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-                        round(percentage, 2),
+                    prog_str = "`Downloading` | [{0}] `{1}%`".format(
+                        progress_bar(percentage), round(percentage, 2)
                     )
-                    current_message = (
+                    report(
+                        gdrive,
                         "`[FILE - DOWNLOAD]`\n\n"
                         f"`{file_name}`\n"
                         f"`Status`\n{prog_str}\n"
                         f"`{humanbytes(downloaded)} of {humanbytes(file_size)}"
                         f" @ {humanbytes(speed)}`\n"
-                        f"`ETA` -> {time_formatter(eta)}"
+                        f"`ETA` -> {time_formatter(eta)}",
                     )
-                    if (
-                        round(diff % 15.00) == 0
-                        and (display_message != current_message)
-                        or (downloaded == file_size)
-                    ):
-                        await gdrive.edit(current_message)
-                        display_message = current_message
-                    files.write(chunk)
+                    update_job(downloaded, file_size)
     else:
         file_name = file.get("name")
         mimeType = file.get("mimeType")
@@ -471,14 +575,11 @@ async def download_gdrive(gdrive, service, uri):
         with io.FileIO(file_path, "wb") as df:
             downloader = MediaIoBaseDownload(df, request)
             complete = False
-            is_cancelled = False
             current_time = time.time()
-            display_message = None
             while complete is False:
-                if is_cancelled is True:
-                    raise CancelProcess
+                check_cancelled()
 
-                status, complete = downloader.next_chunk()
+                status, complete = await next_chunk(request, downloader)
                 if status:
                     file_size = status.total_size
                     diff = time.time() - current_time
@@ -486,26 +587,20 @@ async def download_gdrive(gdrive, service, uri):
                     percentage = downloaded / file_size * 100
                     speed = round(downloaded / diff, 2)
                     eta = round((file_size - downloaded) / speed)
-                    prog_str = "`Downloading` | [{0}{1}] `{2}%`".format(
-                        "".join(["●" for i in range(math.floor(percentage / 10))]),
-                        "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-                        round(percentage, 2),
+                    prog_str = "`Downloading` | [{0}] `{1}%`".format(
+                        progress_bar(percentage), round(percentage, 2)
                     )
-                    current_message = (
+                    report(
+                        gdrive,
                         "`[FILE - DOWNLOAD]`\n\n"
                         f"`{file_name}`\n"
                         f"`Status`\n{prog_str}\n"
                         f"`{humanbytes(downloaded)} of {humanbytes(file_size)}"
                         f" @ {humanbytes(speed)}`\n"
-                        f"`ETA` -> {time_formatter(eta)}"
+                        f"`ETA` -> {time_formatter(eta)}",
                     )
-                    if (
-                        round(diff % 15.00) == 0
-                        and (display_message != current_message)
-                        or (downloaded == file_size)
-                    ):
-                        await gdrive.edit(current_message)
-                        display_message = current_message
+                    update_job(downloaded, file_size)
+    await finish_report(gdrive)
     await gdrive.edit(
         "`[FILE - DOWNLOAD]`\n\n"
         f"`Name   :` `{file_name}`\n"
@@ -555,7 +650,7 @@ async def download_gdrive(gdrive, service, uri):
 async def change_permission(service, Id):
     permission = {"role": "reader", "type": "anyone"}
     try:
-        service.permissions().create(fileId=Id, body=permission).execute()
+        await execute(service.permissions().create(fileId=Id, body=permission))
     except HttpError as e:
         """it's not possible to change permission per file for teamdrive"""
         if f'"File not found: {Id}."' in str(e) or (
@@ -569,7 +664,7 @@ async def change_permission(service, Id):
 
 
 async def get_information(service, Id):
-    r = (
+    r = await execute(
         service.files()
         .get(
             fileId=Id,
@@ -578,54 +673,42 @@ async def get_information(service, Id):
             "description",
             supportsAllDrives=True,
         )
-        .execute()
     )
     return r
 
 
-async def create_dir(service, folder_name):
+async def create_dir(service, folder_name, parent_Id=None):
     metadata = {
         "name": folder_name,
         "mimeType": "application/vnd.google-apps.folder",
     }
-    try:
-        if parent_Id is not None:
-            pass
-    except NameError:
-        """- Fallback to G_DRIVE_FOLDER_ID else root dir -"""
-        if G_DRIVE_FOLDER_ID is not None:
-            metadata["parents"] = [G_DRIVE_FOLDER_ID]
-    else:
-        """- Override G_DRIVE_FOLDER_ID because parent_Id not empty -"""
+    parent_Id = parent_Id or default_parent()
+    if parent_Id is not None:
         metadata["parents"] = [parent_Id]
-    folder = (
+    folder = await execute(
         service.files()
         .create(body=metadata, fields="id, webViewLink", supportsAllDrives=True)
-        .execute()
     )
     await change_permission(service, folder.get("id"))
     return folder
 
 
-async def upload(gdrive, service, file_path, file_name, mimeType):
-    try:
-        await gdrive.edit("`Processing upload...`")
-    except Exception:
-        pass
+async def upload(
+    gdrive, service, file_path, file_name, mimeType, parent_Id=None, quiet=False
+):
+    """- Upload a local file into parent_Id, quiet leaves the status alone -"""
+    if not quiet:
+        try:
+            await gdrive.edit("`Processing upload...`")
+        except Exception:
+            pass
     body = {
         "name": file_name,
         "description": "Uploaded from Telegram using ProjectBish userbot.",
         "mimeType": mimeType,
     }
-    try:
-        if parent_Id is not None:
-            pass
-    except NameError:
-        """- Fallback to G_DRIVE_FOLDER_ID else root dir -"""
-        if G_DRIVE_FOLDER_ID is not None:
-            body["parents"] = [G_DRIVE_FOLDER_ID]
-    else:
-        """- Override G_DRIVE_FOLDER_ID because parent_Id not empty -"""
+    parent_Id = parent_Id or default_parent()
+    if parent_Id is not None:
         body["parents"] = [parent_Id]
     media_body = MediaFileUpload(file_path, mimetype=mimeType, resumable=True)
     """ - Start upload process - """
@@ -635,43 +718,36 @@ async def upload(gdrive, service, file_path, file_name, mimeType):
         fields="id, size, webContentLink",
         supportsAllDrives=True,
     )
-    global is_cancelled
     current_time = time.time()
     response = None
-    display_message = None
-    is_cancelled = False
-    while response is None:
-        if is_cancelled is True:
-            raise CancelProcess
-
-        status, response = file.next_chunk()
-        if status:
-            file_size = status.total_size
-            diff = time.time() - current_time
-            uploaded = status.resumable_progress
-            percentage = uploaded / file_size * 100
-            speed = round(uploaded / diff, 2)
-            eta = round((file_size - uploaded) / speed)
-            prog_str = "`Uploading` | [{0}{1}] `{2}%`".format(
-                "".join(["●" for i in range(math.floor(percentage / 10))]),
-                "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-                round(percentage, 2),
-            )
-            current_message = (
-                "`[FILE - UPLOAD]`\n\n"
-                f"`{file_name}`\n"
-                f"`Status`\n{prog_str}\n"
-                f"`{humanbytes(uploaded)} of {humanbytes(file_size)} "
-                f"@ {humanbytes(speed)}`\n"
-                f"`ETA` -> {time_formatter(eta)}"
-            )
-            if (
-                round(diff % 15.00) == 0
-                and (display_message != current_message)
-                or (uploaded == file_size)
-            ):
-                await gdrive.edit(current_message)
-                display_message = current_message
+    try:
+        while response is None:
+            check_cancelled()
+
+            status, response = await next_chunk(file)
+            if status and not quiet:
+                file_size = status.total_size
+                diff = time.time() - current_time
+                uploaded = status.resumable_progress
+                percentage = uploaded / file_size * 100
+                speed = round(uploaded / diff, 2)
+                eta = round((file_size - uploaded) / speed)
+                prog_str = "`Uploading` | [{0}] `{1}%`".format(
+                    progress_bar(percentage), round(percentage, 2)
+                )
+                report(
+                    gdrive,
+                    "`[FILE - UPLOAD]`\n\n"
+                    f"`{file_name}`\n"
+                    f"`Status`\n{prog_str}\n"
+                    f"`{humanbytes(uploaded)} of {humanbytes(file_size)} "
+                    f"@ {humanbytes(speed)}`\n"
+                    f"`ETA` -> {time_formatter(eta)}",
+                )
+                update_job(uploaded, file_size)
+    finally:
+        if not quiet:
+            await finish_report(gdrive)
     file_id = response.get("id")
     file_size = response.get("size")
     downloadURL = response.get("webContentLink")
@@ -680,42 +756,230 @@ async def upload(gdrive, service, file_path, file_name, mimeType):
     return int(file_size), downloadURL
 
 
-async def task_directory(gdrive, service, folder_path):
-    global parent_Id
-    global is_cancelled
-    is_cancelled = False
-    lists = os.listdir(folder_path)
-    if len(lists) == 0:
-        return parent_Id
-    root_parent_Id = None
-    for f in lists:
-        if is_cancelled is True:
-            raise CancelProcess
-
-        current_f_name = join(folder_path, f)
-        if isdir(current_f_name):
-            folder = await create_dir(service, f)
-            parent_Id = folder.get("id")
-            root_parent_Id = await task_directory(gdrive, service, current_f_name)
+class TelegramMediaUpload(MediaUpload):
+    """- Resumable upload body read from a Telegram download as it goes -
+
+    Drive asks for the file chunk by chunk from the thread running
+    next_chunk(), which blocks in read() until the event loop has fed
+    enough parts into the bounded buffer. Only the chunk Drive may still
+    ask for again is kept, so memory stays flat whatever the file size.
+    """
+
+    def __init__(self, loop, buffer, size, mimeType, chunksize):
+        self._loop = loop
+        self._buffer = buffer
+        self._size = size
+        self._mimetype = mimeType
+        self._chunksize = chunksize
+        self._data = bytearray()
+        self._start = 0
+        self._eof = False
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def _read(self):
+        part = asyncio.run_coroutine_threadsafe(
+            self._buffer.get(), self._loop
+        ).result()
+        if isinstance(part, Exception):
+            raise part
+        if part is None:
+            self._eof = True
         else:
-            file_name = await get_raw_name(current_f_name)
-            mimeType = await get_mimeType(current_f_name)
-            await upload(gdrive, service, current_f_name, file_name, mimeType)
-            root_parent_Id = parent_Id
-    return root_parent_Id
+            self._data.extend(part)
+
+    def getbytes(self, begin, length):
+        """- Drive confirmed everything before begin, drop it -"""
+        del self._data[: begin - self._start]
+        self._start = begin
+        while len(self._data) < length and not self._eof:
+            self._read()
+        return bytes(self._data[:length])
 
 
-async def reset_parentId():
-    global parent_Id
+async def relay(gdrive, service, message):
+    """- Stream a replied Telegram file straight into Drive, no disk -"""
     try:
-        if parent_Id is not None:
-            pass
-    except NameError:
-        if G_DRIVE_FOLDER_ID is not None:
-            parent_Id = G_DRIVE_FOLDER_ID
-    else:
-        del parent_Id
-    return
+        await gdrive.edit("`Processing upload...`")
+    except Exception:
+        pass
+    file_size = message.file.size
+    file_name = message.file.name or f"file_{message.id}{message.file.ext or ''}"
+    mimeType = message.file.mime_type or await get_mimeType(file_name)
+    body = {
+        "name": file_name,
+        "description": "Uploaded from Telegram using ProjectBish userbot.",
+        "mimeType": mimeType,
+    }
+    parent_Id = default_parent()
+    if parent_Id is not None:
+        body["parents"] = [parent_Id]
+    loop = asyncio.get_event_loop()
+    buffer = asyncio.Queue(maxsize=RELAY_BUFFER_PARTS)
+    dc_id, location = get_input_location(message.document)
+    downloader = ParallelTransferrer(gdrive.client, dc_id)
+
+    async def feed():
+        parts = downloader.download(location, file_size)
+        try:
+            async for part in parts:
+                await buffer.put(part)
+        except Exception as e:
+            await buffer.put(e)
+        else:
+            await buffer.put(None)
+        finally:
+            # Hands the connections back to the pool when cancelled.
+            await parts.aclose()
+
+    media_body = TelegramMediaUpload(
+        loop, buffer, file_size, mimeType, RELAY_CHUNK_SIZE
+    )
+    """ - Start upload process - """
+    file = service.files().create(
+        body=body,
+        media_body=media_body,
+        fields="id, size, webContentLink",
+        supportsAllDrives=True,
+    )
+    current_time = time.time()
+    response = None
+    feeder = loop.create_task(feed())
+    try:
+        while response is None:
+            check_cancelled()
+
+            status, response = await next_chunk(file)
+            if status:
+                diff = time.time() - current_time
+                uploaded = status.resumable_progress
+                percentage = uploaded / file_size * 100
+                speed = round(uploaded / diff, 2)
+                eta = round((file_size - uploaded) / speed)
+                prog_str = "`Relaying` | [{0}] `{1}%`".format(
+                    progress_bar(percentage), round(percentage, 2)
+                )
+                report(
+                    gdrive,
+                    "`[FILE - RELAY]`\n\n"
+                    f"`{file_name}`\n"
+                    f"`Status`\n{prog_str}\n"
+                    f"`{humanbytes(uploaded)} of {humanbytes(file_size)} "
+                    f"@ {humanbytes(speed)}`\n"
+                    f"`ETA` -> {time_formatter(eta)}",
+                )
+                update_job(uploaded, file_size)
+    finally:
+        await finish_report(gdrive)
+        feeder.cancel()
+        if not buffer.full():
+            # Wakes up the reading thread if it still waits for a part.
+            buffer.put_nowait(None)
+    file_id = response.get("id")
+    downloadURL = response.get("webContentLink")
+    """ - Change permission - """
+    await change_permission(service, file_id)
+    return int(response.get("size")), downloadURL, file_name
+
+
+async def pool(func, items, workers=DRIVE_WORKERS):
+    """- Await func(item) for every item, at most workers at once -
+
+    Results come back in the order of items. The first error cancels
+    the calls still running, waits for them to unwind and is raised.
+    """
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+
+    async def worker():
+        for index, item in pending:
+            results[index] = await func(item)
+
+    tasks = [
+        asyncio.ensure_future(worker()) for _ in range(min(workers, len(items)))
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+
+async def upload_dir(gdrive, service, folder_path, parent_Id=None):
+    """- Mirror a local folder into Drive, returns its id and size -
+
+    The remote tree is created first, a level at a time, so every file
+    knows the id of its folder before any upload starts. The files then
+    go up DRIVE_WORKERS at once, which hides the per-request latency
+    that dominates folders of many small files.
+    """
+    folder_name = await get_raw_name(folder_path.rstrip("/"))
+    folder = await create_dir(service, folder_name, parent_Id)
+    files = []
+    level = [(folder_path, folder.get("id"))]
+    while level:
+        check_cancelled()
+
+        subdirs = []
+        for path, Id in level:
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                if entry.is_dir():
+                    subdirs.append((entry.path, entry.name, Id))
+                else:
+                    files.append((entry.path, entry.name, entry.stat().st_size, Id))
+        created = await pool(
+            lambda subdir: create_dir(service, subdir[1], subdir[2]), subdirs
+        )
+        level = [
+            (subdir[0], sub.get("id")) for subdir, sub in zip(subdirs, created)
+        ]
+    total_size = sum(file[2] for file in files)
+    done = {"files": 0, "size": 0}
+    current_time = time.time()
+
+    async def upload_one(file):
+        file_path, file_name, file_size, Id = file
+        check_cancelled()
+        mimeType = await get_mimeType(file_path)
+        size, _ = await upload(
+            gdrive, service, file_path, file_name, mimeType, Id, quiet=True
+        )
+        done["files"] += 1
+        done["size"] += file_size
+        percentage = done["size"] / total_size * 100 if total_size else 100
+        speed = done["size"] / (time.time() - current_time)
+        prog_str = "`Uploading` | [{0}] `{1}%`".format(
+            progress_bar(percentage), round(percentage, 2)
+        )
+        report(
+            gdrive,
+            "`[FOLDER - UPLOAD]`\n\n"
+            f"`{folder_name}`\n"
+            f"`Status`\n{prog_str}\n"
+            f"`{done['files']} of {len(files)} files, "
+            f"{humanbytes(done['size'])} of {humanbytes(total_size)} "
+            f"@ {humanbytes(speed)}`",
+        )
+        update_job(done["size"], total_size)
+        return size
+
+    try:
+        sizes = await pool(upload_one, files)
+    finally:
+        await finish_report(gdrive)
+    return folder.get("id"), sum(sizes)
 
 
 @register(pattern=r"^\.gdlist(?: |$)(-l \d+)?(?: |$)?(.*)?(?: |$)", outgoing=True)
@@ -764,7 +1028,7 @@ async def lists(gdrive):
     result = []
     while True:
         try:
-            response = (
+            response = await execute(
                 service.files()
                 .list(
                     supportsAllDrives=True,
@@ -777,7 +1041,6 @@ async def lists(gdrive):
                     orderBy="modifiedTime desc, folder",
                     pageToken=page_token,
                 )
-                .execute()
             )
         except HttpError as e:
             await gdrive.edit(
@@ -837,22 +1100,8 @@ async def google_drive_managers(gdrive):
     for name_or_id in f_name:
         """- in case given name has a space beetween ; -"""
         name_or_id = name_or_id.strip()
-        metadata = {
-            "name": name_or_id,
-            "mimeType": "application/vnd.google-apps.folder",
-        }
-        try:
-            if parent_Id is not None:
-                pass
-        except NameError:
-            """- Fallback to G_DRIVE_FOLDER_ID else to root dir -"""
-            if G_DRIVE_FOLDER_ID is not None:
-                metadata["parents"] = [G_DRIVE_FOLDER_ID]
-        else:
-            """- Override G_DRIVE_FOLDER_ID because parent_Id not empty -"""
-            metadata["parents"] = [parent_Id]
         page_token = None
-        result = (
+        result = await execute(
             service.files()
             .list(
                 q=f'name="{name_or_id}"',
@@ -864,7 +1113,6 @@ async def google_drive_managers(gdrive):
                 supportsAllDrives=True,
                 pageToken=page_token,
             )
-            .execute()
         )
         if exe == "mkdir":
             """
@@ -921,7 +1169,9 @@ async def google_drive_managers(gdrive):
             else:
                 status = "[FILE - DELETE]"
             try:
-                service.files().delete(fileId=f_id, supportsAllDrives=True).execute()
+                await execute(
+                    service.files().delete(fileId=f_id, supportsAllDrives=True)
+                )
             except HttpError as e:
                 status.replace("DELETE]", "ERROR]")
                 reply += (
@@ -979,18 +1229,20 @@ async def cancel_process(gdrive):
     """
     Abort process for download and upload
     """
-    global is_cancelled
     downloads = aria2.get_downloads()
     await gdrive.edit("`Cancelling...`")
     if len(downloads) != 0:
         aria2.remove_all(force=True)
         aria2.autopurge()
-    is_cancelled = True
+    for job in list(JOBS.jobs.values()):
+        if job.kind == "gdrive":
+            JOBS.cancel(job.id)
     await asyncio.sleep(3.5)
     await gdrive.delete()
 
 
 @register(pattern=r"^\.gd(?: |$)(.*)", outgoing=True)
+@as_job("gdrive")
 async def google_drive(gdrive):
     reply = ""
     """ - Parsing all google drive function - """
@@ -1016,19 +1268,14 @@ async def google_drive(gdrive):
             file_path = None
     elif isdir(value):
         folder_path = value
-        global parent_Id
-        folder_name = await get_raw_name(folder_path)
-        folder = await create_dir(service, folder_name)
-        parent_Id = folder.get("id")
-        webViewURL = "https://drive.google.com/drive/folders/" + parent_Id
+        folder_name = await get_raw_name(folder_path.rstrip("/"))
         try:
-            await task_directory(gdrive, service, folder_path)
+            folder_Id, folder_size = await upload_dir(gdrive, service, folder_path)
         except CancelProcess:
             await gdrive.respond(
                 "`[FOLDER - CANCELLED]`\n\n"
                 "`Status` : **OK** - received signal cancelled."
             )
-            await reset_parentId()
             await gdrive.delete()
             return True
         except Exception as e:
@@ -1038,19 +1285,17 @@ async def google_drive(gdrive):
                 "`Status` : **BAD**\n"
                 f"`Reason` : {str(e)}"
             )
-            await reset_parentId()
             return False
         else:
+            webViewURL = "https://drive.google.com/drive/folders/" + folder_Id
             msg = f"**GDrive Upload**\n\n📁 [{folder_name}]({webViewURL})"
             if G_DRIVE_INDEX_URL:
                 index_url = (
                     G_DRIVE_INDEX_URL.rstrip("/") + "/" + quote(folder_name) + "/"
                 )
                 msg += f"\n👥 [Index URL]({index_url})"
-            folder_size = await count_dir_size(service, parent_Id)
             msg += f"\n__Size : {humanbytes(folder_size)}__"
             await gdrive.edit(msg, link_preview=False)
-            await reset_parentId()
             return True
     elif not value and gdrive.reply_to_msg_id:
         reply += await download(gdrive, service)
@@ -1173,25 +1418,25 @@ async def google_drive(gdrive):
 async def set_upload_folder(gdrive):
     """- Set parents dir for upload/check/makedir/remove -"""
     await gdrive.edit("`Sending information...`")
-    global parent_Id
+    global upload_folder_Id
     exe = gdrive.pattern_match.group(1)
     if exe == "rm":
         if G_DRIVE_FOLDER_ID is not None:
-            parent_Id = G_DRIVE_FOLDER_ID
+            upload_folder_Id = None
             await gdrive.edit(
                 "`[FOLDER - SET]`\n\n"
                 "`Status` : **OK** - using `G_DRIVE_FOLDER_ID` now."
             )
             return None
         else:
-            try:
-                del parent_Id
-            except NameError:
+            if upload_folder_Id is None:
                 await gdrive.edit(
-                    "`[FOLDER - SET]`\n\n" "`Status` : **BAD** - No parent_Id is set."
+                    "`[FOLDER - SET]`\n\n"
+                    "`Status` : **BAD** - No upload folder is set."
                 )
                 return False
             else:
+                upload_folder_Id = None
                 await gdrive.edit(
                     "`[FOLDER - SET]`\n\n"
                     "`Status` : **OK**"
@@ -1216,7 +1461,7 @@ async def set_upload_folder(gdrive):
         else:
             c2 = False
         if True in [c1 or c2]:
-            parent_Id = inp
+            upload_folder_Id = inp
             await gdrive.edit(
                 "`[PARENT - FOLDER]`\n\n" "`Status` : **OK** - Successfully changed."
             )
@@ -1225,7 +1470,7 @@ async def set_upload_folder(gdrive):
             await gdrive.edit(
                 "`[PARENT - FOLDER]`\n\n" "`Status` : **WARNING** - forcing use..."
             )
-            parent_Id = inp
+            upload_folder_Id = inp
     else:
         if "uc?id=" in ext_id:
             await gdrive.edit(
@@ -1233,17 +1478,17 @@ async def set_upload_folder(gdrive):
             )
             return None
         try:
-            parent_Id = ext_id.split("folders/")[1]
+            upload_folder_Id = ext_id.split("folders/")[1]
         except IndexError:
             """- Try catch again if URL open?id= -"""
             try:
-                parent_Id = ext_id.split("open?id=")[1]
+                upload_folder_Id = ext_id.split("open?id=")[1]
             except IndexError:
                 if "/view" in ext_id:
-                    parent_Id = ext_id.split("/")[-2]
+                    upload_folder_Id = ext_id.split("/")[-2]
                 else:
                     try:
-                        parent_Id = ext_id.split("folderview?id=")[1]
+                        upload_folder_Id = ext_id.split("folderview?id=")[1]
                     except IndexError:
                         await gdrive.edit(
                             "`[URL - ERROR]`\n\n"
@@ -1258,14 +1503,15 @@ async def set_upload_folder(gdrive):
 
 async def check_progress_for_dl(gdrive, gid, previous):
     complete = None
-    global is_cancelled
     global filenames
-    is_cancelled = False
     while not complete:
-        if is_cancelled is True:
-            raise CancelProcess
-
         file = aria2.get_download(gid)
+        try:
+            check_cancelled()
+        except CancelProcess:
+            file.remove(force=True)
+            raise
+
         complete = file.is_complete
         try:
             filenames = file.name
@@ -1275,10 +1521,8 @@ async def check_progress_for_dl(gdrive, gid, previous):
             if not complete and not file.error_message:
                 percentage = int(file.progress)
                 downloaded = percentage * int(file.total_length) / 100
-                prog_str = "`Downloading` | [{0}{1}] `{2}`".format(
-                    "".join(["●" for i in range(math.floor(percentage / 10))]),
-                    "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-                    file.progress_string(),
+                prog_str = "`Downloading` | [{0}] `{1}`".format(
+                    progress_bar(percentage), file.progress_string()
                 )
                 msg = (
                     "`[URI - DOWNLOAD]`\n\n"
@@ -1290,22 +1534,24 @@ async def check_progress_for_dl(gdrive, gid, previous):
                     f" @ {file.download_speed_string()}`\n"
                     f"`ETA` -> {file.eta_string()}\n"
                 )
-                if msg != previous or downloaded == file.total_length_string():
-                    await gdrive.edit(msg)
-                    msg = previous
+                report(gdrive, msg)
+                update_job(downloaded, int(file.total_length))
             else:
-                await gdrive.edit(f"`{msg}`")
+                report(gdrive, f"`{msg}`")
             await asyncio.sleep(15)
             await check_progress_for_dl(gdrive, gid, previous)
             file = aria2.get_download(gid)
             complete = file.is_complete
             if complete:
-                await gdrive.edit(f"`{file.name}`\n\n" "Successfully downloaded...")
+                await finish_report(
+                    gdrive, f"`{file.name}`\n\n" "Successfully downloaded..."
+                )
                 return True
         except Exception as e:
             if " depth exceeded" in str(e):
                 file.remove(force=True)
                 try:
+                    await finish_report(gdrive)
                     await gdrive.edit(
                         "`[URI - DOWNLOAD]`\n\n"
                         f"`{file.name}`\n"
@@ -1317,13 +1563,15 @@ async def check_progress_for_dl(gdrive, gid, previous):
 
 
 async def list_drive_dir(service, file_id: str) -> list:
+    """- Every child of file_id, a page at a time within CLONE_BUCKET -"""
     query = f"'{file_id}' in parents and (name contains '*')"
     fields = "nextPageToken, files(id, name, mimeType, size)"
     page_token = None
     page_size = 100
     files = []
     while True:
-        response = (
+        response = await limited(
+            execute,
             service.files()
             .list(
                 supportsAllDrives=True,
@@ -1336,7 +1584,6 @@ async def list_drive_dir(service, file_id: str) -> list:
                 corpora="allDrives",
                 orderBy="folder, name",
             )
-            .execute()
         )
         files.extend(response.get("files", []))
         page_token = response.get("nextPageToken", None)
@@ -1352,10 +1599,9 @@ async def create_folder(service, folder_name: str, parent_id: str) -> str:
     }
     if parent_id is not None:
         metadata["parents"] = [parent_id]
-    folder = (
+    folder = await execute(
         service.files()
         .create(body=metadata, fields="id", supportsAllDrives=True)
-        .execute()
     )
     return folder["id"]
 
@@ -1364,46 +1610,146 @@ async def copy_file(service, file_id: str, parent_id: str) -> str:
     body = {}
     if parent_id:
         body["parents"] = [parent_id]
-    drive_file = (
+    drive_file = await execute(
         service.files()
         .copy(body=body, fileId=file_id, supportsTeamDrives=True)
-        .execute()
     )
     return drive_file["id"]
 
 
-async def copy_dir(service, file_id: str, parent_id: str) -> str:
-    files = await list_drive_dir(service, file_id)
-    if len(files) == 0:
-        return parent_id
-    new_id = None
-    for file_ in files:
-        if file_["mimeType"] == G_DRIVE_DIR_MIME_TYPE:
-            dir_id = await create_folder(service, file_["name"], parent_id)
-            new_id = await copy_dir(service, file_["id"], dir_id)
-        else:
-            await copy_file(service, file_["id"], parent_id)
-            await asyncio.sleep(0.5)  # due to user rate limits
-            new_id = parent_id
-    return new_id
+class TokenBucket:
+    """- Lets rate calls a second through on average, burst of them at once -"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = time.monotonic()
+            self.tokens -= 1
+
+
+# The quota is per user, so every clone shares one bucket.
+CLONE_BUCKET = TokenBucket(CLONE_RATE, CLONE_BURST)
+
+
+def rate_limited(e):
+    """- Whether Drive turned a request down for going too fast -"""
+    if e.resp.status == 429:
+        return True
+    return e.resp.status == 403 and (
+        b"userRateLimitExceeded" in e.content or b"rateLimitExceeded" in e.content
+    )
+
 
+async def limited(func, *args):
+    """- Await func(*args) within CLONE_BUCKET, retry when rate limited -
 
-async def count_dir_size(service, file_id: str) -> int:
-    _size = 0
-    files = await list_drive_dir(service, file_id)
-    for _file in files:
+    Every retry waits twice as long as the one before, with jitter so
+    the workers that got limited together don't come back together.
+    """
+    delay = 1
+    for attempt in range(CLONE_RETRIES):
+        await CLONE_BUCKET.acquire()
         try:
-            if _file.get("mimeType") == G_DRIVE_DIR_MIME_TYPE:
-                dir_id = _file.get("id")
-                _size += int(await count_dir_size(service, dir_id))
-            else:
-                _size += int(_file.get("size"))
-        except TypeError:
-            pass
-    return _size
+            return await func(*args)
+        except HttpError as e:
+            if not rate_limited(e) or attempt == CLONE_RETRIES - 1:
+                raise
+        await asyncio.sleep(delay + random.uniform(0, delay))
+        delay *= 2
+
+
+async def clone_dir(event, service, file_id: str, folder_name: str, parent_id):
+    """- Copy a Drive folder server side, returns the copy's id and size -
+
+    The source is walked breadth-first and its folders recreated a level
+    at a time, then every file is copied straight into its new folder,
+    DRIVE_WORKERS at once under the CLONE_BUCKET rate.
+    """
+    root_id = await limited(create_folder, service, folder_name, parent_id)
+    files = []
+    folders = 0
+    level = [(file_id, root_id)]
+    while level:
+        check_cancelled()
+
+        listings = await pool(
+            lambda folder: list_drive_dir(service, folder[0]), level
+        )
+        subdirs = []
+        for (_, new_id), children in zip(level, listings):
+            for child in children:
+                if child["mimeType"] == G_DRIVE_DIR_MIME_TYPE:
+                    subdirs.append((child, new_id))
+                else:
+                    files.append((child, new_id))
+        folders += len(subdirs)
+        report(
+            event,
+            "`[FOLDER - CLONE]`\n\n"
+            f"`{folder_name}`\n"
+            f"`Status` : listing, {folders} folders and {len(files)} files...",
+        )
+        created = await pool(
+            lambda subdir: limited(
+                create_folder, service, subdir[0]["name"], subdir[1]
+            ),
+            subdirs,
+        )
+        level = [
+            (subdir[0]["id"], new_id) for subdir, new_id in zip(subdirs, created)
+        ]
+    total_size = sum(int(child.get("size", 0)) for child, _ in files)
+    done = {"files": 0, "size": 0}
+    current_time = time.time()
+
+    async def copy_one(file):
+        child, new_id = file
+        check_cancelled()
+        await limited(copy_file, service, child["id"], new_id)
+        done["files"] += 1
+        done["size"] += int(child.get("size", 0))
+        percentage = done["files"] / len(files) * 100
+        diff = time.time() - current_time
+        eta = round(diff / done["files"] * (len(files) - done["files"]))
+        prog_str = "`Cloning` | [{0}] `{1}%`".format(
+            progress_bar(percentage), round(percentage, 2)
+        )
+        report(
+            event,
+            "`[FOLDER - CLONE]`\n\n"
+            f"`{folder_name}`\n"
+            f"`Status`\n{prog_str}\n"
+            f"`{done['files']} of {len(files)} files, "
+            f"{humanbytes(done['size'])} of {humanbytes(total_size)}`\n"
+            f"`ETA` -> {time_formatter(eta)}",
+        )
+        update_job(done["size"], total_size)
+
+    try:
+        await pool(copy_one, files)
+    finally:
+        await finish_report(event)
+    return root_id, total_size
 
 
 @register(outgoing=True, pattern=r"^\.gcl(?: |$)(.*)")
+@as_job("gdrive")
 async def gdrive_clone(event):
     service = await create_app(event)
     if service is False:
@@ -1423,23 +1769,21 @@ async def gdrive_clone(event):
         elif "/view" in input_str:
             _file_id = input_str.split("/")[-2]
     try:
-        await get_information(service, _file_id)
-    except BaseException as gd_e:
+        _drive_file = await get_information(service, _file_id)
+    except Exception as gd_e:
         return await event.edit(
             f"`[FILE/FOLDER ERROR]`\n\nStatus : **BAD**\nError : `{gd_e}`"
         )
-    _drive_file = await get_information(service, _file_id)
     if _drive_file["mimeType"] == G_DRIVE_DIR_MIME_TYPE:
-        dir_id = await create_folder(service, _drive_file["name"], G_DRIVE_FOLDER_ID)
-        await copy_dir(service, _file_id, dir_id)
-        ret_id = dir_id
+        ret_id, _size = await clone_dir(
+            event, service, _file_id, _drive_file["name"], G_DRIVE_FOLDER_ID
+        )
     else:
-        ret_id = await copy_file(service, _file_id, G_DRIVE_FOLDER_ID)
+        ret_id = await limited(copy_file, service, _file_id, G_DRIVE_FOLDER_ID)
     _drive_meta = await get_information(service, ret_id)
     _name = _drive_meta.get("name")
     if _drive_meta.get("mimeType") == G_DRIVE_DIR_MIME_TYPE:
         _link = _drive_meta.get("webViewLink")
-        _size = await count_dir_size(service, _drive_meta.get("id"))
         _icon = "📁️"
     else:
         _link = _drive_meta.get("webContentLink")
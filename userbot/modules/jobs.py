@@ -0,0 +1,62 @@
+# Copyright (C) 2019 The Raphielscape Company LLC.
+#
+# Licensed under the Raphielscape Public License, Version 1.c (the "License");
+# you may not use this file except in compliance with the License.
+#
+""" Userbot module to list and cancel the running transfers. """
+
+from userbot import CMD_HELP
+from userbot.events import register
+from userbot.utils import humanbytes, progress_bar, time_formatter
+from userbot.utils.jobs import JOBS, QUEUED
+
+
+def duration(seconds):
+    return time_formatter(round(seconds)) or "0 second(s)"
+
+
+def describe(job):
+    text = f"`{job.id}` | **{job.state.capitalize()}** | `{job.name}`"
+    if job.state == QUEUED:
+        return text + f"\n`Position` -> {JOBS.position(job)}"
+    if job.total:
+        percentage = job.done * 100 / job.total
+        text += (
+            f"\n[{progress_bar(percentage)}] `{round(percentage, 2)}%`"
+            f"\n`{humanbytes(job.done)} of {humanbytes(job.total)}"
+            f" @ {humanbytes(job.speed)}`"
+        )
+    elif job.done:
+        text += f"\n`{humanbytes(job.done)} @ {humanbytes(job.speed)}`"
+    if job.eta is not None and job.finished is None:
+        text += f"\n`ETA` -> {duration(job.eta)}"
+    return text + f"\n`Duration` -> {duration(job.elapsed)}"
+
+
+@register(outgoing=True, pattern=r"^\.jobs$")
+async def list_jobs(event):
+    if not JOBS.jobs:
+        return await event.edit("`No jobs yet.`")
+    await event.edit(
+        "**Jobs**\n\n" + "\n\n".join(describe(job) for job in JOBS.jobs.values())
+    )
+
+
+@register(outgoing=True, pattern=r"^\.cancel (\d+)$")
+async def cancel_job(event):
+    job_id = int(event.pattern_match.group(1))
+    job = JOBS.cancel(job_id)
+    if job is None:
+        return await event.edit(f"`Job {job_id} is not running or queued.`")
+    await event.edit(f"`Cancelling job {job_id}...`")
+
+
+CMD_HELP.update(
+    {
+        "jobs": ">`.jobs`"
+        "\nUsage: Lists the running, queued and last finished transfers "
+        "of .dl, .up, .gd, .gcl, .mega and aria with their progress."
+        "\n\n>`.cancel <id>`"
+        "\nUsage: Cancels the transfer with that id from `.jobs`."
+    }
+)
@@ -21,7 +21,6 @@
 import asyncio
 import errno
 import json
-import math
 import multiprocessing
 import os
 import re
@@ -35,7 +34,16 @@ from pySmartDL import SmartDL
 from userbot import CMD_HELP, LOGS, TEMP_DOWNLOAD_DIRECTORY
 from userbot.events import register
 from userbot.modules.google_drive import create_app, get_mimeType, upload
-from userbot.utils import humanbytes, time_formatter
+from userbot.utils import (
+    as_job,
+    check_cancelled,
+    finish_report,
+    humanbytes,
+    progress_bar,
+    report,
+    time_formatter,
+    update_job,
+)
 from userbot.utils.exceptions import CancelProcess
 
 
@@ -55,6 +63,7 @@ async def subprocess_run(megadl, cmd):
 
 
 @register(outgoing=True, pattern=r"^\.mega(?: |$)(.*)")
+@as_job("mega")
 async def mega_downloader(megadl):
     await megadl.edit("`Collecting information...`")
     if not os.path.isdir(TEMP_DOWNLOAD_DIRECTORY):
@@ -106,7 +115,6 @@ async def mega_downloader(megadl):
             await megadl.edit(f"`{str(e)}`")
             return None
     downloader = SmartDL(file_url, temp_file_path, progress_bar=False)
-    display_message = None
     try:
         downloader.start(blocking=False)
     except HTTPError as e:
@@ -114,41 +122,38 @@ async def mega_downloader(megadl):
         return None
     start = time.time()
     while not downloader.isFinished():
+        try:
+            check_cancelled()
+        except CancelProcess:
+            downloader.stop()
+            raise
         status = downloader.get_status().capitalize()
         total_length = downloader.filesize if downloader.filesize else None
         downloaded = downloader.get_dl_size()
         percentage = int(downloader.get_progress() * 100)
         speed = downloader.get_speed(human=True)
         estimated_total_time = round(downloader.get_eta())
-        progress_str = "`{0}` | [{1}{2}] `{3}%`".format(
-            status,
-            "".join(["●" for i in range(math.floor(percentage / 10))]),
-            "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-            round(percentage, 2),
+        progress_str = "`{0}` | [{1}] `{2}%`".format(
+            status, progress_bar(percentage), round(percentage, 2)
         )
         diff = time.time() - start
-        try:
-            current_message = (
-                f"`{file_name}`\n\n"
-                "Status\n"
-                f"{progress_str}\n"
-                f"`{humanbytes(downloaded)} of {humanbytes(total_length)}"
-                f" @ {speed}`\n"
-                f"`ETA` -> {time_formatter(estimated_total_time)}\n"
-                f"`Duration` -> {time_formatter(round(diff))}"
-            )
-            if round(diff % 15.00) == 0 and (
-                display_message != current_message or total_length == downloaded
-            ):
-                await megadl.edit(current_message)
-                await asyncio.sleep(0.2)
-                display_message = current_message
-        except Exception:
-            pass
-        finally:
-            if status == "Combining":
-                wait = round(downloader.get_eta())
-                await asyncio.sleep(wait)
+        report(
+            megadl,
+            f"`{file_name}`\n\n"
+            "Status\n"
+            f"{progress_str}\n"
+            f"`{humanbytes(downloaded)} of {humanbytes(total_length)}"
+            f" @ {speed}`\n"
+            f"`ETA` -> {time_formatter(estimated_total_time)}\n"
+            f"`Duration` -> {time_formatter(round(diff))}",
+        )
+        update_job(downloaded, total_length)
+        if status == "Combining":
+            wait = round(downloader.get_eta())
+            await asyncio.sleep(wait)
+        else:
+            await asyncio.sleep(1)
+    await finish_report(megadl)
     if downloader.isSuccessful():
         download_time = round(downloader.get_dl_time() + wait)
         try:
@@ -64,10 +64,12 @@ async def killdabot(event):
         )
 
     try:
+        from userbot.modules.sql_helper import flush_writes
         from userbot.modules.sql_helper.globals import addgvar, delgvar
 
         delgvar("restartstatus")
         addgvar("restartstatus", f"{event.chat_id}\n{event.id}")
+        flush_writes()
     except AttributeError:
         pass
 
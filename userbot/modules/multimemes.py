@@ -120,9 +120,7 @@ async def glitch(event):
         Glitched,
         force_document=False,
         reply_to=event.reply_to_msg_id,
-        progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-            progress(d, t, event, c_time, "[UPLOAD]")
-        ),
+        progress_callback=lambda d, t: progress(d, t, event, c_time, "[UPLOAD]"),
     )
     await event.delete()
     os.remove(Glitched)
@@ -19,7 +19,7 @@ from userbot import (
     LOGS,
     PM_AUTO_BAN,
 )
-from userbot.events import register
+from userbot.events import incoming_stage, register
 
 # ========================= CONSTANTS ============================
 DEF_UNAPPROVED_MSG = (
@@ -31,28 +31,35 @@ DEF_UNAPPROVED_MSG = (
 # =================================================================
 
 
-@register(incoming=True, disable_edited=True, disable_errors=True)
-async def permitpm(event):
+@incoming_stage(
+    50,
+    guard=lambda event: PM_AUTO_BAN and event.is_private and event.chat_id != 777000,
+    disable_edited=True,
+    disable_errors=True,
+)
+async def permitpm(event, context):
     """Prohibits people from PMing you without approval. \
         Will block retarded nibbas automatically."""
     if PM_AUTO_BAN:
-        self_user = await event.client.get_me()
         if (
             event.is_private
             and event.chat_id != 777000
-            and event.chat_id != self_user.id
-            and not (await event.get_sender()).bot
+            and event.chat_id != await context.get_self_id()
+            and not await context.is_bot()
         ):
             try:
+                from userbot.modules.sql_helper import run_sql
                 from userbot.modules.sql_helper.globals import gvarstatus
                 from userbot.modules.sql_helper.pm_permit_sql import is_approved
             except AttributeError:
                 return
-            apprv = is_approved(event.chat_id)
-            notifsoff = gvarstatus("NOTIF_OFF")
+            apprv = await context.setting(
+                "pm_approved", run_sql, is_approved, event.chat_id
+            )
+            notifsoff = await run_sql(gvarstatus, "NOTIF_OFF")
 
             # Use user custom unapproved message
-            getmsg = gvarstatus("unapproved_msg")
+            getmsg = await run_sql(gvarstatus, "unapproved_msg")
             if getmsg is not None:
                 UNAPPROVED_MSG = getmsg
             else:
@@ -106,7 +113,7 @@ async def permitpm(event):
                     await event.client(ReportSpamRequest(peer=event.chat_id))
 
                     if BOTLOG:
-                        name = await event.client.get_entity(event.chat_id)
+                        name = await context.get_chat()
                         name0 = str(name.first_name)
                         await event.client.send_message(
                             BOTLOG_CHATID,
@@ -132,13 +139,14 @@ async def auto_accept(event):
         and not (await event.get_sender()).bot
     ):
         try:
+            from userbot.modules.sql_helper import run_sql
             from userbot.modules.sql_helper.globals import gvarstatus
             from userbot.modules.sql_helper.pm_permit_sql import approve, is_approved
         except AttributeError:
             return
 
         # Use user custom unapproved message
-        get_message = gvarstatus("unapproved_msg")
+        get_message = await run_sql(gvarstatus, "unapproved_msg")
         if get_message is not None:
             UNAPPROVED_MSG = get_message
         else:
@@ -146,7 +154,7 @@ async def auto_accept(event):
 
         chat = await event.get_chat()
         if isinstance(chat, User):
-            if is_approved(event.chat_id) or chat.bot:
+            if await run_sql(is_approved, event.chat_id) or chat.bot:
                 return
             async for message in event.client.iter_messages(
                 event.chat_id, reverse=True, limit=1
@@ -156,11 +164,11 @@ async def auto_accept(event):
                     and message.sender_id == self_user.id
                 ):
                     try:
-                        approve(event.chat_id)
+                        await run_sql(approve, event.chat_id)
                     except IntegrityError:
                         return
 
-                if is_approved(event.chat_id) and BOTLOG:
+                if await run_sql(is_approved, event.chat_id) and BOTLOG:
                     await event.client.send_message(
                         BOTLOG_CHATID,
                         "#AUTO-APPROVED\n"
@@ -173,10 +181,11 @@ async def auto_accept(event):
 async def notifoff(noff_event):
     """For .notifoff command, stop getting notifications from unapproved PMs."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.globals import addgvar
     except AttributeError:
         return await noff_event.edit("`Running on Non-SQL mode!`")
-    addgvar("NOTIF_OFF", True)
+    await run_sql(addgvar, "NOTIF_OFF", True)
     await noff_event.edit("`Notifications from unapproved PM's are silenced!`")
 
 
@@ -184,10 +193,11 @@ async def notifoff(noff_event):
 async def notifon(non_event):
     """For .notifoff command, get notifications from unapproved PMs."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.globals import delgvar
     except AttributeError:
         return await non_event.edit("`Running on Non-SQL mode!`")
-    delgvar("NOTIF_OFF")
+    await run_sql(delgvar, "NOTIF_OFF")
     await non_event.edit("`Notifications from unapproved PM's unmuted!`")
 
 
@@ -195,6 +205,7 @@ async def notifon(non_event):
 async def approvepm(apprvpm):
     """For .approve command, give someone the permissions to PM you."""
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.globals import gvarstatus
         from userbot.modules.sql_helper.pm_permit_sql import approve
     except AttributeError:
@@ -226,7 +237,7 @@ async def approvepm(apprvpm):
         uid = apprvpm.chat_id
 
     # Get user custom msg
-    getmsg = gvarstatus("unapproved_msg")
+    getmsg = await run_sql(gvarstatus, "unapproved_msg")
     if getmsg is not None:
         UNAPPROVED_MSG = getmsg
     else:
@@ -238,7 +249,7 @@ async def approvepm(apprvpm):
         await message.delete()
 
     try:
-        approve(uid)
+        await run_sql(approve, uid)
     except IntegrityError:
         return await apprvpm.edit("`User may already be approved.`")
 
@@ -254,6 +265,7 @@ async def approvepm(apprvpm):
 @register(outgoing=True, pattern=r"^\.disapprove(?:$| )(.*)")
 async def disapprovepm(disapprvpm):
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.pm_permit_sql import dissprove
     except BaseException:
         return await disapprvpm.edit("`Running on Non-SQL mode!`")
@@ -263,7 +275,7 @@ async def disapprovepm(disapprvpm):
         replied_user = await disapprvpm.client.get_entity(reply.sender_id)
         aname = replied_user.id
         name0 = str(replied_user.first_name)
-        dissprove(aname)
+        await run_sql(dissprove, aname)
         uid = replied_user.id
     elif disapprvpm.pattern_match.group(1):
         inputArgs = disapprvpm.pattern_match.group(1)
@@ -276,10 +288,10 @@ async def disapprovepm(disapprvpm):
         if not isinstance(user, User):
             return await disapprvpm.edit("`This can be done only with users.`")
         uid = user.id
-        dissprove(uid)
+        await run_sql(dissprove, uid)
         name0 = str(user.first_name)
     else:
-        dissprove(disapprvpm.chat_id)
+        await run_sql(dissprove, disapprvpm.chat_id)
         aname = await disapprvpm.client.get_entity(disapprvpm.chat_id)
         if not isinstance(aname, User):
             return await disapprvpm.edit("`You're not reffering to a User`")
@@ -316,9 +328,10 @@ async def blockpm(block):
         uid = block.chat_id
 
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.pm_permit_sql import dissprove
 
-        dissprove(uid)
+        await run_sql(dissprove, uid)
     except AttributeError:
         pass
 
@@ -358,6 +371,7 @@ async def add_pmsg(cust_msg):
         return await cust_msg.edit("You need to set `PM_AUTO_BAN` to `True`")
     try:
         import userbot.modules.sql_helper.globals as sql
+        from userbot.modules.sql_helper import run_sql
     except AttributeError:
         await cust_msg.edit("`Running on Non-SQL mode!`")
         return
@@ -365,7 +379,7 @@ async def add_pmsg(cust_msg):
     await cust_msg.edit("Processing...")
     conf = cust_msg.pattern_match.group(1)
 
-    custom_message = sql.gvarstatus("unapproved_msg")
+    custom_message = await run_sql(sql.gvarstatus, "unapproved_msg")
 
     if conf.lower() == "set":
         message = await cust_msg.get_reply_message()
@@ -373,7 +387,7 @@ async def add_pmsg(cust_msg):
 
         # check and clear user unapproved message first
         if custom_message is not None:
-            sql.delgvar("unapproved_msg")
+            await run_sql(sql.delgvar, "unapproved_msg")
             status = "Updated"
 
         if message:
@@ -381,7 +395,7 @@ async def add_pmsg(cust_msg):
             # eg: bold, underline, striketrough, link
             # for now all text are in monoscape
             msg = message.message  # get the plain text
-            sql.addgvar("unapproved_msg", msg)
+            await run_sql(sql.addgvar, "unapproved_msg", msg)
         else:
             return await cust_msg.edit("`Reply to a message`")
 
@@ -394,7 +408,7 @@ async def add_pmsg(cust_msg):
 
     if conf.lower() == "reset":
         if custom_message is not None:
-            sql.delgvar("unapproved_msg")
+            await run_sql(sql.delgvar, "unapproved_msg")
             await cust_msg.edit("`Unapproved message reset to default`")
         else:
             await cust_msg.edit("`You haven't set a custom message yet`")
@@ -1,16 +1,315 @@
-from sqlalchemy import create_engine
+import atexit
+from asyncio import get_event_loop
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from threading import Lock, RLock, Timer
+from time import monotonic
+
+from sqlalchemy import Integer, MetaData, Table, create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
-from userbot import DB_URI
+from sqlalchemy.pool import SingletonThreadPool
+from userbot import DB_URI, LOGS
 
 BASE = declarative_base()
 
+# Used when DATABASE_URL isn't set, so SQL modules work without a server.
+SQLITE_URI = "sqlite:///userbot.db"
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def _tune_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 
 def start() -> scoped_session:
-    engine = create_engine(DB_URI)
+    db_uri = DB_URI or SQLITE_URI
+    if db_uri.startswith("sqlite"):
+        # Keep one connection per thread open instead of reconnecting and
+        # running the pragmas again for every session.
+        engine = create_engine(db_uri, poolclass=SingletonThreadPool)
+        event.listen(engine, "connect", _tune_sqlite)
+    else:
+        engine = create_engine(db_uri)
     BASE.metadata.bind = engine
     BASE.metadata.create_all(engine)
     return scoped_session(sessionmaker(bind=engine, autoflush=False))
 
 
 SESSION = start()
+
+
+def _needs_upgrade(table, inspector):
+    columns = {col["name"]: col["type"] for col in inspector.get_columns(table.name)}
+    primary_key = inspector.get_pk_constraint(table.name)["constrained_columns"]
+    if set(primary_key) != {col.name for col in table.primary_key.columns}:
+        return True
+    for column in table.columns:
+        if column.name not in columns:
+            return True
+        if isinstance(column.type, Integer) and not isinstance(
+                columns[column.name], Integer):
+            return True
+    return False
+
+
+def upgrade_table(table):
+    """ Recreates table when the database still has an older schema of it,
+        e.g. ids stored as strings, converting and copying every row over.
+        It all runs in one transaction, so a failure leaves the old table. """
+    engine = BASE.metadata.bind
+    inspector = inspect(engine)
+    if table.name not in inspector.get_table_names():
+        return
+    if not _needs_upgrade(table, inspector):
+        return
+
+    LOGS.info(f"Upgrading the schema of the {table.name} table")
+    with engine.begin() as conn:
+        old = Table(table.name, MetaData(), autoload=True, autoload_with=conn)
+        rows = conn.execute(old.select()).fetchall()
+        new_rows = {}
+        for row in rows:
+            old_values = dict(row.items())
+            values = {}
+            try:
+                for column in table.columns:
+                    value = old_values.get(column.name)
+                    if value is not None and isinstance(column.type, Integer):
+                        value = int(value)
+                    values[column.name] = value
+            except (TypeError, ValueError):
+                LOGS.info(f"Dropping invalid {table.name} row: {old_values}")
+                continue
+            key = tuple(values[col.name] for col in table.primary_key.columns)
+            new_rows[key] = values
+        old.drop(conn)
+        table.create(conn)
+        if new_rows:
+            conn.execute(table.insert(), list(new_rows.values()))
+
+
+# Queries block, so async code runs them on this thread instead of the event
+# loop. A single worker keeps every call from async code in order, and the
+# scoped session gives it a session of its own.
+SQL_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql")
+
+
+async def run_sql(func, *args, **kwargs):
+    """ Awaits func(*args, **kwargs) run on the database thread. """
+    return await get_event_loop().run_in_executor(
+        SQL_EXECUTOR, partial(func, *args, **kwargs))
+
+
+class WriteQueue:
+    """ Write-behind queue for hot-path mutations. Writes are callables
+        taking the session, coalesced by key so only the latest write of a
+        key runs, and flushed together in one transaction. Keys start with
+        the name of the table written to.
+
+        A failed flush is retried with the writes put back in the queue.
+        After retries failed flushes in a row, the writes are committed
+        one by one and those that still fail are dropped, along with the
+        cached reads of their tables, which may already show them. """
+
+    def __init__(self, interval, retries=3):
+        self.interval = interval
+        self.retries = retries
+        self.failures = 0
+        self.pending = OrderedDict()
+        self.lock = Lock()
+        self.flush_lock = RLock()
+        self.timer = None
+
+    def put(self, key, write):
+        with self.lock:
+            self.pending.pop(key, None)
+            self.pending[key] = write
+            self._schedule()
+
+    def _schedule(self):
+        if self.timer is None:
+            self.timer = Timer(self.interval, self._flush_later)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_later(self):
+        try:
+            SQL_EXECUTOR.submit(self.flush)
+        except RuntimeError:
+            # The executor is gone at shutdown, atexit flushes instead.
+            pass
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, OrderedDict()
+                self.timer = None
+            if not pending:
+                return
+            try:
+                for write in pending.values():
+                    write(SESSION)
+                SESSION.commit()
+                if self.failures:
+                    # Reads in between cached the database without these.
+                    for table in {key[0] for key in pending}:
+                        invalidate(table)
+                    self.failures = 0
+            except BaseException:
+                SESSION.rollback()
+                self.failures += 1
+                if self.failures < self.retries:
+                    LOGS.exception(
+                        f"Failed to write {len(pending)} queued changes, "
+                        "retrying")
+                    self._requeue(pending)
+                else:
+                    LOGS.exception(
+                        f"Failed to write {len(pending)} queued changes "
+                        f"{self.failures} times, writing them one by one")
+                    self.failures = 0
+                    self._write_each(pending)
+            finally:
+                SESSION.close()
+
+    def _requeue(self, failed):
+        """ Puts failed writes back ahead of the queue, unless a newer
+            write of the same key was queued meanwhile. """
+        with self.lock:
+            pending = OrderedDict(
+                (key, write) for key, write in failed.items()
+                if key not in self.pending)
+            pending.update(self.pending)
+            self.pending = pending
+            self._schedule()
+
+    def _write_each(self, pending):
+        for key, write in pending.items():
+            try:
+                write(SESSION)
+                SESSION.commit()
+            except BaseException:
+                SESSION.rollback()
+                LOGS.exception(f"Dropped the queued write of {key}")
+                invalidate(key[0])
+
+
+WRITE_QUEUE = WriteQueue(interval=1.0)
+atexit.register(WRITE_QUEUE.flush)
+
+
+def queue_write(key, write):
+    """ Queues write(session) to run within a second, replacing any write
+        still pending for key. """
+    WRITE_QUEUE.put(key, write)
+
+
+def flush_writes():
+    """ Commits every queued write now, e.g. before reading the database
+        or replacing the process. """
+    WRITE_QUEUE.flush()
+
+
+class TableCache:
+    """ LRU cache with a time to live for the lookups done on one table. """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Returns (found, value) for key. """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+
+CACHES = {}
+
+
+def _cache_key(args):
+    # Ids reach the accessors both as int and str, so they share an entry.
+    return tuple(str(arg) for arg in args)
+
+
+def cached(table, ttl=300, maxsize=1024):
+    """ Caches the results of a read accessor of table by its arguments.
+        Writers of the table must call invalidate() after committing. """
+    cache = CACHES.setdefault(table, TableCache(ttl, maxsize))
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args):
+            key = _cache_key(args)
+            found, value = cache.get(key)
+            if not found:
+                # Queued writes must land before the database is read.
+                flush_writes()
+                value = func(*args)
+                cache.set(key, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def update_cache(table, value, *args):
+    """ Stores value as the cached lookup of table for args, for writers
+        whose change is queued rather than committed yet. """
+    cache = CACHES.get(table)
+    if cache is not None:
+        cache.set(_cache_key(args), value)
+
+
+def invalidate(table, *args):
+    """ Drops the cached lookup of table for args, or all of them. """
+    cache = CACHES.get(table)
+    if cache is not None:
+        cache.invalidate(_cache_key(args) if args else None)
+
+
+def cache_stats():
+    """ Returns the hit and miss counters and size of every table cache. """
+    return {
+        table: {
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "size": len(cache.entries),
+        }
+        for table, cache in CACHES.items()
+    }
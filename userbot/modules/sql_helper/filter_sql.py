@@ -1,19 +1,30 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import (
+        CACHES,
+        SESSION,
+        BASE,
+        TableCache,
+        _cache_key,
+        flush_writes,
+        queue_write,
+        upgrade_table,
+    )
 except ImportError:
     raise AttributeError
-from sqlalchemy import Column, UnicodeText, Numeric, String
+from collections import deque
+
+from sqlalchemy import BigInteger, Column, UnicodeText
 
 
 class Filters(BASE):
     __tablename__ = "filters"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
     keyword = Column(UnicodeText, primary_key=True, nullable=False)
     reply = Column(UnicodeText)
-    f_mesg_id = Column(Numeric)
+    f_mesg_id = Column(BigInteger)
 
     def __init__(self, chat_id, keyword, reply, f_mesg_id):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.keyword = keyword
         self.reply = reply
         self.f_mesg_id = f_mesg_id
@@ -24,47 +35,181 @@ class Filters(BASE):
             and self.keyword == other.keyword)
 
 
+upgrade_table(Filters.__table__)
 Filters.__table__.create(checkfirst=True)
 
 
+def _fold(text):
+    """ Lowercases text without changing its length, so that offsets found
+        in the folded text are valid in the original one. """
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def _is_word(char):
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher:
+    """ Aho-Corasick automaton over the filter keywords of a chat.
+        A keyword matches when it is surrounded by the text boundaries or
+        non-word characters, like the old per-keyword regex did. """
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in keywords:
+            self._add(keyword)
+        self._link()
+
+    def _add(self, keyword):
+        folded = _fold(keyword)
+        if not folded:
+            return
+        state = 0
+        for char in folded:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append((len(folded), keyword))
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def search(self, text):
+        """ Returns the set of keywords found in text, in one pass. """
+        found = set()
+        folded = _fold(text)
+        end = len(folded)
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, char in enumerate(folded):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not output[state]:
+                continue
+            after = index + 1
+            if after < end and _is_word(folded[after]):
+                continue
+            for length, keyword in output[state]:
+                before = after - length
+                if before == 0 or not _is_word(folded[before - 1]):
+                    found.add(keyword)
+        return found
+
+
+# (chat_id,) -> {keyword: Filters}, filled from the database on first use
+# and bounded like the caches of the other tables. It is keyed like them, so
+# invalidate("filters", chat_id) and update_cache() reach it. A chat's dict
+# is replaced rather than changed, so it can be read while the database
+# thread writes.
+FILTERS_INDEX = CACHES.setdefault("filters", TableCache(ttl=300, maxsize=1024))
+# (chat_id,) -> (filters, KeywordMatcher over them), rebuilt lazily when
+# the chat's filters dict is not the one it was built for.
+MATCHERS = TableCache(ttl=300, maxsize=1024)
+
+
+def _chat_filters(chat_id):
+    key = _cache_key((chat_id,))
+    found, filters = FILTERS_INDEX.get(key)
+    if not found:
+        filters = {filt.keyword: filt for filt in get_filters(chat_id)}
+        FILTERS_INDEX.set(key, filters)
+    return filters
+
+
+def _update_index(chat_id, keyword, filt=None):
+    key = _cache_key((chat_id,))
+    filters = dict(_chat_filters(chat_id))
+    if filt is None:
+        filters.pop(keyword, None)
+    else:
+        filters[keyword] = filt
+    FILTERS_INDEX.set(key, filters)
+    MATCHERS.invalidate(key)
+
+
+def match_filters(chat_id, text):
+    """ Returns the filters of a chat whose keyword appears in text. """
+    return _match(chat_id, _chat_filters(chat_id), text)
+
+
+def match_cached_filters(chat_id, text):
+    """ Like match_filters(), or None while the filters of the chat are not
+        in memory, so the event loop can match without the database. """
+    found, filters = FILTERS_INDEX.get(_cache_key((chat_id,)))
+    if not found:
+        return None
+    return _match(chat_id, filters, text)
+
+
+def _match(chat_id, filters, text):
+    if not filters or not text:
+        return []
+    key = _cache_key((chat_id,))
+    found, entry = MATCHERS.get(key)
+    if not found or entry[0] is not filters:
+        entry = (filters, KeywordMatcher(filters))
+        MATCHERS.set(key, entry)
+    found = entry[1].search(text)
+    return [filt for keyword, filt in filters.items() if keyword in found]
+
+
 def get_filter(chat_id, keyword):
+    flush_writes()
     try:
-        return SESSION.query(Filters).get((str(chat_id), keyword))
+        return SESSION.query(Filters).get((int(chat_id), keyword))
     finally:
         SESSION.close()
 
 
 def get_filters(chat_id):
+    flush_writes()
     try:
         return SESSION.query(Filters).filter(
-            Filters.chat_id == str(chat_id)).all()
+            Filters.chat_id == int(chat_id)).all()
     finally:
         SESSION.close()
 
 
 def add_filter(chat_id, keyword, reply, f_mesg_id):
-    to_check = get_filter(chat_id, keyword)
-    if not to_check:
-        adder = Filters(str(chat_id), keyword, reply, f_mesg_id)
-        SESSION.add(adder)
-        SESSION.commit()
-        return True
-    else:
-        rem = SESSION.query(Filters).get((str(chat_id), keyword))
-        SESSION.delete(rem)
-        SESSION.commit()
-        adder = Filters(str(chat_id), keyword, reply, f_mesg_id)
-        SESSION.add(adder)
-        SESSION.commit()
-        return False
+    is_new = keyword not in _chat_filters(chat_id)
+    _update_index(chat_id, keyword,
+                  Filters(int(chat_id), keyword, reply, f_mesg_id))
+    queue_write(
+        ("filters", int(chat_id), keyword),
+        lambda session: session.merge(
+            Filters(int(chat_id), keyword, reply, f_mesg_id)),
+    )
+    return is_new
 
 
 def remove_filter(chat_id, keyword):
-    to_check = get_filter(chat_id, keyword)
-    if not to_check:
+    if keyword not in _chat_filters(chat_id):
         return False
-    else:
-        rem = SESSION.query(Filters).get((str(chat_id), keyword))
-        SESSION.delete(rem)
-        SESSION.commit()
-        return True
+    _update_index(chat_id, keyword)
+    queue_write(
+        ("filters", int(chat_id), keyword),
+        lambda session: session.query(Filters).filter(
+            Filters.chat_id == int(chat_id),
+            Filters.keyword == keyword).delete(synchronize_session=False),
+    )
+    return True
@@ -1,5 +1,12 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import (
+        SESSION,
+        BASE,
+        cached,
+        queue_write,
+        update_cache,
+        upgrade_table,
+    )
 except ImportError:
     raise AttributeError
 
@@ -9,16 +16,18 @@ from sqlalchemy import Column, String, UnicodeText
 class Globals(BASE):
     __tablename__ = "globals"
     variable = Column(String, primary_key=True, nullable=False)
-    value = Column(UnicodeText, primary_key=True, nullable=False)
+    value = Column(UnicodeText, nullable=False)
 
     def __init__(self, variable, value):
         self.variable = str(variable)
         self.value = value
 
 
+upgrade_table(Globals.__table__)
 Globals.__table__.create(checkfirst=True)
 
 
+@cached("globals")
 def gvarstatus(variable):
     try:
         return SESSION.query(Globals).filter(
@@ -30,16 +39,17 @@ def gvarstatus(variable):
 
 
 def addgvar(variable, value):
-    if SESSION.query(Globals).filter(
-            Globals.variable == str(variable)).one_or_none():
-        delgvar(variable)
-    adder = Globals(str(variable), value)
-    SESSION.add(adder)
-    SESSION.commit()
+    queue_write(
+        ("globals", str(variable)),
+        lambda session: session.merge(Globals(str(variable), value)),
+    )
+    update_cache("globals", value, variable)
 
 
 def delgvar(variable):
-    rem = SESSION.query(Globals).filter(Globals.variable == str(variable))\
-        .delete(synchronize_session="fetch")
-    if rem:
-        SESSION.commit()
+    queue_write(
+        ("globals", str(variable)),
+        lambda session: session.query(Globals).filter(
+            Globals.variable == str(variable)).delete(synchronize_session=False),
+    )
+    update_cache("globals", None, variable)
@@ -1,39 +1,63 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import SESSION, BASE, upgrade_table
 except ImportError:
     raise AttributeError
 
-from sqlalchemy import Column, String
+from sqlalchemy import BigInteger, Column
 
 
 class GMute(BASE):
     __tablename__ = "gmute"
-    sender = Column(String(14), primary_key=True)
+    sender = Column(BigInteger, primary_key=True, autoincrement=False)
 
     def __init__(self, sender):
-        self.sender = str(sender)
+        self.sender = int(sender)
 
 
+upgrade_table(GMute.__table__)
 GMute.__table__.create(checkfirst=True)
 
+# Ids of every gmuted user, loaded from the table on first use.
+GMUTED = None
+
+
+def _gmuted():
+    global GMUTED
+    if GMUTED is None:
+        try:
+            GMUTED = {row.sender for row in SESSION.query(GMute).all()}
+        finally:
+            SESSION.close()
+    return GMUTED
+
 
 def is_gmuted(sender_id):
-    try:
-        return SESSION.query(GMute).all()
-    except BaseException:
+    return int(sender_id) in _gmuted()
+
+
+def is_gmuted_cached(sender_id):
+    """ Like is_gmuted(), or None while the ids are not loaded yet, so the
+        event loop can check them without touching the database. """
+    if GMUTED is None:
         return None
-    finally:
-        SESSION.close()
+    return int(sender_id) in GMUTED
 
 
 def gmute(sender):
-    adder = GMute(str(sender))
+    if is_gmuted(sender):
+        return False
+    adder = GMute(int(sender))
     SESSION.add(adder)
     SESSION.commit()
+    _gmuted().add(int(sender))
+    return True
 
 
 def ungmute(sender):
-    rem = SESSION.query(GMute).get((str(sender)))
-    if rem:
-        SESSION.delete(rem)
-        SESSION.commit()
+    rem = SESSION.query(GMute).get((int(sender)))
+    if not rem:
+        return False
+    SESSION.delete(rem)
+    SESSION.commit()
+    _gmuted().discard(int(sender))
+    return True
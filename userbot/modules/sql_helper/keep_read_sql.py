@@ -1,22 +1,30 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import (
+        SESSION,
+        BASE,
+        cached,
+        invalidate,
+        upgrade_table,
+    )
 except ImportError:
     raise AttributeError
 
-from sqlalchemy import Column, String
+from sqlalchemy import BigInteger, Column
 
 
 class KRead(BASE):
     __tablename__ = "kread"
-    groupid = Column(String(14), primary_key=True)
+    groupid = Column(BigInteger, primary_key=True, autoincrement=False)
 
     def __init__(self, sender):
-        self.groupid = str(sender)
+        self.groupid = int(sender)
 
 
+upgrade_table(KRead.__table__)
 KRead.__table__.create(checkfirst=True)
 
 
+@cached("kread", ttl=600)
 def is_kread():
     try:
         return SESSION.query(KRead).all()
@@ -27,13 +35,15 @@ def is_kread():
 
 
 def kread(chat):
-    adder = KRead(str(chat))
+    adder = KRead(int(chat))
     SESSION.add(adder)
     SESSION.commit()
+    invalidate("kread")
 
 
 def unkread(chat):
-    rem = SESSION.query(KRead).get((str(chat)))
+    rem = SESSION.query(KRead).get((int(chat)))
     if rem:
         SESSION.delete(rem)
         SESSION.commit()
+        invalidate("kread")
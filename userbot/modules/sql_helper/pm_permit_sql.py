@@ -1,25 +1,33 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import (
+        SESSION,
+        BASE,
+        cached,
+        invalidate,
+        upgrade_table,
+    )
 except ImportError:
     raise AttributeError
-from sqlalchemy import Column, String
+from sqlalchemy import BigInteger, Column
 
 
 class PMPermit(BASE):
     __tablename__ = "pmpermit"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
 
     def __init__(self, chat_id):
-        self.chat_id = str(chat_id)  # ensure string
+        self.chat_id = int(chat_id)
 
 
+upgrade_table(PMPermit.__table__)
 PMPermit.__table__.create(checkfirst=True)
 
 
+@cached("pmpermit", ttl=600)
 def is_approved(chat_id):
     try:
         return SESSION.query(PMPermit).filter(
-            PMPermit.chat_id == str(chat_id)).one()
+            PMPermit.chat_id == int(chat_id)).one()
     except BaseException:
         return None
     finally:
@@ -27,13 +35,15 @@ def is_approved(chat_id):
 
 
 def approve(chat_id):
-    adder = PMPermit(str(chat_id))
+    adder = PMPermit(int(chat_id))
     SESSION.add(adder)
     SESSION.commit()
+    invalidate("pmpermit", chat_id)
 
 
 def dissprove(chat_id):
-    rem = SESSION.query(PMPermit).get(str(chat_id))
+    rem = SESSION.query(PMPermit).get(int(chat_id))
     if rem:
         SESSION.delete(rem)
         SESSION.commit()
+        invalidate("pmpermit", chat_id)
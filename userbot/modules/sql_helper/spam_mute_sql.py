@@ -1,41 +1,72 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import SESSION, BASE, upgrade_table
 except ImportError:
     raise AttributeError
 
-from sqlalchemy import Column, String
+from sqlalchemy import BigInteger, Column
 
 
 class Mute(BASE):
     __tablename__ = "muted"
-    chat_id = Column(String(14), primary_key=True)
-    sender = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    sender = Column(BigInteger, primary_key=True)
 
     def __init__(self, chat_id, sender):
-        self.chat_id = str(chat_id)  # ensure string
-        self.sender = str(sender)
+        self.chat_id = int(chat_id)
+        self.sender = int(sender)
 
 
+upgrade_table(Mute.__table__)
 Mute.__table__.create(checkfirst=True)
 
+# chat_id -> ids of the users muted there, loaded from the table on first use.
+MUTED = None
 
-def is_muted(chat_id):
-    try:
-        return SESSION.query(Mute).filter(Mute.chat_id == str(chat_id)).all()
-    except BaseException:
+
+def _muted():
+    global MUTED
+    if MUTED is None:
+        muted = {}
+        try:
+            for row in SESSION.query(Mute).all():
+                muted.setdefault(row.chat_id, set()).add(row.sender)
+        finally:
+            SESSION.close()
+        MUTED = muted
+    return MUTED
+
+
+def is_muted(chat_id, sender):
+    return int(sender) in _muted().get(int(chat_id), ())
+
+
+def is_muted_cached(chat_id, sender):
+    """ Like is_muted(), or None while the mutes are not loaded yet, so the
+        event loop can check them without touching the database. """
+    if MUTED is None:
         return None
-    finally:
-        SESSION.close()
+    return int(sender) in MUTED.get(int(chat_id), ())
 
 
 def mute(chat_id, sender):
-    adder = Mute(str(chat_id), str(sender))
+    if is_muted(chat_id, sender):
+        return False
+    adder = Mute(int(chat_id), int(sender))
     SESSION.add(adder)
     SESSION.commit()
+    _muted().setdefault(int(chat_id), set()).add(int(sender))
+    return True
 
 
 def unmute(chat_id, sender):
-    rem = SESSION.query(Mute).get(((str(chat_id)), (str(sender))))
-    if rem:
-        SESSION.delete(rem)
-        SESSION.commit()
+    rem = SESSION.query(Mute).get(((int(chat_id)), (int(sender))))
+    if not rem:
+        return False
+    SESSION.delete(rem)
+    SESSION.commit()
+    senders = _muted().get(int(chat_id))
+    if senders is not None:
+        senders.discard(int(sender))
+        if not senders:
+            del MUTED[int(chat_id)]
+    return True
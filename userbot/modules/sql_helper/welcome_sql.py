@@ -1,73 +1,89 @@
 try:
-    from userbot.modules.sql_helper import SESSION, BASE
+    from userbot.modules.sql_helper import (
+        SESSION,
+        BASE,
+        cached,
+        flush_writes,
+        queue_write,
+        update_cache,
+        upgrade_table,
+    )
 except ImportError:
     raise AttributeError
 
-from sqlalchemy import BigInteger, Column, Numeric, String, UnicodeText
+from sqlalchemy import BigInteger, Column, UnicodeText
 
 
 class Welcome(BASE):
     __tablename__ = "welcome"
-    chat_id = Column(String(14), primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
     previous_welcome = Column(BigInteger)
     reply = Column(UnicodeText)
-    f_mesg_id = Column(Numeric)
+    f_mesg_id = Column(BigInteger)
 
     def __init__(self, chat_id, previous_welcome, reply, f_mesg_id):
-        self.chat_id = str(chat_id)
+        self.chat_id = int(chat_id)
         self.previous_welcome = previous_welcome
         self.reply = reply
         self.f_mesg_id = f_mesg_id
 
 
+upgrade_table(Welcome.__table__)
 Welcome.__table__.create(checkfirst=True)
 
 
 def get_welcome(chat_id):
+    flush_writes()
     try:
-        return SESSION.query(Welcome).get(str(chat_id))
+        return SESSION.query(Welcome).get(int(chat_id))
     finally:
         SESSION.close()
 
 
+@cached("welcome", ttl=600)
 def get_current_welcome_settings(chat_id):
     try:
         return SESSION.query(Welcome).filter(
-            Welcome.chat_id == str(chat_id)).one()
+            Welcome.chat_id == int(chat_id)).one()
     except BaseException:
         return None
     finally:
         SESSION.close()
 
 
+def _save_welcome(chat_id, previous_welcome, reply, f_mesg_id):
+    queue_write(
+        ("welcome", int(chat_id)),
+        lambda session: session.merge(
+            Welcome(chat_id, previous_welcome, reply, f_mesg_id)),
+    )
+
+
 def add_welcome_setting(chat_id, previous_welcome, reply, f_mesg_id):
-    to_check = get_welcome(chat_id)
-    if not to_check:
-        adder = Welcome(chat_id, previous_welcome, reply, f_mesg_id)
-        SESSION.add(adder)
-        SESSION.commit()
-        return True
-    else:
-        rem = SESSION.query(Welcome).get(str(chat_id))
-        SESSION.delete(rem)
-        SESSION.commit()
-        adder = Welcome(chat_id, previous_welcome, reply, f_mesg_id)
-        SESSION.commit()
-        return False
+    is_new = get_current_welcome_settings(chat_id) is None
+    _save_welcome(chat_id, previous_welcome, reply, f_mesg_id)
+    update_cache("welcome", Welcome(chat_id, previous_welcome, reply, f_mesg_id),
+                 chat_id)
+    return is_new
 
 
 def rm_welcome_setting(chat_id):
-    try:
-        rem = SESSION.query(Welcome).get(str(chat_id))
-        if rem:
-            SESSION.delete(rem)
-            SESSION.commit()
-            return True
-    except BaseException:
+    if get_current_welcome_settings(chat_id) is None:
         return False
+    queue_write(
+        ("welcome", int(chat_id)),
+        lambda session: session.query(Welcome).filter(
+            Welcome.chat_id == int(chat_id)).delete(synchronize_session=False),
+    )
+    update_cache("welcome", None, chat_id)
+    return True
 
 
 def update_previous_welcome(chat_id, previous_welcome):
-    row = SESSION.query(Welcome).get(str(chat_id))
+    row = get_current_welcome_settings(chat_id)
+    if row is None:
+        return
+    # The cached row is updated in place; the queued upsert carries the
+    # whole row so it can replace any other write pending for the chat.
     row.previous_welcome = previous_welcome
-    SESSION.commit()
+    _save_welcome(chat_id, previous_welcome, row.reply, row.f_mesg_id)
@@ -85,10 +85,12 @@ async def deploy(event, repo, ups_rem, ac_br, txt):
             return repo.__del__()
         await event.edit("`Userbot dyno build in progress, please wait...`")
         try:
+            from userbot.modules.sql_helper import flush_writes
             from userbot.modules.sql_helper.globals import addgvar, delgvar
 
             delgvar("restartstatus")
             addgvar("restartstatus", f"{event.chat_id}\n{event.id}")
+            flush_writes()
         except AttributeError:
             pass
         ups_rem.fetch(ac_br)
@@ -130,10 +132,12 @@ async def update(event, repo, ups_rem, ac_br):
     )
 
     try:
+        from userbot.modules.sql_helper import flush_writes
         from userbot.modules.sql_helper.globals import addgvar, delgvar
 
         delgvar("restartstatus")
         addgvar("restartstatus", f"{event.chat_id}\n{event.id}")
+        flush_writes()
     except AttributeError:
         pass
 
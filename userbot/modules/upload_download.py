@@ -10,25 +10,51 @@
      downloading/uploading from/to the server. """
 
 import asyncio
-import math
+import mimetypes
 import os
+import tempfile
 import time
 from datetime import datetime
-from urllib.parse import unquote_plus
+from urllib.parse import unquote_plus, urlparse
 
+import aiohttp
 from hachoir.metadata import extractMetadata
 from hachoir.parser import createParser
 from natsort import os_sorted
 from pySmartDL import SmartDL
-from telethon.tl.types import DocumentAttributeAudio, DocumentAttributeVideo
+from telethon.tl.types import (
+    DocumentAttributeAudio,
+    DocumentAttributeFilename,
+    DocumentAttributeVideo,
+    InputMediaUploadedDocument,
+    InputMediaUploadedPhoto,
+)
 
 from userbot import CMD_HELP, LOGS, TEMP_DOWNLOAD_DIRECTORY
 from userbot.events import register
-from userbot.utils import humanbytes, progress, run_cmd
+from userbot.utils import (
+    as_job,
+    check_cancelled,
+    finish_report,
+    humanbytes,
+    progress,
+    progress_bar,
+    report,
+    run_cmd,
+    update_job,
+)
+from userbot.utils.exceptions import CancelProcess
 from userbot.utils.FastTelethon import download_file, upload_file
 
+# Files of a folder prepared at once by .up, and files sent per album.
+FOLDER_WORKERS = 4
+ALBUM_SIZE = 10
+# Read size of .dlup responses, regrouped into upload parts by FastTelethon.
+STREAM_CHUNK = 256 * 1024
+
 
 @register(pattern=r"^\.dl(?: |$)(.*)", outgoing=True)
+@as_job("download")
 async def download(target_file):
     """For .download command, download files to the userbot's server."""
     await target_file.edit("`Processing...`")
@@ -52,37 +78,33 @@ async def download(target_file):
         downloaded_file_name = TEMP_DOWNLOAD_DIRECTORY + "" + file_name
         downloader = SmartDL(url, downloaded_file_name, progress_bar=False)
         downloader.start(blocking=False)
-        c_time = time.time()
-        display_message = None
         while not downloader.isFinished():
+            try:
+                check_cancelled()
+            except CancelProcess:
+                downloader.stop()
+                raise
             status = downloader.get_status().capitalize()
             total_length = downloader.filesize if downloader.filesize else None
             downloaded = downloader.get_dl_size()
-            now = time.time()
-            diff = now - c_time
             percentage = downloader.get_progress() * 100
             speed = downloader.get_speed()
-            progress_str = "[{0}{1}] `{2}%`".format(
-                "".join(["●" for i in range(math.floor(percentage / 10))]),
-                "".join(["○" for i in range(10 - math.floor(percentage / 10))]),
-                round(percentage, 2),
+            progress_str = "[{0}] `{1}%`".format(
+                progress_bar(percentage), round(percentage, 2)
             )
             estimated_total_time = downloader.get_eta(human=True)
-            try:
-                current_message = (
-                    f"`Name` : `{file_name}`\n"
-                    "Status"
-                    f"\n**{status}**... | {progress_str}"
-                    f"\n{humanbytes(downloaded)} of {humanbytes(total_length)}"
-                    f" @ {humanbytes(speed)}"
-                    f"\n`ETA` -> {estimated_total_time}"
-                )
-
-                if round(diff % 15.00) == 0 and current_message != display_message:
-                    await target_file.edit(current_message)
-                    display_message = current_message
-            except Exception as e:
-                LOGS.info(str(e))
+            report(
+                target_file,
+                f"`Name` : `{file_name}`\n"
+                "Status"
+                f"\n**{status}**... | {progress_str}"
+                f"\n{humanbytes(downloaded)} of {humanbytes(total_length)}"
+                f" @ {humanbytes(speed)}"
+                f"\n`ETA` -> {estimated_total_time}",
+            )
+            update_job(downloaded, total_length)
+            await asyncio.sleep(1)
+        await finish_report(target_file)
         if downloader.isSuccessful():
             await target_file.edit(
                 "Downloaded to `{}` successfully !!".format(downloaded_file_name)
@@ -110,14 +132,25 @@ async def download(target_file):
                 outdir = TEMP_DOWNLOAD_DIRECTORY + filename
                 c_time = time.time()
                 start_time = datetime.now()
-                with open(outdir, "wb") as f:
+
+                async def refresh_location():
+                    message = await target_file.client.get_messages(
+                        replied.chat_id, ids=replied.id
+                    )
+                    return message.media.document
+
+                # Keep what an interrupted download of this file left behind,
+                # download_file resumes it.
+                mode = "r+b" if os.path.exists(outdir) else "wb"
+                with open(outdir, mode) as f:
                     result = await download_file(
                         client=target_file.client,
                         location=file,
                         out=f,
-                        progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-                            progress(d, t, target_file, c_time, "[DOWNLOAD]", input_str)
+                        progress_callback=lambda d, t: progress(
+                            d, t, target_file, c_time, "[DOWNLOAD]", input_str
                         ),
+                        refresh_location=refresh_location,
                     )
             else:
                 start_time = datetime.now()
@@ -125,9 +158,12 @@ async def download(target_file):
                     media, TEMP_DOWNLOAD_DIRECTORY
                 )
             dl_time = (datetime.now() - start_time).seconds
+        except CancelProcess:
+            raise
         except Exception as e:  # pylint:disable=C0103,W0703
-            await target_file.edit(str(e))
+            await finish_report(target_file, str(e))
         else:
+            await finish_report(target_file)
             try:
                 await target_file.edit(
                     "Downloaded to `{}` in `{}` seconds.".format(result.name, dl_time)
@@ -140,19 +176,296 @@ async def download(target_file):
         await target_file.edit("See `.help download` for more info.")
 
 
-async def get_video_thumb(file, output):
-    """Get video thumbnail"""
-    command = ["ffmpeg", "-i", file, "-ss", "00:00:01.000", "-vframes", "1", output]
+async def spool(response):
+    """Writes a response of unknown length to a temporary file, whose
+    size upload_file then reads from disk."""
+    spooled = tempfile.TemporaryFile(dir=TEMP_DOWNLOAD_DIRECTORY)
+    try:
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK):
+            spooled.write(chunk)
+        spooled.flush()
+        size = spooled.tell()
+        spooled.seek(0)
+    except BaseException:
+        spooled.close()
+        raise
+    return spooled, size
+
+
+@register(pattern=r"^\.dlup (.*)", outgoing=True)
+@as_job("upload")
+async def stream_upload(event):
+    """For .dlup command, upload a file from a link straight to the chat."""
+    await event.edit("`Processing...`")
+    input_str = event.pattern_match.group(1)
+    url, _, file_name = input_str.partition("|")
+    url, file_name = url.strip(), file_name.strip()
+    if not os.path.isdir(TEMP_DOWNLOAD_DIRECTORY):
+        os.makedirs(TEMP_DOWNLOAD_DIRECTORY)
+    start_time = datetime.now()
+    try:
+        async with aiohttp.ClientSession() as session:
+            # Without compression the body is exactly Content-Length bytes.
+            async with session.get(
+                url, headers={"Accept-Encoding": "identity"}
+            ) as response:
+                if response.status != 200:
+                    return await event.edit(
+                        f"`Link returned HTTP {response.status}`\n{url}"
+                    )
+                if not file_name:
+                    file_name = (
+                        response.content_disposition
+                        and response.content_disposition.filename
+                    ) or unquote_plus(os.path.basename(urlparse(url).path))
+                file_name = file_name or "file"
+                c_time = time.time()
+
+                def callback(d, t):
+                    return progress(d, t, event, c_time, "[FILE - UPLOAD]", file_name)
+
+                if response.content_length:
+                    result = await upload_file(
+                        client=event.client,
+                        file=response.content.iter_chunked(STREAM_CHUNK),
+                        name=file_name,
+                        progress_callback=callback,
+                        size=response.content_length,
+                    )
+                else:
+                    """- Unknown length, upload needs the size first -"""
+                    await event.edit(f"`Downloading {file_name}...`")
+                    spooled, size = await spool(response)
+                    with spooled:
+                        result = await upload_file(
+                            client=event.client,
+                            file=spooled,
+                            name=file_name,
+                            progress_callback=callback,
+                            size=size,
+                        )
+    except CancelProcess:
+        raise
+    except Exception as e:  # pylint:disable=C0103,W0703
+        return await finish_report(event, f"`{e}`")
+    await finish_report(event)
+    up_time = (datetime.now() - start_time).seconds
+    await event.client.send_file(
+        event.chat_id,
+        result,
+        caption=file_name,
+        force_document=False,
+        allow_cache=False,
+        reply_to=event.message.id,
+    )
+    await event.edit(f"Uploaded successfully in `{up_time}` seconds.")
+
+
+async def get_video_thumb(file):
+    """Get video thumbnail, into a file of its own so that uploads running
+    at the same time never share one. The caller removes it."""
+    if not os.path.isdir(TEMP_DOWNLOAD_DIRECTORY):
+        os.makedirs(TEMP_DOWNLOAD_DIRECTORY)
+    fd, output = tempfile.mkstemp(suffix=".jpg", dir=TEMP_DOWNLOAD_DIRECTORY)
+    os.close(fd)
+    command = [
+        "ffmpeg", "-y", "-i", file, "-ss", "00:00:01.000", "-vframes", "1", output
+    ]
     t_resp, e_resp = await run_cmd(command)
-    if os.path.lexists(output):
+    if os.path.getsize(output):
         return output
     else:
         LOGS.info(t_resp)
         LOGS.info(e_resp)
+        os.remove(output)
         return None
 
 
+def get_media_attributes(path):
+    """Video or audio attributes of the file, read with hachoir."""
+    if path.lower().endswith(("mp4", "mkv", "webm")):
+        metadata = extractMetadata(createParser(path))
+        duration = 0
+        width = 0
+        height = 0
+        if metadata.has("duration"):
+            duration = metadata.get("duration").seconds
+        if metadata.has("width"):
+            width = metadata.get("width")
+        if metadata.has("height"):
+            height = metadata.get("height")
+        return [
+            DocumentAttributeVideo(
+                duration=duration,
+                w=width,
+                h=height,
+                round_message=False,
+                supports_streaming=True,
+            )
+        ]
+    if path.lower().endswith(("mp3", "flac", "wav")):
+        metadata = extractMetadata(createParser(path))
+        duration = 0
+        artist = ""
+        title = ""
+        if metadata.has("duration"):
+            duration = metadata.get("duration").seconds
+        if metadata.has("title"):
+            title = metadata.get("title")
+        if metadata.has("artist"):
+            artist = metadata.get("artist")
+        return [
+            DocumentAttributeAudio(
+                duration=duration,
+                title=title,
+                performer=artist,
+            )
+        ]
+    return []
+
+
+def media_kind(path):
+    """How Telegram shows the file: photo, video, audio or document."""
+    name = path.lower()
+    # Bigger photos are only accepted as documents.
+    if name.endswith(("jpg", "jpeg", "png")) and os.path.getsize(path) < 10 * 1024 ** 2:
+        return "photo"
+    if name.endswith(("mp4", "mkv", "webm")):
+        return "video"
+    if name.endswith(("mp3", "flac", "wav")):
+        return "audio"
+    return "document"
+
+
+def group_media(paths):
+    """Splits paths, in order, into albums of up to 10 files. Photos and
+    videos can share an album, audio and documents only their own kind."""
+    groups = []
+    last = None
+    for index, path in enumerate(paths):
+        kind = media_kind(path)
+        album = "visual" if kind in ("photo", "video") else kind
+        if album != last or len(groups[-1]) == ALBUM_SIZE:
+            groups.append([])
+            last = album
+        groups[-1].append(index)
+    return groups
+
+
+async def prepare_media(client, path, progress_callback=None):
+    """Uploads path, while probing its metadata and thumbnail, and returns
+    the InputMedia to send it with."""
+
+    async def upload_path():
+        with open(path, "rb") as f:
+            return await upload_file(
+                client=client,
+                file=f,
+                name=os.path.basename(path),
+                progress_callback=progress_callback,
+            )
+
+    async def thumbnail():
+        if media_kind(path) != "video":
+            return None
+        thumb = await get_video_thumb(path)
+        if thumb is None:
+            return None
+        try:
+            return await client.upload_file(thumb)
+        finally:
+            os.remove(thumb)
+
+    loop = asyncio.get_event_loop()
+    uploaded, attributes, thumb = await asyncio.gather(
+        upload_path(),
+        loop.run_in_executor(None, get_media_attributes, path),
+        thumbnail(),
+    )
+    if media_kind(path) == "photo":
+        return InputMediaUploadedPhoto(file=uploaded)
+    return InputMediaUploadedDocument(
+        file=uploaded,
+        mime_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+        attributes=attributes
+        + [DocumentAttributeFilename(file_name=os.path.basename(path))],
+        thumb=thumb,
+    )
+
+
+async def upload_folder(event, paths):
+    """Uploads paths through a pool of workers and sends them in order,
+    grouped into albums where possible. Returns how many were sent."""
+    if not os.path.isdir(TEMP_DOWNLOAD_DIRECTORY):
+        os.makedirs(TEMP_DOWNLOAD_DIRECTORY)
+    loop = asyncio.get_event_loop()
+    prepared = [loop.create_future() for _ in paths]
+    pending = iter(range(len(paths)))
+    uploaded = [0] * len(paths)
+    total = sum(os.path.getsize(path) for path in paths)
+
+    def file_progress(index):
+        def callback(current, _):
+            check_cancelled()
+            uploaded[index] = current
+            update_job(sum(uploaded), total)
+        return callback
+
+    async def worker():
+        for index in pending:
+            try:
+                check_cancelled()
+                prepared[index].set_result(
+                    await prepare_media(
+                        event.client, paths[index], file_progress(index)
+                    )
+                )
+            except Exception as e:  # pylint:disable=C0103,W0703
+                prepared[index].set_exception(e)
+
+    workers = [loop.create_task(worker()) for _ in range(FOLDER_WORKERS)]
+    sent = 0
+    try:
+        for group in group_media(paths):
+            check_cancelled()
+            media = []
+            captions = []
+            for index in group:
+                try:
+                    media.append(await prepared[index])
+                    captions.append(os.path.basename(paths[index]))
+                except CancelProcess:
+                    raise
+                except Exception as e:  # pylint:disable=C0103,W0703
+                    LOGS.info(f"Failed to upload {paths[index]}: {e}")
+            if not media:
+                continue
+            try:
+                await event.client.send_file(
+                    event.chat_id,
+                    media if len(media) > 1 else media[0],
+                    caption=captions if len(media) > 1 else captions[0],
+                )
+            except Exception as e:  # pylint:disable=C0103,W0703
+                LOGS.info(f"Failed to send {', '.join(captions)}: {e}")
+                continue
+            sent += len(media)
+            await event.edit(f"Uploaded `{sent}` of `{len(paths)}` files...")
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Uploads that ended after the folder stopped were never awaited.
+        for future in prepared:
+            if not future.done():
+                future.cancel()
+            elif not future.cancelled():
+                future.exception()
+    return sent
+
+
 @register(pattern=r"^\.up (.*)", outgoing=True)
+@as_job("upload")
 async def upload(event):
     if event.fwd_from:
         return
@@ -164,128 +477,23 @@ async def upload(event):
             start_time = datetime.now()
             file_name = os.path.basename(input_str)
             thumb = None
-            attributes = []
             with open(input_str, "rb") as f:
                 result = await upload_file(
                     client=event.client,
                     file=f,
                     name=file_name,
-                    progress_callback=lambda d, t: asyncio.get_event_loop().create_task(
-                        progress(d, t, event, c_time, "[FILE - UPLOAD]", input_str)
+                    progress_callback=lambda d, t: progress(
+                        d, t, event, c_time, "[FILE - UPLOAD]", input_str
                     ),
                 )
+            await finish_report(event)
             up_time = (datetime.now() - start_time).seconds
-            if input_str.lower().endswith(("mp4", "mkv", "webm")):
-                thumb = await get_video_thumb(input_str, "thumb_image.jpg")
-                metadata = extractMetadata(createParser(input_str))
-                duration = 0
-                width = 0
-                height = 0
-                if metadata.has("duration"):
-                    duration = metadata.get("duration").seconds
-                if metadata.has("width"):
-                    width = metadata.get("width")
-                if metadata.has("height"):
-                    height = metadata.get("height")
-                attributes = [
-                    DocumentAttributeVideo(
-                        duration=duration,
-                        w=width,
-                        h=height,
-                        round_message=False,
-                        supports_streaming=True,
-                    )
-                ]
-            elif input_str.lower().endswith(("mp3", "flac", "wav")):
-                metadata = extractMetadata(createParser(input_str))
-                duration = 0
-                artist = ""
-                title = ""
-                if metadata.has("duration"):
-                    duration = metadata.get("duration").seconds
-                if metadata.has("title"):
-                    title = metadata.get("title")
-                if metadata.has("artist"):
-                    artist = metadata.get("artist")
-                attributes = [
-                    DocumentAttributeAudio(
-                        duration=duration,
-                        title=title,
-                        performer=artist,
-                    )
-                ]
-            await event.client.send_file(
-                event.chat_id,
-                result,
-                thumb=thumb,
-                caption=file_name,
-                force_document=False,
-                allow_cache=False,
-                reply_to=event.message.id,
-                attributes=attributes,
+            attributes = await asyncio.get_event_loop().run_in_executor(
+                None, get_media_attributes, input_str
             )
-            if thumb is not None:
-                os.remove(thumb)
-            await event.edit(f"Uploaded successfully in `{up_time}` seconds.")
-        elif os.path.isdir(input_str):
-            start_time = datetime.now()
-            lst_files = []
-            for root, dirs, files in os.walk(input_str):
-                for file in files:
-                    lst_files.append(os.path.join(root, file))
-            if len(lst_files) == 0:
-                return await event.edit(f"`{input_str}` is empty.")
-            await event.edit(f"Found `{len(lst_files)}` files. Now uploading...")
-            for files in os_sorted(lst_files):
-                file_name = os.path.basename(files)
-                thumb = None
-                attributes = []
-                msg = await event.reply(f"Uploading `{files}`")
-                with open(files, "rb") as f:
-                    result = await upload_file(
-                        client=event.client,
-                        file=f,
-                        name=file_name,
-                    )
-                if file_name.lower().endswith(("mp4", "mkv", "webm")):
-                    thumb = await get_video_thumb(files, "thumb_image.jpg")
-                    metadata = extractMetadata(createParser(files))
-                    duration = 0
-                    width = 0
-                    height = 0
-                    if metadata.has("duration"):
-                        duration = metadata.get("duration").seconds
-                    if metadata.has("width"):
-                        width = metadata.get("width")
-                    if metadata.has("height"):
-                        height = metadata.get("height")
-                    attributes = [
-                        DocumentAttributeVideo(
-                            duration=duration,
-                            w=width,
-                            h=height,
-                            round_message=False,
-                            supports_streaming=True,
-                        )
-                    ]
-                elif file_name.lower().endswith(("mp3", "flac", "wav")):
-                    metadata = extractMetadata(createParser(files))
-                    duration = 0
-                    title = ""
-                    artist = ""
-                    if metadata.has("duration"):
-                        duration = metadata.get("duration").seconds
-                    if metadata.has("title"):
-                        title = metadata.get("title")
-                    if metadata.has("artist"):
-                        artist = metadata.get("artist")
-                    attributes = [
-                        DocumentAttributeAudio(
-                            duration=duration,
-                            title=title,
-                            performer=artist,
-                        )
-                    ]
+            if input_str.lower().endswith(("mp4", "mkv", "webm")):
+                thumb = await get_video_thumb(input_str)
+            try:
                 await event.client.send_file(
                     event.chat_id,
                     result,
@@ -293,16 +501,27 @@ async def upload(event):
                     caption=file_name,
                     force_document=False,
                     allow_cache=False,
+                    reply_to=event.message.id,
                     attributes=attributes,
                 )
-                await msg.delete()
+            finally:
                 if thumb is not None:
                     os.remove(thumb)
-
+            await event.edit(f"Uploaded successfully in `{up_time}` seconds.")
+        elif os.path.isdir(input_str):
+            start_time = datetime.now()
+            lst_files = []
+            for root, dirs, files in os.walk(input_str):
+                for file in files:
+                    lst_files.append(os.path.join(root, file))
+            if len(lst_files) == 0:
+                return await event.edit(f"`{input_str}` is empty.")
+            await event.edit(f"Found `{len(lst_files)}` files. Now uploading...")
+            sent = await upload_folder(event, os_sorted(lst_files))
             await event.delete()
             up_time = (datetime.now() - start_time).seconds
             await event.respond(
-                f"Uploaded `{len(lst_files)}` files in `{input_str}` folder "
+                f"Uploaded `{sent}` files in `{input_str}` folder "
                 f"in `{up_time}` seconds."
             )
     else:
@@ -313,6 +532,9 @@ CMD_HELP.update(
     {
         "download": ">`.dl` <link> | <filename> (optional)"
         "\nUsage: Downloads file from url to the server."
+        "\n\n>`.dlup` <link> | <filename> (optional)"
+        "\nUsage: Uploads the file from url to the chat as it downloads,"
+        " without saving it on the server first."
         "\n\n>`.dl` <reply to file>"
         "\nUsage: Downloads file from the replied file/media."
         "\n\n>`.up` <file/folder path in server>"
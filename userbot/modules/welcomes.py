@@ -7,13 +7,14 @@ from userbot.events import register
 @bot.on(ChatAction)
 async def welcome_to_chat(event):
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.welcome_sql import (
             get_current_welcome_settings,
             update_previous_welcome,
         )
     except AttributeError:
         return
-    cws = get_current_welcome_settings(event.chat_id)
+    cws = await run_sql(get_current_welcome_settings, event.chat_id)
     if cws:
         """user_added=True,
         user_joined=True,
@@ -79,12 +80,13 @@ async def welcome_to_chat(event):
                 ),
                 file=file_media,
             )
-            update_previous_welcome(event.chat_id, current_message.id)
+            await run_sql(update_previous_welcome, event.chat_id, current_message.id)
 
 
 @register(outgoing=True, pattern=r"^\.savewelcome(?: |$)(.*)")
 async def save_welcome(event):
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.welcome_sql import add_welcome_setting
     except AttributeError:
         return await event.edit("`Running on Non-SQL mode!`")
@@ -111,7 +113,7 @@ async def save_welcome(event):
         rep_msg = await event.get_reply_message()
         string = rep_msg.text
     success = "`Welcome note {}.`"
-    if add_welcome_setting(event.chat_id, 0, string, msg_id) is True:
+    if await run_sql(add_welcome_setting, event.chat_id, 0, string, msg_id) is True:
         await event.edit(success.format("saved"))
     else:
         await event.edit(success.format("updated"))
@@ -120,10 +122,11 @@ async def save_welcome(event):
 @register(outgoing=True, pattern=r"^\.checkwelcome$")
 async def show_welcome(event):
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.welcome_sql import get_current_welcome_settings
     except AttributeError:
         return await event.edit("`Running on Non-SQL mode!`")
-    cws = get_current_welcome_settings(event.chat_id)
+    cws = await run_sql(get_current_welcome_settings, event.chat_id)
     if not cws:
         return await event.edit("`No welcome message saved here.`")
     elif cws and cws.f_mesg_id:
@@ -140,10 +143,11 @@ async def show_welcome(event):
 @register(outgoing=True, pattern=r"^\.rmwelcome$")
 async def del_welcome(event):
     try:
+        from userbot.modules.sql_helper import run_sql
         from userbot.modules.sql_helper.welcome_sql import rm_welcome_setting
     except AttributeError:
         return await event.edit("`Running on Non-SQL mode!`")
-    if rm_welcome_setting(event.chat_id) is True:
+    if await run_sql(rm_welcome_setting, event.chat_id) is True:
         await event.edit("`Welcome note deleted.`")
     else:
         await event.edit("`Do I have a welcome note here ?`")
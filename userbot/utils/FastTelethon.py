@@ -4,13 +4,17 @@ import asyncio
 import hashlib
 import inspect
 import logging
+import json
 import math
 import os
+import time
+import zlib
 from collections import defaultdict
-from typing import Optional, List, AsyncGenerator, Union, Awaitable, DefaultDict, Tuple, BinaryIO
+from typing import Optional, List, AsyncGenerator, AsyncIterable, Union, Awaitable, DefaultDict, Tuple, BinaryIO, Callable, Sequence, Dict, Iterator
 
 from telethon import utils, helpers, TelegramClient
 from telethon.crypto import AuthKey
+from telethon.errors import FileReferenceExpiredError, FloodWaitError
 from telethon.network import MTProtoSender
 from telethon.tl.alltlobjects import LAYER
 from telethon.tl.functions import InvokeWithLayerRequest
@@ -40,41 +44,135 @@ TypeLocation = Union[Document,
                      InputFileLocation,
                      InputPhotoFileLocation]
 
-filename = ""
+# Best connection count found per (DC, "download" or "upload"), the next
+# transfer to the same DC starts from it.
+TUNED_CONNECTIONS: Dict[Tuple[int, str], int] = {}
+# Transfers to a DC not tuned yet start with at least this many
+# connections, as far as the file has parts for them.
+MIN_CONNECTIONS = 4
+
+
+class ConnectionTuner:
+    """Hill-climbs the number of connections of one transfer.
+
+    Every interval seconds the throughput is compared with the previous
+    one. While it improves the count keeps moving the same way, when it
+    drops the direction reverses, and FloodWait or timeouts halve it.
+    The first sample is taken early, once every connection brought in
+    warmup_parts parts, so transfers shorter than an interval adapt too.
+    share returns the most connections the scheduler allows right now.
+    """
+    interval: float = 2.0
+    warmup_parts: float = 2
+
+    def __init__(self, key: Tuple[int, str], start: int, maximum: int,
+                 share: Optional[Callable[[], int]] = None) -> None:
+        self.key = key
+        self.maximum = max(1, maximum)
+        self.share = share
+        self.target = max(1, min(start, self.limit()))
+        self.direction = 1
+        self.transferred = 0
+        self.parts = 0
+        self.sampled = False
+        self.sampled_at = time.monotonic()
+        self.last_rate = 0.0
+        self.best_rate = 0.0
+        self.best = self.target
+        self.throttled = False
+
+    def record(self, size: int) -> None:
+        self.transferred += size
+        self.parts += 1
+
+    def throttle(self) -> None:
+        self.throttled = True
+
+    def limit(self) -> int:
+        if self.share is None:
+            return self.maximum
+        return max(1, min(self.maximum, self.share()))
+
+    def update(self, active: int) -> int:
+        """Returns how many connections to use from now on."""
+        maximum = self.limit()
+        if active > maximum:
+            # The scheduler handed part of ours to another transfer.
+            self.target = maximum
+            return self.target
+        now = time.monotonic()
+        warm = not self.sampled and self.parts >= self.warmup_parts * active
+        if now - self.sampled_at < self.interval and not warm:
+            return self.target
+        rate = self.transferred / (now - self.sampled_at)
+        self.transferred = 0
+        self.sampled = True
+        self.sampled_at = now
+        if rate > self.best_rate:
+            self.best_rate = rate
+            self.best = active
+        step = max(1, active // 4)
+        if self.throttled:
+            self.throttled = False
+            self.direction = -1
+            self.target = active // 2
+        elif rate > self.last_rate * 1.05:
+            self.target = active + self.direction * step
+        elif rate < self.last_rate * 0.95:
+            self.direction = -self.direction
+            self.target = active + self.direction * step
+        self.target = max(1, min(self.target, maximum))
+        self.last_rate = rate
+        return self.target
+
+    def remember(self) -> None:
+        if self.best_rate:
+            TUNED_CONNECTIONS[self.key] = self.best
+
+
+async def _call_with_retry(client: TelegramClient, sender: MTProtoSender,
+                           request, tuner: ConnectionTuner):
+    for attempt in range(3):
+        try:
+            return await client._call(sender, request)
+        except FloodWaitError as error:
+            tuner.throttle()
+            if attempt == 2:
+                raise
+            log.debug(f"Flood wait of {error.seconds}s on a transfer connection")
+            await asyncio.sleep(error.seconds)
+        except (asyncio.TimeoutError, ConnectionError):
+            tuner.throttle()
+            if attempt == 2:
+                raise
 
 
 class DownloadSender:
     client: TelegramClient
     sender: MTProtoSender
     request: GetFileRequest
-    remaining: int
-    stride: int
+    tuner: ConnectionTuner
 
     def __init__(
             self,
             client: TelegramClient,
             sender: MTProtoSender,
             file: TypeLocation,
-            offset: int,
             limit: int,
-            stride: int,
-            count: int) -> None:
+            tuner: ConnectionTuner) -> None:
         self.sender = sender
         self.client = client
-        self.request = GetFileRequest(file, offset=offset, limit=limit)
-        self.stride = stride
-        self.remaining = count
-
-    async def next(self) -> Optional[bytes]:
-        if not self.remaining:
-            return None
-        result = await self.client._call(self.sender, self.request)
-        self.remaining -= 1
-        self.request.offset += self.stride
+        self.request = GetFileRequest(file, offset=0, limit=limit)
+        self.tuner = tuner
+
+    async def next(self, offset: int) -> bytes:
+        self.request.offset = offset
+        result = await _call_with_retry(self.client, self.sender, self.request,
+                                        self.tuner)
         return result.bytes
 
-    def disconnect(self) -> Awaitable[None]:
-        return self.sender.disconnect()
+    async def finish(self, cancel: bool = False) -> None:
+        pass
 
 
 class UploadSender:
@@ -82,7 +180,7 @@ class UploadSender:
     sender: MTProtoSender
     request: Union[SaveFilePartRequest, SaveBigFilePartRequest]
     part_count: int
-    stride: int
+    tuner: ConnectionTuner
     previous: Optional[asyncio.Task]
     loop: asyncio.AbstractEventLoop
 
@@ -93,38 +191,201 @@ class UploadSender:
             file_id: int,
             part_count: int,
             big: bool,
-            index: int,
-            stride: int,
+            tuner: ConnectionTuner,
             loop: asyncio.AbstractEventLoop) -> None:
         self.client = client
         self.sender = sender
         self.part_count = part_count
         if big:
             self.request = SaveBigFilePartRequest(
-                file_id, index, part_count, b"")
+                file_id, 0, part_count, b"")
         else:
-            self.request = SaveFilePartRequest(file_id, index, b"")
-        self.stride = stride
+            self.request = SaveFilePartRequest(file_id, 0, b"")
+        self.tuner = tuner
         self.previous = None
         self.loop = loop
 
-    async def next(self, data: bytes) -> None:
+    async def next(self, index: int, data: bytes) -> None:
         if self.previous:
             await self.previous
-        self.previous = self.loop.create_task(self._next(data))
+        self.previous = self.loop.create_task(self._next(index, data))
 
-    async def _next(self, data: bytes) -> None:
+    async def _next(self, index: int, data: bytes) -> None:
+        self.request.file_part = index
         self.request.bytes = data
         log.debug(
-            f"Sending file part {self.request.file_part}/{self.part_count}"
+            f"Sending file part {index}/{self.part_count}"
             f" with {len(data)} bytes")
-        await self.client._call(self.sender, self.request)
-        self.request.file_part += self.stride
-
-    async def disconnect(self) -> None:
-        if self.previous:
+        await _call_with_retry(self.client, self.sender, self.request, self.tuner)
+
+    async def finish(self, cancel: bool = False) -> None:
+        if not self.previous:
+            return
+        if cancel:
+            self.previous.cancel()
+            await asyncio.gather(self.previous, return_exceptions=True)
+        else:
             await self.previous
-        return await self.sender.disconnect()
+
+
+class SenderPool:
+    """Connected MTProtoSenders kept per client and DC for reuse.
+
+    Transfers take their senders from here and hand them back when done,
+    so consecutive transfers skip connecting and, for foreign DCs, the
+    authorization export, which is done once per DC and its key kept.
+    At most max_connections senders are lent out at once, waiting
+    transfers get the freed ones by priority. Senders left idle for
+    idle_timeout seconds are disconnected.
+    """
+
+    def __init__(self, max_connections: int = 40, idle_timeout: float = 60) -> None:
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.in_use = 0
+        self.idle: DefaultDict[Tuple[TelegramClient, int], List[Tuple[MTProtoSender, float]]] = defaultdict(list)
+        self.auth_keys: Dict[Tuple[TelegramClient, int], AuthKey] = {}
+        self.auth_locks: DefaultDict[Tuple[TelegramClient, int], asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.released: Optional[asyncio.Condition] = None
+        self.waiting: List[int] = []
+        self.reaper: Optional[asyncio.Task] = None
+
+    async def acquire(self, client: TelegramClient, dc_id: int,
+                      wait: bool = True, priority: int = 1) -> Optional[MTProtoSender]:
+        """Returns a connected sender for dc_id, or None when all of them
+        are lent out, or wanted by a waiting transfer, and wait is False."""
+        if self.in_use >= self.max_connections or self.waiting:
+            if not wait:
+                return None
+            await self._wait_turn(priority)
+        else:
+            self.in_use += 1
+        try:
+            idle = self.idle[(client, dc_id)]
+            while idle:
+                sender, _ = idle.pop()
+                if sender.is_connected():
+                    return sender
+            return await self._connect(client, dc_id)
+        except BaseException:
+            self.in_use -= 1
+            self._notify()
+            raise
+
+    async def _wait_turn(self, priority: int) -> None:
+        """Waits until a connection is free for priority and takes it."""
+        if self.released is None:
+            self.released = asyncio.Condition()
+        self.waiting.append(priority)
+        try:
+            async with self.released:
+                await self.released.wait_for(lambda: self._take(priority))
+        finally:
+            self.waiting.remove(priority)
+        # Room may be left for the next waiter.
+        self._notify()
+
+    def _take(self, priority: int) -> bool:
+        # Taken within the predicate, so waiters woken together can't
+        # all pass it before any of them counts its connection.
+        if self.in_use < self.max_connections and priority >= max(self.waiting):
+            self.in_use += 1
+            return True
+        return False
+
+    def _notify(self) -> None:
+        if self.released is not None and self.waiting:
+            asyncio.get_event_loop().create_task(self._wake())
+
+    async def _wake(self) -> None:
+        async with self.released:
+            self.released.notify_all()
+
+    async def release(self, client: TelegramClient, dc_id: int,
+                      sender: MTProtoSender, reusable: bool = True) -> None:
+        """Hands sender back. Senders whose transfer failed are not
+        reused, they may still have requests in flight."""
+        # Nothing is awaited until the sender is either kept or being
+        # disconnected, so a cancel can't leave it connected and untracked.
+        self.in_use -= 1
+        self._notify()
+        if not reusable or not sender.is_connected():
+            await asyncio.shield(sender.disconnect())
+            return
+        self.idle[(client, dc_id)].append((sender, time.monotonic()))
+        if self.reaper is None or self.reaper.done():
+            self.reaper = client.loop.create_task(self._reap())
+
+    async def _reap(self) -> None:
+        while any(self.idle.values()):
+            await asyncio.sleep(self.idle_timeout / 2)
+            deadline = time.monotonic() - self.idle_timeout
+            for idle in list(self.idle.values()):
+                expired = [sender for sender, since in idle if since < deadline]
+                idle[:] = [(sender, since) for sender, since in idle if since >= deadline]
+                for sender in expired:
+                    await sender.disconnect()
+
+    async def _connect(self, client: TelegramClient, dc_id: int) -> MTProtoSender:
+        if dc_id == client.session.dc_id:
+            return await self._new_sender(client, dc_id, client.session.auth_key)
+        key = (client, dc_id)
+        if key in self.auth_keys:
+            return await self._new_sender(client, dc_id, self.auth_keys[key])
+        # Only one sender exports the authorization, the others wait for it
+        # and use the resulting key.
+        async with self.auth_locks[key]:
+            if key in self.auth_keys:
+                return await self._new_sender(client, dc_id, self.auth_keys[key])
+            sender = await self._new_sender(client, dc_id, None)
+            log.debug(f"Exporting auth to DC {dc_id}")
+            auth = await client(ExportAuthorizationRequest(dc_id))
+            client._init_request.query = ImportAuthorizationRequest(
+                id=auth.id, bytes=auth.bytes)
+            req = InvokeWithLayerRequest(LAYER, client._init_request)
+            await sender.send(req)
+            self.auth_keys[key] = sender.auth_key
+            return sender
+
+    @staticmethod
+    async def _new_sender(client: TelegramClient, dc_id: int,
+                          auth_key: Optional[AuthKey]) -> MTProtoSender:
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=client._log)
+        await sender.connect(client._connection(dc.ip_address, dc.port, dc.id,
+                                                loggers=client._log,
+                                                proxy=client._proxy))
+        return sender
+
+
+SENDER_POOL = SenderPool()
+
+
+class TransferScheduler:
+    """Splits the connections of the pool between the running transfers.
+
+    Each transfer may use a share of the pool proportional to its
+    priority, and its tuner stays within that share. A new transfer thus
+    takes connections from the running ones as they shrink, instead of
+    waiting for them to finish.
+    """
+
+    def __init__(self, pool: SenderPool) -> None:
+        self.pool = pool
+        self.priorities: Dict["ParallelTransferrer", int] = {}
+
+    def register(self, transfer: "ParallelTransferrer") -> None:
+        self.priorities[transfer] = transfer.priority
+
+    def unregister(self, transfer: "ParallelTransferrer") -> None:
+        self.priorities.pop(transfer, None)
+
+    def share(self, transfer: "ParallelTransferrer") -> int:
+        total = sum(self.priorities.values()) or 1
+        return self.pool.max_connections * self.priorities.get(transfer, 1) // total
+
+
+TRANSFERS = TransferScheduler(SENDER_POOL)
 
 
 class ParallelTransferrer:
@@ -132,24 +393,41 @@ class ParallelTransferrer:
     loop: asyncio.AbstractEventLoop
     dc_id: int
     senders: Optional[List[Union[DownloadSender, UploadSender]]]
-    auth_key: AuthKey
+    tuner: Optional[ConnectionTuner]
+    location: Optional[TypeLocation]
+    priority: int
     upload_ticker: int
+    upload_part: int
 
     def __init__(
             self,
             client: TelegramClient,
-            dc_id: Optional[int] = None) -> None:
+            dc_id: Optional[int] = None,
+            priority: int = 1) -> None:
         self.client = client
         self.loop = self.client.loop
         self.dc_id = dc_id or self.client.session.dc_id
-        self.auth_key = (None if dc_id and self.client.session.dc_id != dc_id
-                         else self.client.session.auth_key)
+        self.priority = priority
         self.senders = None
+        self.tuner = None
+        self.location = None
+        self.refresh_lock = asyncio.Lock()
         self.upload_ticker = 0
-
-    async def _cleanup(self) -> None:
-        await asyncio.gather(*[sender.disconnect() for sender in self.senders])
-        self.senders = None
+        self.upload_part = 0
+
+    async def _cleanup(self, reusable: bool = True) -> None:
+        TRANSFERS.unregister(self)
+        senders, self.senders = self.senders or [], None
+        try:
+            await asyncio.gather(*[sender.finish(cancel=not reusable)
+                                   for sender in senders])
+        except BaseException:
+            reusable = False
+            raise
+        finally:
+            await asyncio.gather(*[
+                SENDER_POOL.release(self.client, self.dc_id, sender.sender, reusable)
+                for sender in senders])
 
     @staticmethod
     def _get_connection_count(file_size: int, max_count: int = 20,
@@ -158,191 +436,569 @@ class ParallelTransferrer:
             return max_count
         return math.ceil((file_size / full_size) * max_count)
 
-    async def _init_download(self, connections: int, file: TypeLocation, part_count: int,
-                             part_size: int) -> None:
-        minimum, remainder = divmod(part_count, connections)
-
-        def get_part_count() -> int:
-            nonlocal remainder
-            if remainder > 0:
-                remainder -= 1
-                return minimum + 1
-            return minimum
-
-        # The first cross-DC sender will export+import the authorization, so we always create it
-        # before creating any other senders.
-        self.senders = [
-            await self._create_download_sender(file, 0, part_size, connections * part_size,
-                                               get_part_count()),
-            *await asyncio.gather(
-                *[self._create_download_sender(file, i, part_size, connections * part_size,
-                                               get_part_count())
-                  for i in range(1, connections)])
-        ]
-
-    async def _create_download_sender(self, file: TypeLocation, index: int, part_size: int,
-                                      stride: int,
-                                      part_count: int) -> DownloadSender:
-        return DownloadSender(self.client, await self._create_sender(), file, index * part_size, part_size,
-                              stride, part_count)
-
-    async def _init_upload(self, connections: int, file_id: int, part_count: int, big: bool
-                           ) -> None:
-        self.senders = [
-            await self._create_upload_sender(file_id, part_count, big, 0, connections),
-            *await asyncio.gather(
-                *[self._create_upload_sender(file_id, part_count, big, i, connections)
-                  for i in range(1, connections)])
-        ]
-
-    async def _create_upload_sender(self, file_id: int, part_count: int, big: bool, index: int,
-                                    stride: int) -> UploadSender:
-        return UploadSender(self.client, await self._create_sender(), file_id, part_count, big, index, stride,
-                            loop=self.loop)
-
-    async def _create_sender(self) -> MTProtoSender:
-        dc = await self.client._get_dc(self.dc_id)
-        sender = MTProtoSender(self.auth_key, loggers=self.client._log)
-        await sender.connect(self.client._connection(dc.ip_address, dc.port, dc.id,
-                                                     loggers=self.client._log,
-                                                     proxy=self.client._proxy))
-        if not self.auth_key:
-            log.debug(f"Exporting auth to DC {self.dc_id}")
-            auth = await self.client(ExportAuthorizationRequest(self.dc_id))
-            self.client._init_request.query = ImportAuthorizationRequest(
-                id=auth.id, bytes=auth.bytes)
-            req = InvokeWithLayerRequest(LAYER, self.client._init_request)
-            await sender.send(req)
-            self.auth_key = sender.auth_key
-        return sender
+    @staticmethod
+    def _get_part_size(file_size: int, connections: int) -> int:
+        # Bigger parts mean fewer requests, as long as there are still
+        # enough of them to keep every connection busy.
+        minimum = utils.get_appropriated_part_size(file_size)
+        for part_size_kb in (512, 256, 128):
+            if part_size_kb <= minimum or file_size >= part_size_kb * 1024 * connections * 2:
+                return part_size_kb
+        return minimum
+
+    def plan(self, direction: str, file_size: int, part_size_kb: Optional[float] = None,
+             connection_count: Optional[int] = None) -> Tuple[int, int]:
+        """Returns the connection count and part size in KiB to start a
+        transfer with, from what worked best for this DC before."""
+        connection_count = (connection_count
+                            or TUNED_CONNECTIONS.get((self.dc_id, direction))
+                            or max(MIN_CONNECTIONS, self._get_connection_count(file_size)))
+        part_size_kb = part_size_kb or self._get_part_size(file_size, connection_count)
+        return connection_count, part_size_kb
+
+    async def _acquire_senders(self, connections: int) -> List[MTProtoSender]:
+        # The first sender may wait for a free connection and, for a
+        # foreign DC, exports the authorization the others then reuse.
+        # The others are only taken when the pool has room, so a transfer
+        # never waits on another one while holding connections.
+        first = await self._create_sender()
+        try:
+            return [first, *await self._acquire_more(connections - 1)]
+        except BaseException:
+            await SENDER_POOL.release(self.client, self.dc_id, first)
+            raise
+
+    async def _acquire_more(self, connections: int) -> List[MTProtoSender]:
+        # The senders acquired before another one fails, or before the
+        # transfer is cancelled, go back to the pool.
+        tasks = [self.loop.create_task(self._create_sender(wait=False))
+                 for _ in range(connections)]
+        try:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await self._release_acquired(
+                await asyncio.gather(*tasks, return_exceptions=True))
+            raise
+        for result in results:
+            if isinstance(result, BaseException):
+                await self._release_acquired(results)
+                raise result
+        return [sender for sender in results if sender]
+
+    async def _release_acquired(self, results: list) -> None:
+        await asyncio.gather(*[
+            SENDER_POOL.release(self.client, self.dc_id, sender)
+            for sender in results
+            if sender and not isinstance(sender, BaseException)])
+
+    def _create_sender(self, wait: bool = True) -> Awaitable[Optional[MTProtoSender]]:
+        return SENDER_POOL.acquire(self.client, self.dc_id, wait=wait,
+                                   priority=self.priority)
+
+    def _create_tuner(self, direction: str, connections: int, maximum: int) -> ConnectionTuner:
+        TRANSFERS.register(self)
+        return ConnectionTuner((self.dc_id, direction), connections, maximum,
+                               share=lambda: TRANSFERS.share(self))
 
     async def init_upload(self, file_id: int, file_size: int, part_size_kb: Optional[float] = None,
                           connection_count: Optional[int] = None) -> Tuple[int, int, bool]:
-        connection_count = connection_count or self._get_connection_count(
-            file_size)
-        part_size = (
-            part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
+        connections, part_size_kb = self.plan("upload", file_size, part_size_kb,
+                                              connection_count)
+        part_size = int(part_size_kb * 1024)
         part_count = (file_size + part_size - 1) // part_size
         is_large = file_size > 10 * 1024 * 1024
-        await self._init_upload(connection_count, file_id, part_count, is_large)
+        self.tuner = self._create_tuner("upload", connections,
+                                        min(connection_count or 20, part_count))
+        self.upload_args = (file_id, part_count, is_large)
+        self.senders = [
+            UploadSender(self.client, sender, *self.upload_args, self.tuner, loop=self.loop)
+            for sender in await self._acquire_senders(self.tuner.target)
+        ]
         return part_size, part_count, is_large
 
     async def upload(self, part: bytes) -> None:
-        await self.senders[self.upload_ticker].next(part)
+        await self.senders[self.upload_ticker].next(self.upload_part, part)
+        self.upload_part += 1
         self.upload_ticker = (self.upload_ticker + 1) % len(self.senders)
+        self.tuner.record(len(part))
+        await self._retune_upload()
+
+    async def _retune_upload(self) -> None:
+        active = len(self.senders)
+        target = self.tuner.update(active)
+        if target > active:
+            self.senders.extend(
+                UploadSender(self.client, sender, *self.upload_args, self.tuner,
+                             loop=self.loop)
+                for sender in await self._acquire_more(target - active))
+        elif target < active:
+            dropped = self.senders[target:]
+            del self.senders[target:]
+            self.upload_ticker %= target
+            for sender in dropped:
+                await sender.finish()
+                await SENDER_POOL.release(self.client, self.dc_id, sender.sender)
 
     async def finish_upload(self) -> None:
         await self._cleanup()
+        self.tuner.remember()
+
+    async def abort_upload(self) -> None:
+        await self._cleanup(reusable=False)
+
+    async def _refresh_location(self, stale: TypeLocation,
+                                refresh_location: Callable[[], Awaitable[TypeLocation]]
+                                ) -> None:
+        async with self.refresh_lock:
+            if self.location is not stale:
+                # Another connection refreshed it meanwhile.
+                return
+            log.debug("File reference expired, refreshing it")
+            _, self.location = utils.get_input_location(await refresh_location())
+            for sender in self.senders:
+                sender.request.location = self.location
+
+    async def _fetch_part(self, sender: DownloadSender, offset: int,
+                          refresh_location: Optional[Callable[[], Awaitable[TypeLocation]]]
+                          ) -> bytes:
+        for attempt in range(3):
+            location = sender.request.location
+            try:
+                return await sender.next(offset)
+            except FileReferenceExpiredError:
+                if not refresh_location or attempt == 2:
+                    raise
+                await self._refresh_location(location, refresh_location)
+
+    async def download_parts(self, file: TypeLocation, file_size: int,
+                             part_size_kb: Optional[float] = None,
+                             connection_count: Optional[int] = None,
+                             parts: Optional[Sequence[int]] = None,
+                             refresh_location: Optional[Callable[[], Awaitable[TypeLocation]]] = None,
+                             ordered: bool = False
+                             ) -> AsyncGenerator[Tuple[int, bytes], None]:
+        """Yields (offset, data) for every part as soon as it arrives.
+
+        Each connection fetches the next part still wanted as soon as the
+        previous one is handed over, so a slow connection never holds up
+        the others and parts come out of order. Connections are added or
+        dropped along the way as the tuner decides. parts limits the
+        download to those part indices. refresh_location is awaited for a
+        fresh location when Telegram reports the file reference as expired.
+
+        With ordered, parts are yielded in the order of parts instead, and
+        no connection starts on a part more than a window ahead of the
+        next one to yield. A part stuck behind a FloodWait thus holds up
+        the others, rather than letting the rest of the file pile up in
+        memory until it arrives.
+        """
+        connections, part_size_kb = self.plan("download", file_size, part_size_kb,
+                                              connection_count)
+        part_size = int(part_size_kb * 1024)
+        if parts is None:
+            parts = range(math.ceil(file_size / part_size))
+        if not parts:
+            return
+        self.tuner = self._create_tuner("download", connections,
+                                        min(connection_count or 20, len(parts)))
+        log.debug("Starting parallel download: "
+                  f"{self.tuner.target} {part_size} {len(parts)} {file!s}")
+        self.location = file
+        self.senders = []
+
+        # Bounded, so connections wait for the consumer instead of piling
+        # parts up in memory.
+        window = self.tuner.maximum * 2
+        queue: asyncio.Queue = asyncio.Queue(maxsize=window)
+        # Shared by every connection, each takes the next part from it.
+        wanted = enumerate(parts)
+        taken = 0
+        workers = []
+        stopping = 0
+        # Ordered downloads: the position in parts of the next part to
+        # yield, and the parts that arrived ahead of it.
+        position = 0
+        pending: Dict[int, bytes] = {}
+        advanced = asyncio.Condition()
+        ended = False
+
+        async def fetch(sender: DownloadSender) -> None:
+            nonlocal stopping, taken, ended
+            try:
+                for number, index in wanted:
+                    taken += 1
+                    if ordered and number >= position + window:
+                        async with advanced:
+                            await advanced.wait_for(
+                                lambda: number < position + window or ended)
+                    data = await self._fetch_part(sender, index * part_size,
+                                                  refresh_location)
+                    if not data:
+                        ended = True
+                        async with advanced:
+                            advanced.notify_all()
+                        break
+                    await queue.put((index * part_size, data))
+                    if stopping:
+                        # The tuner dropped a connection, hand this one back.
+                        stopping -= 1
+                        self.senders.remove(sender)
+                        await SENDER_POOL.release(self.client, self.dc_id, sender.sender)
+                        break
+            except Exception as error:
+                await queue.put(error)
+            else:
+                await queue.put(None)
+
+        def start(senders: List[MTProtoSender]) -> None:
+            for sender in senders:
+                sender = DownloadSender(self.client, sender, self.location,
+                                        part_size, self.tuner)
+                self.senders.append(sender)
+                workers.append(self.loop.create_task(fetch(sender)))
+
+        finished = False
+        try:
+            start(await self._acquire_senders(self.tuner.target))
+            running = len(workers)
+            part = 0
+            while running:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                if not ordered:
+                    yield item
+                else:
+                    pending[item[0]] = item[1]
+                    while (position < len(parts)
+                           and parts[position] * part_size in pending):
+                        offset = parts[position] * part_size
+                        yield offset, pending.pop(offset)
+                        position += 1
+                        async with advanced:
+                            advanced.notify_all()
+                part += 1
+                log.debug(f"Part {part} downloaded")
+                self.tuner.record(len(item[1]))
+                active = running - stopping
+                target = self.tuner.update(active)
+                # Connections ending at the tail are not replaced, there
+                # would be nothing left for new ones to fetch.
+                if target > active and taken < len(parts):
+                    added = await self._acquire_more(
+                        min(target - active, len(parts) - taken))
+                    start(added)
+                    running += len(added)
+                elif target < active:
+                    stopping += active - target
+            finished = True
+            self.tuner.remember()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            log.debug("Parallel download finished, releasing connections")
+            await self._cleanup(reusable=finished)
 
     async def download(self, file: TypeLocation, file_size: int,
                        part_size_kb: Optional[float] = None,
                        connection_count: Optional[int] = None) -> AsyncGenerator[bytes, None]:
-        connection_count = connection_count or self._get_connection_count(
-            file_size)
-        part_size = (
-            part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
-        part_count = math.ceil(file_size / part_size)
-        log.debug("Starting parallel download: "
-                  f"{connection_count} {part_size} {part_count} {file!s}")
-        await self._init_download(connection_count, file, part_count, part_size)
-
-        part = 0
-        while part < part_count:
-            tasks = []
-            for sender in self.senders:
-                tasks.append(self.loop.create_task(sender.next()))
-            for task in tasks:
-                data = await task
-                if not data:
-                    break
-                yield data
-                part += 1
-                log.debug(f"Part {part} downloaded")
+        """Yields the parts of the file in order."""
+        async for _, data in self.download_parts(
+                file, file_size, part_size_kb, connection_count, ordered=True):
+            yield data
 
-        log.debug("Parallel download finished, cleaning up connections")
-        await self._cleanup()
 
+def read_parts(file_to_read: BinaryIO, part_size: int) -> Iterator[bytes]:
+    """Yields the file in part_size pieces, reading each with one call."""
+    while True:
+        data = file_to_read.read(part_size)
+        # Buffered files only return less at the end, raw ones may not.
+        while data and len(data) < part_size:
+            more = file_to_read.read(part_size - len(data))
+            if not more:
+                break
+            data += more
+        if not data:
+            break
+        yield data
 
-parallel_transfer_locks: DefaultDict[int, asyncio.Lock] = defaultdict(
-    lambda: asyncio.Lock())
 
+async def read_stream_parts(stream: AsyncIterable[bytes],
+                            part_size: int) -> AsyncGenerator[bytes, None]:
+    """Yields the chunks of stream regrouped into part_size pieces.
 
-def stream_file(file_to_stream: BinaryIO, chunk_size=1024):
-    while True:
-        data_read = file_to_stream.read(chunk_size)
-        if not data_read:
-            break
-        yield data_read
+    Telegram wants every part but the last to be exactly part_size, while
+    network streams hand out chunks of whatever size arrived.
+    """
+    buffer = bytearray()
+    async for chunk in stream:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _iter_parts(source: Union[BinaryIO, AsyncIterable[bytes]],
+                      part_size: int) -> AsyncGenerator[bytes, None]:
+    if hasattr(source, "__aiter__"):
+        async for data in read_stream_parts(source, part_size):
+            yield data
+    else:
+        for data in read_parts(source, part_size):
+            yield data
 
 
 async def _internal_transfer_to_telegram(client: TelegramClient,
-                                         response: BinaryIO,
-                                         progress_callback: callable
+                                         response: Union[BinaryIO, AsyncIterable[bytes]],
+                                         name: str,
+                                         progress_callback: callable,
+                                         priority: int = 1,
+                                         size: Optional[int] = None
                                          ) -> Tuple[TypeInputFile, int]:
-    global filename
     file_id = helpers.generate_random_long()
-    file_size = os.path.getsize(response.name)
+    file_size = size if size is not None else os.path.getsize(response.name)
 
     hash_md5 = hashlib.md5()
-    uploader = ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(file_id, file_size)
-    buffer = bytearray()
-    for data in stream_file(response):
-        if progress_callback:
-            r = progress_callback(response.tell(), file_size)
-            if inspect.isawaitable(r):
-                await r
-        if not is_large:
-            hash_md5.update(data)
-        if len(buffer) == 0 and len(data) == part_size:
+    uploader = ParallelTransferrer(client, priority=priority)
+    sent = 0
+    try:
+        # Inside the try, so waiting for a turn in the pool can be
+        # cancelled without leaving the transfer registered.
+        part_size, part_count, is_large = await uploader.init_upload(file_id, file_size)
+        # Telethon serializes requests from bytes only, so each part is
+        # read straight into the bytes object that gets sent.
+        async for data in _iter_parts(response, part_size):
+            if sent + len(data) > file_size:
+                raise ValueError(f"{name} is larger than the {file_size} bytes announced")
+            if not is_large:
+                hash_md5.update(data)
             await uploader.upload(data)
-            continue
-        new_len = len(buffer) + len(data)
-        if new_len >= part_size:
-            cutoff = part_size - len(buffer)
-            buffer.extend(data[:cutoff])
-            await uploader.upload(bytes(buffer))
-            buffer.clear()
-            buffer.extend(data[cutoff:])
-        else:
-            buffer.extend(data)
-    if len(buffer) > 0:
-        await uploader.upload(bytes(buffer))
+            sent += len(data)
+            if progress_callback:
+                r = progress_callback(sent, file_size)
+                if inspect.isawaitable(r):
+                    await r
+        if sent < file_size:
+            raise ValueError(f"{name} ended after {sent} of {file_size} bytes")
+    except BaseException:
+        await uploader.abort_upload()
+        raise
     await uploader.finish_upload()
     if is_large:
-        return InputFileBig(file_id, part_count, filename), file_size
+        return InputFileBig(file_id, part_count, name), file_size
     else:
-        return InputFile(file_id, part_count, filename,
+        return InputFile(file_id, part_count, name,
                          hash_md5.hexdigest()), file_size
 
 
+def _part_writer(out: BinaryIO, size: int) -> Callable[[int, bytes], None]:
+    """Returns a function writing data at an offset of out.
+
+    Real files are preallocated and written with pwrite, so parts can land
+    in any order without seeking. Other streams fall back to seek + write.
+    """
+    try:
+        fd = out.fileno()
+    except (AttributeError, OSError):
+        fd = None
+    if fd is None or not hasattr(os, "pwrite"):
+        def write(offset: int, data: bytes) -> None:
+            out.seek(offset)
+            out.write(data)
+        return write
+
+    out.flush()
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+    def write(offset: int, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    return write
+
+
+class DownloadState:
+    """Which parts of a download are on disk already.
+
+    Kept in a sidecar file next to the output, so an interrupted download
+    can be resumed by fetching only the missing parts.
+    """
+
+    def __init__(self, path: str, file_id: int, size: int, part_size: int) -> None:
+        self.path = f"{path}.dlstate"
+        self.file_id = file_id
+        self.size = size
+        self.part_size = part_size
+        self.part_count = math.ceil(size / part_size)
+        self.bitmap = bytearray((self.part_count + 7) // 8)
+        self.checksums: Dict[int, int] = {}
+        self.saved_at = time.monotonic()
+
+    @classmethod
+    def load(cls, out: BinaryIO, file_id: int, size: int, part_size: int) -> "DownloadState":
+        """Returns the saved state of out when it matches the file, with
+        the part size it was started with, or an empty one.
+
+        Every part the record marks as done is read back from out and kept
+        only if its checksum still matches, so parts written after the last
+        save or changed since are simply fetched again. This reads the
+        downloaded part of out, so call it off the event loop.
+        """
+        state = cls(out.name, file_id, size, part_size)
+        if "w" in getattr(out, "mode", "w"):
+            return state
+        try:
+            with open(state.path) as f:
+                record = json.load(f)
+            saved = cls(out.name, file_id, size, int(record["part_size"]))
+            checksums = {int(index): int(crc) for index, crc in record["crc32"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, ZeroDivisionError):
+            return state
+        if (record.get("id"), record.get("size")) != (file_id, size):
+            return state
+        for index, crc in sorted(checksums.items()):
+            if not 0 <= index < saved.part_count:
+                continue
+            offset = index * saved.part_size
+            out.seek(offset)
+            data = out.read(min(saved.part_size, size - offset))
+            if zlib.crc32(data) == crc:
+                saved.mark(index, data)
+        return saved
+
+    @property
+    def started(self) -> bool:
+        return any(self.bitmap)
+
+    def has(self, index: int) -> bool:
+        return bool(self.bitmap[index >> 3] & (1 << (index & 7)))
+
+    def missing(self) -> List[int]:
+        return [index for index in range(self.part_count) if not self.has(index)]
+
+    def done_bytes(self) -> int:
+        return sum(min(self.part_size, self.size - index * self.part_size)
+                   for index in range(self.part_count) if self.has(index))
+
+    def mark(self, index: int, data: bytes) -> None:
+        self.bitmap[index >> 3] |= 1 << (index & 7)
+        self.checksums[index] = zlib.crc32(data)
+
+    def snapshot(self) -> dict:
+        """Returns the record of the parts marked so far, for save to
+        write while more parts are being marked."""
+        self.saved_at = time.monotonic()
+        return {
+            "id": self.file_id,
+            "size": self.size,
+            "part_size": self.part_size,
+            "crc32": dict(self.checksums),
+        }
+
+    def save(self, out: BinaryIO, record: dict) -> None:
+        """Writes record next to out. This fsyncs out, so call it off the
+        event loop."""
+        # The parts must be on disk before the record says they are.
+        out.flush()
+        os.fsync(out.fileno())
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
 async def download_file(client: TelegramClient,
                         location: TypeLocation,
                         out: BinaryIO,
-                        progress_callback: callable = None
+                        progress_callback: callable = None,
+                        refresh_location: Callable[[], Awaitable[TypeLocation]] = None,
+                        priority: int = 1
                         ) -> BinaryIO:
+    """Downloads location into out.
+
+    When out is a file on disk, the parts already downloaded are recorded
+    next to it, so calling this again with the same file opened without
+    truncating it (mode "r+b") only fetches what is missing.
+    """
     size = location.size
     dc_id, location = utils.get_input_location(location)
-    # We lock the transfers because telegram has connection count limits
-    downloader = ParallelTransferrer(client, dc_id)
-    downloaded = downloader.download(location, size)
-    async for x in downloaded:
-        out.write(x)
-        if progress_callback:
-            r = progress_callback(out.tell(), size)
-            if inspect.isawaitable(r):
-                await r
-
+    # Telegram limits connections, TRANSFERS shares them between transfers
+    downloader = ParallelTransferrer(client, dc_id, priority=priority)
+    _, part_size_kb = downloader.plan("download", size)
+    part_size = part_size_kb * 1024
+    state = None
+    loop = asyncio.get_running_loop()
+    file_id = getattr(location, "id", None)
+    if file_id is not None and isinstance(getattr(out, "name", None), str):
+        state = await loop.run_in_executor(
+            None, DownloadState.load, out, file_id, size, part_size)
+        # A resumed download keeps the part size it was started with.
+        part_size = state.part_size
+        if not state.started:
+            out.seek(0)
+            out.truncate()
+    write = _part_writer(out, size)
+    received = state.done_bytes() if state else 0
+    parts = state.missing() if state else None
+    try:
+        async for offset, data in downloader.download_parts(
+                location, size, part_size // 1024, parts=parts,
+                refresh_location=refresh_location):
+            write(offset, data)
+            received += len(data)
+            if state:
+                state.mark(offset // part_size, data)
+                if time.monotonic() - state.saved_at > 5:
+                    await loop.run_in_executor(
+                        None, state.save, out, state.snapshot())
+            if progress_callback:
+                r = progress_callback(received, size)
+                if inspect.isawaitable(r):
+                    await r
+    except BaseException:
+        if state:
+            await loop.run_in_executor(None, state.save, out, state.snapshot())
+        raise
+    if state:
+        state.remove()
+
+    out.seek(size)
     return out
 
 
 async def upload_file(client: TelegramClient,
-                      file: BinaryIO,
+                      file: Union[BinaryIO, AsyncIterable[bytes]],
                       name: str,
                       progress_callback: callable = None,
-
+                      priority: int = 1,
+                      size: Optional[int] = None
                       ) -> TypeInputFile:
-    global filename
-    filename = name
-    res = (await _internal_transfer_to_telegram(client, file, progress_callback))[0]
+    """Uploads file, an open file or an async iterable of bytes.
+
+    The size of a file is read from disk unless given. An async iterable,
+    e.g. an HTTP response body, is uploaded as it arrives and needs its
+    size up front, since Telegram takes the part count with every part.
+    """
+    if size is None and hasattr(file, "__aiter__"):
+        raise ValueError("the size of a stream must be known to upload it")
+    res = (await _internal_transfer_to_telegram(client, file, name, progress_callback,
+                                                priority, size))[0]
     return res
@@ -16,7 +16,8 @@
 
 from .chrome import chrome, options
 from .google_images_download import googleimagesdownload
-from .progress import progress
+from .jobs import as_job, check_cancelled, current_job, update_job
+from .progress import finish_report, progress, progress_bar, report
 
 from .tools import (
     humanbytes,
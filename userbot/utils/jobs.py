@@ -0,0 +1,220 @@
+# Copyright (C) 2019 The Raphielscape Company LLC.
+#
+# Licensed under the Raphielscape Public License, Version 1.c (the "License");
+# you may not use this file except in compliance with the License.
+#
+""" Job manager that queues, tracks and cancels the long-running transfers. """
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, List, Optional
+
+from .exceptions import CancelProcess
+
+# Transfers running at once, the others wait in line.
+MAX_RUNNING_JOBS = 2
+# Finished jobs still listed by .jobs.
+JOB_HISTORY = 10
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_current: ContextVar[Optional["Job"]] = ContextVar("job", default=None)
+
+
+class Job:
+    """
+       A transfer started by a command, from queued to finished
+    """
+
+    def __init__(self, manager: "JobManager", job_id: int, kind: str,
+                 name: str, event):
+        self.manager = manager
+        self.id = job_id
+        self.kind = kind
+        self.name = name
+        self.event = event
+        self.state = QUEUED
+        self.done = 0
+        self.total = 0
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+        self._token = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def speed(self) -> float:
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        speed = self.speed
+        if not self.total or not speed:
+            return None
+        return max(0.0, (self.total - self.done) / speed)
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        self.done = done
+        if total:
+            self.total = total
+
+    def cancel(self) -> None:
+        """ Marks the job cancelled. Running jobs stop at their next
+            check_cancelled(), queued ones right away. """
+        self.cancelled = True
+        if self.state == QUEUED and self.task is not None:
+            self.task.cancel()
+
+    async def __aenter__(self) -> "Job":
+        self.task = asyncio.current_task()
+        self._token = _current.set(self)
+        try:
+            await self.manager._start(self)
+        except asyncio.CancelledError:
+            if not self.cancelled:
+                raise
+            self._finish(CANCELLED)
+            _current.reset(self._token)
+            raise CancelProcess
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        if exc_type is None:
+            self._finish(DONE)
+        elif self.cancelled or issubclass(exc_type, CancelProcess):
+            self._finish(CANCELLED)
+        else:
+            self._finish(FAILED)
+
+    def _finish(self, state: str) -> None:
+        self.state = state
+        self.finished = time.monotonic()
+        self.manager._end(self)
+
+
+class JobManager:
+    """
+       Runs at most max_running jobs at once, in the order they came
+    """
+
+    def __init__(self, max_running: int, history: int):
+        self.max_running = max_running
+        self.history = history
+        self.jobs: "OrderedDict[int, Job]" = OrderedDict()
+        self.waiting: List[Job] = []
+        self.running = 0
+        self.next_id = 1
+        self.changed: Optional[asyncio.Condition] = None
+
+    def submit(self, event, kind: str, name: str) -> Job:
+        job = Job(self, self.next_id, kind, name, event)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        return job
+
+    async def _start(self, job: Job) -> None:
+        if self.changed is None:
+            self.changed = asyncio.Condition()
+        self.waiting.append(job)
+        try:
+            async with self.changed:
+                await self.changed.wait_for(
+                    lambda: self.running < self.max_running
+                    and self.waiting[0] is job)
+        finally:
+            self.waiting.remove(job)
+        self.running += 1
+        job.state = RUNNING
+        job.started = time.monotonic()
+        if self.waiting and self.running < self.max_running:
+            async with self.changed:
+                self.changed.notify_all()
+
+    def _end(self, job: Job) -> None:
+        if job.started is not None:
+            self.running -= 1
+        finished = [j for j in self.jobs.values() if j.finished is not None]
+        for old in finished[:-self.history]:
+            del self.jobs[old.id]
+        if self.changed is not None and self.waiting:
+            asyncio.get_event_loop().create_task(self._wake())
+
+    async def _wake(self) -> None:
+        async with self.changed:
+            self.changed.notify_all()
+
+    def position(self, job: Job) -> int:
+        return self.waiting.index(job) + 1 if job in self.waiting else 0
+
+    def cancel(self, job_id: int) -> Optional[Job]:
+        job = self.jobs.get(job_id)
+        if job is None or job.finished is not None:
+            return None
+        job.cancel()
+        return job
+
+
+JOBS = JobManager(max_running=MAX_RUNNING_JOBS, history=JOB_HISTORY)
+
+
+def current_job() -> Optional[Job]:
+    """ Returns the job the calling code runs in, if any. """
+    return _current.get()
+
+
+def check_cancelled() -> None:
+    """ Raises CancelProcess when the current job was cancelled. """
+    job = _current.get()
+    if job is not None and job.cancelled:
+        raise CancelProcess
+
+
+def update_job(done: int, total: Optional[int] = None) -> None:
+    """ Records the progress of the current job, for .jobs. """
+    job = _current.get()
+    if job is not None:
+        job.update(done, total)
+
+
+def as_job(kind: str) -> Callable:
+    """ Runs a command handler as a job of kind, queued behind the running
+        ones. A cancelled job that the handler doesn't handle itself ends
+        with its status message saying so. """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(event):
+            from .progress import finish_report
+
+            job = JOBS.submit(event, kind, event.raw_text[:48])
+            if JOBS.running >= JOBS.max_running or JOBS.waiting:
+                await event.edit(
+                    f"`Queued as job {job.id}, "
+                    f"{len(JOBS.waiting)} more waiting before it...`"
+                )
+            try:
+                async with job:
+                    return await func(event)
+            except CancelProcess:
+                await finish_report(
+                    event,
+                    f"`[JOB {job.id} - CANCELLED]`\n\n"
+                    "`Status` : **OK** - received signal cancelled.",
+                )
+        return wrapper
+    return decorator
@@ -15,51 +15,175 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import time
+import asyncio
+import logging
 import math
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
 
-from telethon.errors.rpcerrorlist import MessageNotModifiedError
+from telethon.errors.rpcerrorlist import (
+    FloodWaitError,
+    MessageNotModifiedError,
+)
 
 from .tools import humanbytes, time_formatter
-from .exceptions import CancelProcess
+from .jobs import check_cancelled, update_job
+
+log = logging.getLogger(__name__)
+
+# Seconds between two edits of the same status message.
+EDIT_INTERVAL = 5
+
+
+class StatusMessage:
+    """
+       A status message and the latest text waiting to be shown in it
+    """
+
+    def __init__(self, event):
+        self.event = event
+        self.pending: Optional[Union[str, Callable[[], str]]] = None
+        self.shown: Optional[str] = None
+        self.editor: Optional[asyncio.Task] = None
+        # Held while an edit is in flight.
+        self.lock = asyncio.Lock()
+        self.next_edit = 0.0
+
+    def take(self) -> Optional[str]:
+        text, self.pending = self.pending, None
+        return text() if callable(text) else text
+
+
+class ProgressReporter:
+    """
+       Edits status messages on behalf of every transfer.
+
+       Reports only replace the text waiting for a message, so however
+       often they come there is at most one edit in flight per message and
+       one every interval seconds. A FloodWait on any edit holds back all
+       of them for as long as Telegram asks.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.messages: Dict[Tuple[int, int], StatusMessage] = {}
+        self.blocked_until = 0.0
+
+    def report(self, event, text: Union[str, Callable[[], str]]) -> None:
+        key = (event.chat_id, event.id)
+        message = self.messages.get(key)
+        if message is None:
+            message = self.messages[key] = StatusMessage(event)
+        message.pending = text
+        if message.editor is None:
+            message.editor = asyncio.get_event_loop().create_task(
+                self._edit_loop(key, message))
+
+    async def _wait(self, message: StatusMessage) -> None:
+        while True:
+            delay = max(message.next_edit, self.blocked_until) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _edit(self, message: StatusMessage, text: str) -> bool:
+        """ Returns False when the message can't be edited anymore. """
+        while True:
+            await self._wait(message)
+            message.next_edit = time.monotonic() + self.interval
+            try:
+                async with message.lock:
+                    if text != message.shown:
+                        await message.event.edit(text)
+                        message.shown = text
+                return True
+            except MessageNotModifiedError:
+                message.shown = text
+                return True
+            except FloodWaitError as e:
+                self.blocked_until = time.monotonic() + e.seconds
+                if message.pending is not None:
+                    # Retry with what was reported meanwhile.
+                    text = message.take()
+            except Exception as e:
+                log.info(f"Stopped reporting progress: {e}")
+                return False
+
+    async def _edit_loop(self, key, message: StatusMessage) -> None:
+        try:
+            while message.pending is not None:
+                if not await self._edit(message, message.take()):
+                    break
+                # Anything reported meanwhile waits for the next turn.
+                await self._wait(message)
+        finally:
+            message.editor = None
+            if self.messages.get(key) is message:
+                del self.messages[key]
+
+    async def finish(self, event, text: Optional[str] = None) -> None:
+        """ Drops the text still waiting for event and waits for the edit in
+            flight, so it can't land over what the caller edits next. """
+        message = self.messages.pop((event.chat_id, event.id), None)
+        if message is None:
+            message = StatusMessage(event)
+        message.pending = None
+        async with message.lock:
+            if message.editor is not None:
+                message.editor.cancel()
+        if text is not None:
+            message.next_edit = 0.0
+            await self._edit(message, text)
+
+
+REPORTER = ProgressReporter(interval=EDIT_INTERVAL)
+
+
+def report(event, text: Union[str, Callable[[], str]]) -> None:
+    """ Shows text in event soon, replacing any text still waiting. text
+        may be a function, called only when the edit is actually made. """
+    REPORTER.report(event, text)
+
+
+async def finish_report(event, text: Optional[str] = None) -> None:
+    """ Stops reporting to event, then edits it to text if given. """
+    await REPORTER.finish(event, text)
+
+
+def progress_bar(percentage: float) -> str:
+    filled = min(10, max(0, math.floor(percentage / 10)))
+    return "●" * filled + "○" * (10 - filled)
+
+
+def _progress_text(current, total, now, start, prog_type, file_name=None):
+    diff = now - start
+    percentage = current * 100 / total
+    speed = current / diff if diff else 0
+    elapsed_time = round(diff)
+    eta = round((total - current) / speed) if speed else 0
+    if 'upload' in prog_type.lower():
+        status = 'Uploading'
+    elif 'download' in prog_type.lower():
+        status = 'Downloading'
+    else:
+        status = 'Unknown'
+    progress_str = "`{0}` | [{1}] `{2}%`".format(
+        status, progress_bar(percentage), round(percentage, 2))
+    tmp = (
+        f"{progress_str}\n"
+        f"`{humanbytes(current)} of {humanbytes(total)}"
+        f" @ {humanbytes(speed)}`\n"
+        f"`ETA` -> {time_formatter(eta)}\n"
+        f"`Duration` -> {time_formatter(elapsed_time)}"
+    )
+    return f"`{prog_type}`\n\n`Status`\n{tmp}"
 
 
 async def progress(
-    current, total, event, start, prog_type,
-    file_name=None, is_cancelled=False
+    current, total, event, start, prog_type, file_name=None
 ):
+    check_cancelled()
+    update_job(current, total)
     now = time.time()
-    diff = now - start
-    if is_cancelled is True:
-        raise CancelProcess
-
-    if round(diff % 15.00) == 0 or current == total:
-        percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff)
-        eta = round((total - current) / speed)
-        if 'upload' in prog_type.lower():
-            status = 'Uploading'
-        elif 'download' in prog_type.lower():
-            status = 'Downloading'
-        else:
-            status = 'Unknown'
-        progress_str = "`{0}` | [{1}{2}] `{3}%`".format(
-            status,
-            ''.join(["●" for i in range(
-                    math.floor(percentage / 10))]),
-            ''.join(["○" for i in range(
-                    10 - math.floor(percentage / 10))]),
-            round(percentage, 2))
-        tmp = (
-            f"{progress_str}\n"
-            f"`{humanbytes(current)} of {humanbytes(total)}"
-            f" @ {humanbytes(speed)}`\n"
-            f"`ETA` -> {time_formatter(eta)}\n"
-            f"`Duration` -> {time_formatter(elapsed_time)}"
-        )
-        try:
-            await event.edit(f"`{prog_type}`\n\n"
-                             f"`Status`\n{tmp}")
-        except MessageNotModifiedError:
-            pass
+    report(event, lambda: _progress_text(
+        current, total, now, start, prog_type, file_name))